@@ -0,0 +1,324 @@
+"""Local OpenAI-compatible chat completions server for benchmarks.
+
+The server answers `POST /v1/chat/completions`, streamed or not, after a
+configurable latency. Streams are cut into chunks sent at a fixed cadence and
+end with a usage chunk when `include_usage` is asked for. A share of the
+requests can be failed with an error status and `retry-after`, to exercise the
+retry path. Replies come from a `responder` so each command gets an answer it
+accepts, e.g. a link for `goto` or a `propose_command` tool call for `run`.
+
+A minimal Batch API is served as well: `POST /v1/files` stores an uploaded
+input file, `POST /v1/batches` answers every request line of it at once and
+`GET /v1/batches/{id}` and `GET /v1/files/{id}/content` return the finished job
+and its output and error files.
+"""
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+Responder = Callable[[Dict], Dict]
+
+FILE_CONTENT_PATH = re.compile(r".*/files/([^/]+)/content$")
+BATCH_PATH = re.compile(r".*/batches/([^/]+)$")
+
+
+def default_responder(body: Dict) -> Dict:
+    """Reply shaped after the command that sent the request, recognized by its system prompt."""
+    system = " ".join(
+        message["content"]
+        for message in body.get("messages", [])
+        if message.get("role") == "system" and isinstance(message.get("content"), str)
+    )
+    if "generates a single link" in system:
+        return {"content": "https://example.com/bench"}
+    if "emoji" in system:
+        return {"content": "😊"}
+    tool_names = [tool.get("function", {}).get("name") for tool in body.get("tools") or []]
+    if "propose_command" in tool_names:
+        return {
+            "tool_calls": [
+                {
+                    "id": "call_bench",
+                    "type": "function",
+                    "function": {"name": "propose_command", "arguments": json.dumps({"command": "echo bench"})},
+                }
+            ]
+        }
+    if "shell function" in system:
+        return {"content": "echo bench"}
+    return {"content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4}
+
+
+def completion_usage(body: Dict, content: str | None) -> Dict:
+    usage = {
+        "prompt_tokens": sum(len(str(m.get("content") or "")) // 4 + 1 for m in body.get("messages", [])),
+        "completion_tokens": max(1, len((content or "").split())),
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return usage
+
+
+def completion(body: Dict, reply: Dict) -> Dict:
+    """Non-streamed chat completion for `reply`."""
+    message = {"role": "assistant", "content": reply.get("content")}
+    if reply.get("tool_calls"):
+        message["tool_calls"] = reply["tool_calls"]
+    return {
+        "id": "chatcmpl-bench",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": completion_usage(body, reply.get("content")),
+    }
+
+
+@dataclass
+class StubSettings:
+    latency: float = 0.05
+    # Seconds between streamed chunks and the number of words per chunk
+    chunk_interval: float = 0.005
+    words_per_chunk: int = 2
+    error_rate: float = 0.0
+    # Fail the first requests outright, for deterministic retry runs
+    fail_first: int = 0
+    error_status: int = 503
+    retry_after: float | None = 0.05
+    seed: int = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive like real gateways, so clients reuse pooled connections
+    protocol_version = "HTTP/1.1"
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, payload: Dict, headers: Dict | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _bytes(self, status: int, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self) -> None:
+        self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if match := FILE_CONTENT_PATH.match(path):
+            content = self.server.files.get(match.group(1))
+            if content is None:
+                self._not_found()
+            else:
+                self._bytes(200, content)
+        elif match := BATCH_PATH.match(path):
+            batch = self.server.batches.get(match.group(1))
+            if batch is None:
+                self._not_found()
+            else:
+                self._json(200, batch)
+        else:
+            self._not_found()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length)
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/chat/completions"):
+            self._chat_completion(json.loads(data or b"{}"))
+        elif path.endswith("/files"):
+            self._json(200, self.server.upload(self.headers.get("Content-Type", ""), data))
+        elif path.endswith("/batches"):
+            batch = self.server.create_batch(json.loads(data or b"{}"))
+            if batch is None:
+                self._not_found()
+            else:
+                self._json(200, batch)
+        else:
+            self._not_found()
+
+    def _chat_completion(self, body: Dict) -> None:
+        stub = self.server
+        settings = stub.settings
+        stub.count("requests")
+        time.sleep(settings.latency)
+        if stub.should_fail():
+            stub.count("errors")
+            headers = {"retry-after": str(settings.retry_after)} if settings.retry_after is not None else {}
+            self._json(settings.error_status, {"error": {"message": "injected error"}}, headers)
+            return
+
+        reply = stub.responder(body)
+        if not body.get("stream"):
+            self._json(200, completion(body, reply))
+            return
+        content = reply.get("content")
+        tool_calls = reply.get("tool_calls")
+        usage = completion_usage(body, content)
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model")}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # Streams have no length, the end of the body is the end of the connection
+        self.send_header("Connection", "close")
+        self.close_connection = True
+        self.end_headers()
+
+        def send(delta=None, extra=None):
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}] if delta is not None else [],
+                **(extra or {}),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        if tool_calls:
+            send({"role": "assistant", "tool_calls": [{"index": i, **call} for i, call in enumerate(tool_calls)]})
+        else:
+            words = (content or "").split(" ")
+            for start in range(0, len(words), settings.words_per_chunk):
+                text = " ".join(words[start:start + settings.words_per_chunk])
+                send({"role": "assistant", "content": text + " "})
+                time.sleep(settings.chunk_interval)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(extra={"usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: StubSettings | None = None, responder: Responder = default_responder,
+                 port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.settings = settings or StubSettings()
+        self.responder = responder
+        self.counts = {"requests": 0, "errors": 0}
+        # Uploaded and generated files by id, and finished batch jobs by id
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict] = {}
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            if self.counts["requests"] <= self.settings.fail_first:
+                return True
+            return self._random.random() < self.settings.error_rate
+
+    def _store_file(self, content: bytes, filename: str, purpose: str) -> Dict:
+        with self._lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def upload(self, content_type: str, data: bytes) -> Dict:
+        """Store a multipart `files.create` upload."""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + data
+        )
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        filename, content = fields.get("file", ("input.jsonl", b""))
+        purpose = (fields.get("purpose", (None, b"batch"))[1] or b"batch").decode("utf-8")
+        return self._store_file(content, filename or "input.jsonl", purpose)
+
+    def create_batch(self, body: Dict) -> Dict | None:
+        """Answer every request line of the input file and return the completed job."""
+        input_file = self.files.get(body.get("input_file_id"))
+        if input_file is None:
+            return None
+        output_lines, error_lines = [], []
+        for line in input_file.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self.count("requests")
+            if self.should_fail():
+                self.count("errors")
+                status, payload = self.settings.error_status, {"error": {"message": "injected error"}}
+            else:
+                status, payload = 200, completion(request["body"], self.responder(request["body"]))
+            result = {"id": f"batch-req-{request['custom_id']}", "custom_id": request["custom_id"],
+                      "response": {"status_code": status, "body": payload}, "error": None}
+            (output_lines if status == 200 else error_lines).append(json.dumps(result))
+
+        def result_file(lines):
+            if not lines:
+                return None
+            return self._store_file(("\n".join(lines) + "\n").encode("utf-8"), "results.jsonl",
+                                    "batch_output")["id"]
+
+        now = int(time.time())
+        batch = {
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "completed",
+            "output_file_id": result_file(output_lines),
+            "error_file_id": result_file(error_lines),
+            "created_at": now,
+            "completed_at": now,
+            "metadata": body.get("metadata"),
+            "request_counts": {
+                "total": len(output_lines) + len(error_lines),
+                "completed": len(output_lines),
+                "failed": len(error_lines),
+            },
+        }
+        with self._lock:
+            batch["id"] = f"batch-{len(self.batches) + 1}"
+            self.batches[batch["id"]] = batch
+        return batch
+
+    def start(self) -> StubServer:
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> StubServer:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,274 @@
+"""Benchmarks of the command paths and of `Conversation` as history grows.
+
+Command benchmarks run `main.py` end to end in a subprocess against the stub
+server, with a throwaway HOME holding a config that points at it, and report
+latency, CPU time and peak memory per command. Conversation benchmarks run in
+process and time token estimation, journaling, saving and request building
+for histories of growing length.
+
+Results are a JSON document with one entry per benchmark, which can be saved
+as a baseline and compared against later runs to gate regressions.
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from bench.stub_server import StubServer, StubSettings
+from llm.metrics import percentile
+
+RESULTS_VERSION = 1
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+DEFAULT_HISTORY_SIZES = (100, 1000, 5000)
+# Benchmark values compared against the baseline, lower is better for all of them.
+# Changes smaller than the slack are noise on sub-millisecond timings and tiny heaps.
+GATED_VALUES = {"p50": 0.001, "cpu": 0.001, "max_rss_mb": 1.0, "peak_mb": 0.1}
+
+
+@dataclass(frozen=True)
+class CommandCase:
+    name: str
+    args: List[str]
+    stdin: str = ""
+
+
+COMMAND_CASES = [
+    CommandCase("chat", ["chat"], "Tell me something\n/q\n"),
+    CommandCase("complete", ["complete", "-i", "Say something"]),
+    # The proposed command is aborted with "~", nothing is executed
+    CommandCase("run", ["run", "--no-fast-path", "-i", "list the files here"], "~\n/q\n"),
+    CommandCase("goto", ["goto", "-i", "bench docs"]),
+    CommandCase("emoji", ["emoji", "-i", "happy face"]),
+    CommandCase("enhance", ["enhance", "-i", "more formal", "-t", "hey, can u check this"]),
+]
+
+
+def _summary(values: List[float]) -> Dict:
+    return {
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def _write_home(home: Path, base_url: str) -> None:
+    smart = home / ".smart"
+    smart.mkdir(parents=True, exist_ok=True)
+    (smart / "config").write_text(
+        f"model=bench-model\nclient=openai\nbase_url={base_url}\nllm_token=bench\n"
+        f"retry_base_delay=0.01\nretry_max_delay=0.2\n",
+        encoding="utf-8",
+    )
+    (home / ".zshrc").touch()
+
+
+def run_command(case: CommandCase, home: Path) -> Dict:
+    """One end-to-end run of `case`, with the wall time and rusage of its process."""
+    env = {
+        **os.environ,
+        "HOME": str(home),
+        # goto opens the link, make that a no-op
+        "BROWSER": "true",
+        "SMART_USE_DAEMON": "0",
+        "SMART_SPECULATE": "0",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(MAIN), "--no-cache", *case.args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+        cwd=home,
+    )
+    process.stdin.write(case.stdin.encode("utf-8"))
+    process.stdin.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    stderr = process.stderr.read().decode("utf-8", "replace")
+    process.stderr.close()
+    # The process was reaped by wait4, tell Popen so it does not wait for it again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {
+        "seconds": elapsed,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": max_rss,
+        "returncode": process.returncode,
+        "stderr": stderr[-2000:],
+    }
+
+
+def bench_commands(cases: Iterable[CommandCase], settings: StubSettings, iterations: int) -> List[Dict]:
+    results = []
+    with StubServer(settings) as server, tempfile.TemporaryDirectory(prefix="smart-bench-") as directory:
+        home = Path(directory)
+        _write_home(home, server.base_url)
+        for case in cases:
+            requests, errors = server.counts["requests"], server.counts["errors"]
+            runs = [run_command(case, home) for _ in range(iterations)]
+            failed = [run for run in runs if run["returncode"] != 0]
+            result = {
+                "name": f"command.{case.name}",
+                "unit": "seconds",
+                "iterations": iterations,
+                "failures": len(failed),
+                **_summary([run["seconds"] for run in runs]),
+                "cpu": statistics.fmean(run["cpu"] for run in runs),
+                "max_rss_mb": max(run["max_rss_mb"] for run in runs),
+                "stub_requests": server.counts["requests"] - requests,
+                "stub_errors": server.counts["errors"] - errors,
+            }
+            if failed:
+                lines = failed[-1]["stderr"].strip().splitlines()
+                result["error"] = lines[-1] if lines else f"exit {failed[-1]['returncode']}"
+            results.append(result)
+    return results
+
+
+def _timed(fn, repeat: int = 3) -> Dict:
+    values = []
+    cpu = []
+    for _ in range(repeat):
+        started, cpu_started = time.perf_counter(), time.process_time()
+        fn()
+        values.append(time.perf_counter() - started)
+        cpu.append(time.process_time() - cpu_started)
+    return {"unit": "seconds", "iterations": repeat, **_summary(values), "cpu": statistics.fmean(cpu)}
+
+
+def _history(size: int) -> List[Dict]:
+    text = "Please look at the logs of the build and tell me what failed, with the file names. " * 3
+    return [
+        {"role": "user" if index % 2 == 0 else "assistant", "content": f"{index}: {text}"}
+        for index in range(size)
+    ]
+
+
+def bench_conversation(sizes: Iterable[int] = DEFAULT_HISTORY_SIZES) -> List[Dict]:
+    from llm.context import ContextPolicy
+    from llm.conversation import Conversation, count_message_tokens, get_encoding
+    from llm.journal import ConversationJournal, read_journal
+
+    encoder = "tiktoken" if get_encoding() is not None else "approximate"
+    results = []
+    with tempfile.TemporaryDirectory(prefix="smart-bench-") as directory:
+        directory = Path(directory)
+        for size in sizes:
+            messages = _history(size)
+
+            def build():
+                conversation = Conversation(model="bench-model")
+                conversation.context_policy = None
+                conversation.load_messages(messages)
+                return conversation
+
+            def count():
+                return sum(count_message_tokens(message) for message in messages)
+
+            conversation = build()
+
+            def journal():
+                journal_path = directory / f"journal-{size}.jsonl"
+                journal_path.unlink(missing_ok=True)
+                conversation.journal = None
+                conversation.attach_journal(ConversationJournal(journal_path))
+                conversation.add_user_message("one more turn")
+                conversation.journal.flush()
+                conversation.journal.close()
+                conversation.journal = None
+
+            def replay():
+                read_journal(directory / f"journal-{size}.jsonl")
+
+            def save():
+                with open(directory / f"save-{size}.json", "w", encoding="utf-8") as f:
+                    json.dump(conversation.to_dict(), f, ensure_ascii=False, indent=4)
+
+            def request():
+                conversation.context_policy = ContextPolicy(max_tokens=8000)
+                conversation.request_messages()
+                conversation.context_policy = None
+
+            tracemalloc.start()
+            build()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({"name": f"conversation.memory.{size}", "messages": size, "unit": "megabytes",
+                            "peak_mb": peak / (1024 * 1024)})
+
+            for name, fn in [
+                ("load", build),
+                ("count_tokens", count),
+                ("journal", journal),
+                ("replay_journal", replay),
+                ("save", save),
+                ("request_messages", request),
+            ]:
+                results.append({"name": f"conversation.{name}.{size}", "messages": size, "encoder": encoder,
+                                **_timed(fn)})
+    return results
+
+
+def run_suite(
+        commands: Iterable[str] | None = None,
+        settings: StubSettings | None = None,
+        iterations: int = 3,
+        history_sizes: Iterable[int] = DEFAULT_HISTORY_SIZES,
+        include_commands: bool = True,
+) -> Dict:
+    """Run the selected command benchmarks, all when `commands` is empty, and the conversation benchmarks."""
+    settings = settings or StubSettings()
+    selected = [
+        case for case in COMMAND_CASES if include_commands and (not commands or case.name in commands)
+    ]
+    results = bench_commands(selected, settings, iterations) if selected else []
+    if history_sizes:
+        results.extend(bench_conversation(history_sizes))
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stub": asdict(settings),
+        "results": results,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Benchmark values that got worse than `baseline` by more than `tolerance` (0.2 = 20%)."""
+    previous = {result["name"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results["results"]:
+        before = previous.get(result["name"])
+        if not before:
+            continue
+        for key, slack in GATED_VALUES.items():
+            if key not in result or not before.get(key):
+                continue
+            change = result[key] / before[key] - 1
+            if change > tolerance and result[key] - before[key] > slack:
+                regressions.append(
+                    {"name": result["name"], "value": key, "baseline": before[key], "current": result[key],
+                     "change": change}
+                )
+        if result.get("failures") and not before.get("failures"):
+            regressions.append({"name": result["name"], "value": "failures", "baseline": 0,
+                                "current": result["failures"], "change": None})
+    return regressions
+
+
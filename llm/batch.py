@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, TextIO
+
+from llm.client import AsyncClient, get_async_underlying_client
+from llm.conversation import Conversation
+from llm.prompts import (
+    build_emoji_generation_prompt,
+    build_generic_prompt,
+    build_text_enhancement_prompt,
+)
+from llm.ratelimit import RateLimiter
+from llm.transport import aclose_http_clients
+from utils.config import DEFAULT_PROFILE, read_config
+
+logger = logging.getLogger(__name__)
+
+BATCH_COMMANDS = ("complete", "enhance", "emoji")
+DEFAULT_BATCH_CONCURRENCY = 8
+ORDER_INPUT = "input"
+ORDER_COMPLETION = "completion"
+
+
+@dataclass
+class BatchRecord:
+    """One line of a batch input file."""
+
+    index: int
+    command: str = "complete"
+    instruction: List[str] = field(default_factory=list)
+    text: str | None = None
+    profile: str = DEFAULT_PROFILE
+    id: str | None = None
+    # Set when the line could not be read, the record is reported without a request
+    error: str | None = None
+
+    @classmethod
+    def from_dict(cls, index: int, data: Dict) -> BatchRecord:
+        command = data.get("command") or "complete"
+        if command not in BATCH_COMMANDS:
+            raise ValueError(f"Unsupported batch command: {command}")
+        instruction = data.get("instruction") or []
+        if isinstance(instruction, str):
+            instruction = [instruction]
+        return cls(
+            index=index,
+            command=command,
+            instruction=list(instruction),
+            text=data.get("text"),
+            profile=data.get("profile") or DEFAULT_PROFILE,
+            id=data.get("id"),
+        )
+
+
+def read_records(lines: Iterable[str]) -> Iterator[BatchRecord]:
+    """Records of a JSONL stream, numbered by line so results can be matched back.
+
+    A line that is not valid JSON or asks for an unsupported command becomes a
+    record carrying the error, so it fails on its own instead of the whole batch.
+    """
+    for index, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        data = None
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Batch record is not a JSON object")
+            record = BatchRecord.from_dict(index, data)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Batch record {index} is invalid: {e}")
+            record_id = data.get("id") if isinstance(data, dict) else None
+            record = BatchRecord(index=index, id=record_id, error=f"Invalid batch record: {e}")
+        yield record
+
+
+def build_record_conversation(
+        record: BatchRecord,
+        model: str | None = None,
+        system_prompts: List[str] | None = None,
+) -> Conversation:
+    """The conversation the interactive command would send for `record`."""
+    conversation = Conversation(model=model)
+    if record.command == "emoji":
+        conversation.add_system_message(system_prompts or build_emoji_generation_prompt())
+        user_input = record.text or "\n\n".join(record.instruction)
+        conversation.add_user_message(f"Here is the user input: {user_input}")
+    elif record.command == "enhance":
+        conversation.add_system_message(system_prompts or build_text_enhancement_prompt())
+        for instruction in record.instruction:
+            conversation.add_user_message(f"Here is the user instruction:\n\n{instruction}")
+        conversation.add_user_message(f"Here is the user input: \n\n{record.text or ''}")
+    else:
+        conversation.add_system_message(system_prompts or build_generic_prompt())
+        for instruction in record.instruction:
+            conversation.add_user_message(instruction)
+        if record.text:
+            conversation.add_user_message(record.text)
+    return conversation
+
+
+def read_checkpoint(output: TextIO) -> set:
+    """Indexes of the records that already have a successful result in `output`."""
+    done = set()
+    for line in output:
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue  # A line cut short when the previous run was interrupted
+        if result.get("error") is None and "index" in result:
+            done.add(result["index"])
+    return done
+
+
+class _Profile:
+    def __init__(self, name: str, rps: float | None, concurrency: int):
+        self.name = name
+        self.config = read_config().for_profile(name)
+        self.client = AsyncClient(client=get_async_underlying_client(self.config), profile=name)
+        rate = rps if rps is not None else self.config.get("batch_rps")
+        self.rate_limiter = RateLimiter(float(rate) if rate else None, burst=concurrency)
+
+
+class BatchRunner:
+    """Runs batch records on one event loop with bounded concurrency.
+
+    At most `concurrency` requests are in flight across all profiles and each
+    profile has its own rate limiter, so records for different gateways do not
+    hold each other back.
+    """
+
+    def __init__(
+            self,
+            concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+            rps: float | None = None,
+            order: str = ORDER_INPUT,
+            system_prompts: List[str] | None = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.rps = rps
+        self.order = order
+        self.system_prompts = system_prompts
+        self._profiles: Dict[str, _Profile] = {}
+
+    def _profile(self, name: str) -> _Profile:
+        if name not in self._profiles:
+            self._profiles[name] = _Profile(name, self.rps, self.concurrency)
+        return self._profiles[name]
+
+    async def _run_record(self, record: BatchRecord, semaphore: asyncio.Semaphore) -> Dict:
+        result = {"index": record.index, "id": record.id, "command": record.command,
+                  "profile": record.profile, "output": None, "error": record.error}
+        if record.error:
+            return result
+        async with semaphore:
+            try:
+                profile = self._profile(record.profile)
+                await profile.rate_limiter.acquire_async()
+                conversation = build_record_conversation(
+                    record, model=profile.config.model, system_prompts=self.system_prompts
+                )
+                response = await profile.client.converse(conversation)
+                result["output"] = response.choices[0].message.content
+                result["tokens"] = conversation.get_token_usage()
+            except Exception as e:
+                logger.warning(f"Batch record {record.index} failed: {e}")
+                result["error"] = str(e)
+        return result
+
+    async def run(
+            self,
+            records: Iterable[BatchRecord],
+            emit: Callable[[Dict], None],
+            skip: set | None = None,
+    ) -> Dict[str, int]:
+        """Run `records`, passing each result to `emit` in the configured order."""
+        skip = skip or set()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = {}
+        order = []
+        position = 0
+        buffered = {}
+        counts = {"ok": 0, "failed": 0, "skipped": 0}
+        try:
+            for record in records:
+                if record.index in skip:
+                    counts["skipped"] += 1
+                    continue
+                # Tasks are created as records are read, the semaphore bounds the requests
+                pending[asyncio.ensure_future(self._run_record(record, semaphore))] = record.index
+                order.append(record.index)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.pop(task)
+                    result = task.result()
+                    counts["failed" if result["error"] else "ok"] += 1
+                    if self.order == ORDER_COMPLETION:
+                        emit(result)
+                    else:
+                        buffered[result["index"]] = result
+                # In input order a result waits until every earlier record is written
+                while position < len(order) and order[position] in buffered:
+                    emit(buffered.pop(order[position]))
+                    position += 1
+        finally:
+            for task in pending:
+                task.cancel()
+            await aclose_http_clients()
+        return counts
+
+
+def run_batch(
+        lines: Iterable[str],
+        output: TextIO,
+        concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+        rps: float | None = None,
+        order: str = ORDER_INPUT,
+        skip: set | None = None,
+        system_prompts: List[str] | None = None,
+) -> Dict[str, int]:
+    """Run a JSONL batch and write one JSON result per line to `output`."""
+
+    def emit(result):
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()  # Each line written is a checkpoint for --resume
+
+    runner = BatchRunner(concurrency, rps, order, system_prompts)
+    return asyncio.run(runner.run(read_records(lines), emit, skip))
+
+
+def get_batch_concurrency() -> int:
+    return int(read_config().get("batch_concurrency", DEFAULT_BATCH_CONCURRENCY))
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+from llm.batch import BatchRecord, build_record_conversation
+from llm.client import get_underlying_client
+from llm.scheduler import get_scheduler
+from utils.config import read_config
+
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_INTERVAL = 30.0
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Called with (profile, batch status, completed requests, total requests) while polling
+StatusCallback = Callable[[str, str, int, int], None]
+
+
+def custom_id(record: BatchRecord) -> str:
+    return f"record-{record.index}"
+
+
+def render_requests(
+        records: Iterable[BatchRecord],
+        system_prompts: List[str] | None = None,
+) -> Dict[str, List[Dict]]:
+    """Batch API request lines for `records`, grouped by profile.
+
+    A job runs against one account and gateway, so each profile becomes its
+    own job.
+    """
+    config = read_config()
+    requests = {}
+    for record in records:
+        profile_config = config.for_profile(record.profile)
+        conversation = build_record_conversation(
+            record, model=profile_config.model, system_prompts=system_prompts
+        )
+        requests.setdefault(record.profile, []).append(
+            {
+                "custom_id": custom_id(record),
+                "method": "POST",
+                "url": CHAT_COMPLETIONS_ENDPOINT,
+                "body": {"model": conversation.model, "messages": conversation.request_messages()},
+            }
+        )
+    return requests
+
+
+def write_input_file(requests: List[Dict], path: Path) -> Path:
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+
+def submit_job(client, input_path: Path, description: str = "") -> str:
+    """Upload a Batch API input file and start the job, returning the batch id."""
+    with open(input_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=CHAT_COMPLETIONS_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata={"description": description} if description else None,
+    )
+    return batch.id
+
+
+def wait_for_job(client, batch_id: str, poll_interval: float, on_status=None, scheduler=None):
+    while True:
+        if scheduler:
+            # A transient error while polling should not lose a job that is still running
+            batch = scheduler.call(lambda: client.batches.retrieve(batch_id))
+        else:
+            batch = client.batches.retrieve(batch_id)
+        if on_status:
+            counts = batch.request_counts
+            on_status(batch.status, counts.completed if counts else 0, counts.total if counts else 0)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def _read_lines(client, file_id: str | None) -> List[Dict]:
+    if not file_id:
+        return []
+    content = client.files.content(file_id).text
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def collect_results(client, batch) -> Dict[str, Dict]:
+    """Output and error lines of a finished job, keyed by custom_id."""
+    results = {}
+    for line in _read_lines(client, batch.output_file_id) + _read_lines(client, batch.error_file_id):
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        error = line.get("error") or body.get("error")
+        if not error and response.get("status_code", 200) >= 400:
+            error = {"message": f"HTTP {response['status_code']}"}
+        if error:
+            results[line["custom_id"]] = {"output": None, "error": error.get("message", str(error))}
+            continue
+        results[line["custom_id"]] = {
+            "output": body["choices"][0]["message"]["content"],
+            "error": None,
+            "tokens": (body.get("usage") or {}).get("total_tokens"),
+        }
+    return results
+
+
+class BatchJobs:
+    """Batch API jobs of one run, saved next to the output so polling can resume.
+
+    The state records a hash of the rendered requests. It is only picked up on
+    resume and when the hash matches, so jobs submitted for another input or
+    prompt are never mistaken for this run's.
+    """
+
+    def __init__(self, state_path: Path, input_hash: str, resume: bool = False):
+        self.state_path = state_path
+        self.input_hash = input_hash
+        self.jobs: Dict[str, str] = {}
+        if not state_path.exists():
+            return
+        state = None
+        if resume:
+            try:
+                with open(state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable batch state {state_path}: {e}")
+        if isinstance(state, dict) and state.get("input_hash") == input_hash:
+            self.jobs = state.get("jobs") or {}
+        else:
+            if resume:
+                logger.warning(f"Batch state {state_path} is for a different input, submitting new jobs")
+            self.clear()
+
+    def save(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"input_hash": self.input_hash, "jobs": self.jobs}, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def clear(self) -> None:
+        self.jobs = {}
+        self.state_path.unlink(missing_ok=True)
+
+
+def requests_hash(requests: Dict[str, List[Dict]]) -> str:
+    return hashlib.sha256(json.dumps(requests, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def run_batch_api(
+        records: List[BatchRecord],
+        emit: Callable[[Dict], None],
+        state_path: Path,
+        system_prompts: List[str] | None = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        on_status: StatusCallback | None = None,
+        resume: bool = False,
+) -> Dict[str, int]:
+    """Submit `records` as Batch API jobs, one per profile, and emit results in input order.
+
+    With `resume`, jobs recorded in `state_path` for the same requests are
+    polled instead of submitted again; any other state is discarded.
+    """
+    config = read_config()
+    results = {}
+    for record in records:
+        if record.error:
+            results[custom_id(record)] = {"output": None, "error": record.error}
+        elif record.profile not in config.profiles:
+            results[custom_id(record)] = {"output": None, "error": f"Profile {record.profile} not found"}
+    submittable = [record for record in records if custom_id(record) not in results]
+    rendered = render_requests(submittable, system_prompts)
+    jobs = BatchJobs(state_path, requests_hash(rendered), resume=resume)
+
+    for profile, requests in rendered.items():
+        if profile in jobs.jobs:
+            continue
+        client = get_underlying_client(config.for_profile(profile))
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = write_input_file(requests, Path(directory) / f"{profile}.jsonl")
+            jobs.jobs[profile] = submit_job(client, input_path, description=f"smart batch {profile}")
+        jobs.save()
+        logger.info(f"Submitted {len(requests)} requests for profile {profile}: {jobs.jobs[profile]}")
+
+    for profile, batch_id in jobs.jobs.items():
+        profile_config = config.for_profile(profile)
+        client = get_underlying_client(profile_config)
+        status = functools.partial(on_status, profile) if on_status else None
+        batch = wait_for_job(
+            client, batch_id, poll_interval, status, get_scheduler(profile, profile_config)
+        )
+        if batch.status != "completed":
+            logger.warning(f"Batch {batch_id} for profile {profile} ended as {batch.status}")
+        results.update(collect_results(client, batch))
+
+    counts = {"ok": 0, "failed": 0, "skipped": 0}
+    for record in records:
+        result = {"index": record.index, "id": record.id, "command": record.command,
+                  "profile": record.profile, "output": None, "error": "No result in batch output"}
+        result.update(results.get(custom_id(record), {}))
+        counts["failed" if result["error"] else "ok"] += 1
+        emit(result)
+    jobs.clear()
+    return counts
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from utils.config import read_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+CACHEABLE_COMMANDS = ("emoji", "goto", "run")
+USAGE_FILE = "usage"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache of LLM replies with TTL and LRU eviction.
+
+    Every entry is a small JSON file; its mtime is bumped on each hit so the
+    least recently used entries are the first to go when limits are exceeded.
+    The entry count and total size are kept in a usage file next to the entries,
+    so the directory is only scanned once a limit is crossed. Eviction then
+    frees a tenth of the limits to make the next scan far off.
+    """
+
+    def __init__(
+            self,
+            directory: Path,
+            ttl_seconds: float = DEFAULT_TTL_SECONDS,
+            max_entries: int = DEFAULT_MAX_ENTRIES,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(model: str, messages: list, kb_content_hash: str = "") -> str:
+        digest = hashlib.sha256()
+        digest.update((model or "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(kb_content_hash.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("content")
+
+    def put(self, key: str, content: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        try:
+            replaced_size = path.stat().st_size
+        except OSError:
+            replaced_size = None
+        data = json.dumps({"created_at": time.time(), "content": content}, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write response cache entry: {e}")
+            Path(tmp_path).unlink(missing_ok=True)
+            return
+
+        usage = self._read_usage()
+        if usage is None:
+            # No usage file yet, or a broken one: a scan counts the entries again
+            self.evict()
+            return
+        entries, total_bytes = usage
+        if replaced_size is None:
+            entries += 1
+            total_bytes += len(data)
+        else:
+            total_bytes += len(data) - replaced_size
+        if entries > self.max_entries or total_bytes > self.max_bytes:
+            self.evict()
+        else:
+            self._write_usage(entries, total_bytes)
+
+    def _read_usage(self) -> tuple[int, int] | None:
+        try:
+            with open(self.directory / USAGE_FILE, "r", encoding="utf-8") as f:
+                usage = json.load(f)
+            return int(usage["entries"]), int(usage["bytes"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_usage(self, entries: int, total_bytes: int) -> None:
+        try:
+            with open(self.directory / USAGE_FILE, "w", encoding="utf-8") as f:
+                json.dump({"entries": entries, "bytes": total_bytes}, f)
+        except OSError as e:
+            logger.warning(f"Failed to write response cache usage: {e}")
+
+    def evict(self) -> None:
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        if len(entries) > self.max_entries or total_bytes > self.max_bytes:
+            max_entries = self.max_entries - self.max_entries // 10
+            max_bytes = self.max_bytes - self.max_bytes // 10
+            while entries and (len(entries) > max_entries or total_bytes > max_bytes):
+                _, size, path = entries.pop(0)
+                path.unlink(missing_ok=True)
+                total_bytes -= size
+        self._write_usage(len(entries), total_bytes)
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+        (self.directory / USAGE_FILE).unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache:
+    config = read_config()
+    return ResponseCache(
+        Path(os.getenv("HOME")) / ".smart" / "cache" / "responses",
+        ttl_seconds=float(config.get("cache_ttl", DEFAULT_TTL_SECONDS)),
+        max_entries=int(config.get("cache_max_entries", DEFAULT_MAX_ENTRIES)),
+        max_bytes=int(config.get("cache_max_bytes", DEFAULT_MAX_BYTES)),
+    )
+
+
+def is_cacheable_command(command: str | None) -> bool:
+    if command not in CACHEABLE_COMMANDS:
+        return False
+    disabled = read_config().get("cache_disabled_commands", "")
+    return command not in [c.strip() for c in disabled.split(",")]
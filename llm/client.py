@@ -1,30 +1,88 @@
 import functools
 import logging
 import json
-
-from openai import OpenAI
-from portkey_ai import Portkey
-
-from llm.conversation import Conversation
-from utils.config import read_config, GLOBAL_VERBOSE
+import time
+from contextlib import contextmanager
+
+from llm.context import render_transcript
+from llm.conversation import Conversation, count_message_tokens
+from llm.metrics import RequestSpan, note_route
+from llm.prompts import build_conversation_summary_prompt
+from llm.routing import Route, RoutingPolicy, race, race_threads, should_fail_over
+from llm.scheduler import RequestScheduler, get_scheduler
+from llm.tools import ToolCall
+from llm.transport import TransportSettings, get_async_http_client, get_http_client
+from utils.config import SmartConfig, read_config, GLOBAL_VERBOSE
+from utils.lazy import lazy_import
+
+openai = lazy_import("openai")
+portkey_ai = lazy_import("portkey_ai")
 
 DEFAULT_MODEL = "gpt-4o-mini"
+# Ask for the token usage in the last chunk of a stream
+STREAM_OPTIONS = {"include_usage": True}
 
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_PORTKEY_BASE_URL = "https://api.portkey.ai/v1"
+
+
 def _get_openai_client(config):
-    return OpenAI(
+    base_url = config.base_url or DEFAULT_OPENAI_BASE_URL
+    settings = TransportSettings.from_config(config)
+    return openai.OpenAI(
         api_key=config.llm_token,
-        base_url=config.base_url or "https://api.openai.com/v1",
+        base_url=base_url,
+        timeout=settings.timeout(),
+        # Retries are left to the request scheduler, which knows about the rate limits
+        max_retries=0,
+        http_client=get_http_client(base_url, settings),
     )
 
 
+def _without_sdk_retries(portkey_client):
+    # Portkey has no max_retries argument and retries once, in its own client
+    # and in the OpenAI client it wraps; the request scheduler retries instead
+    portkey_client.max_retries = 0
+    portkey_client.openai_client.max_retries = 0
+    return portkey_client
+
+
 def _get_portkey_client(config):
-    return Portkey(
-        base_url=config.base_url,
-        api_key=config.portkey_api_key,
-        virtual_key=config.portkey_virtual_key,
+    settings = TransportSettings.from_config(config)
+    return _without_sdk_retries(
+        portkey_ai.Portkey(
+            base_url=config.base_url,
+            api_key=config.portkey_api_key,
+            virtual_key=config.portkey_virtual_key,
+            http_client=get_http_client(config.base_url or DEFAULT_PORTKEY_BASE_URL, settings),
+        )
+    )
+
+
+def _get_async_openai_client(config):
+    base_url = config.base_url or DEFAULT_OPENAI_BASE_URL
+    settings = TransportSettings.from_config(config)
+    return openai.AsyncOpenAI(
+        api_key=config.llm_token,
+        base_url=base_url,
+        timeout=settings.timeout(),
+        max_retries=0,
+        http_client=get_async_http_client(base_url, settings),
+    )
+
+
+def _get_async_portkey_client(config):
+    settings = TransportSettings.from_config(config)
+    return _without_sdk_retries(
+        portkey_ai.AsyncPortkey(
+            base_url=config.base_url,
+            api_key=config.portkey_api_key,
+            virtual_key=config.portkey_virtual_key,
+            http_client=get_async_http_client(config.base_url or DEFAULT_PORTKEY_BASE_URL, settings),
+        )
     )
 
 
@@ -42,7 +100,9 @@ def apply_profile(profile):
     if profile not in config.profiles:
         return False
     config.apply_profile(profile)
-    get_llm_client().reset_client(get_underlying_client(config))
+    # A client that was never built will pick up the new profile when it is
+    if get_llm_client.cache_info().currsize:
+        get_llm_client().reset_client(get_underlying_client(config))
     return True
 
 
@@ -53,46 +113,295 @@ def get_underlying_client(config):
         return _get_openai_client(config)
 
 
+def get_async_underlying_client(config):
+    if config.client == "portkey":
+        return _get_async_portkey_client(config)
+    else:
+        return _get_async_openai_client(config)
+
+
+def get_async_llm_client(config=None):
+    """AsyncClient for the running event loop, must be called from a coroutine.
+
+    Its connections are pooled per event loop, so one client serves any number
+    of conversations running concurrently on that loop.
+    """
+    return AsyncClient(client=get_async_underlying_client(config or read_config()))
+
+
 class OpenAIAPIError(Exception):
     """Custom exception for OpenAI API errors."""
 
     pass
 
 
-class Client:
+def _raise_for_error(response):
+    # Some gateways answer 200 with an error body, typed SDK objects keep it as an extra field
+    if isinstance(response, dict):
+        error = response.get("error")
+    else:
+        error = getattr(response, "error", None)
+    if error:
+        message = error.get("message") if isinstance(error, dict) else getattr(error, "message", error)
+        raise OpenAIAPIError(f"Error from OpenAI API: {message}")
 
-    def __init__(self, model=None, client=None) -> None:
-        self.client = client
-        self.model = model if model else DEFAULT_MODEL
 
-    def _call_chat_completion(self, model, messages, tools):
-        # debug the messages being sent
-        if GLOBAL_VERBOSE:
-            logger.info(f"Request to API: {json.dumps(messages, indent=2)}")
-        response = self.client.chat.completions.create(
-            model=model, messages=messages, tools=tools
+def _profile_config(profile):
+    """(name, config) of `profile`, or of the current profile when it is None."""
+    config = read_config()
+    current = SmartConfig.get_current_profile()
+    if profile is None or profile == current:
+        return current, config
+    return profile, config.for_profile(profile)
+
+
+def _prompt_tokens(scheduler: RequestScheduler, messages) -> int:
+    # Counting is only worth it when the profile has a token budget
+    if not scheduler.counts_tokens:
+        return 0
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def _create_on(route: Route, client, model, messages, tools, **kwargs):
+    scheduler = get_scheduler(route.profile, route.config)
+    response = scheduler.call(
+        lambda: client.chat.completions.create(
+            model=route.model_for(model), messages=messages, tools=tools, **kwargs
+        ),
+        _prompt_tokens(scheduler, messages),
+        route.max_retries,
+    )
+    note_route(route.profile, route.model_for(model))
+    return response
+
+
+async def _acreate_on(route: Route, client, model, messages, tools, **kwargs):
+    scheduler = get_scheduler(route.profile, route.config)
+    response = await scheduler.call_async(
+        lambda: client.chat.completions.create(
+            model=route.model_for(model), messages=messages, tools=tools, **kwargs
+        ),
+        _prompt_tokens(scheduler, messages),
+        route.max_retries,
+    )
+    note_route(route.profile, route.model_for(model))
+    return response
+
+
+@contextmanager
+def _measured(span: RequestSpan):
+    """Report waits and retries to `span` while a request is sent, recording it if the request fails."""
+    try:
+        with span.active():
+            yield span
+    except BaseException as e:
+        span.finish(e)
+        raise
+
+
+async def _close_stream(started):
+    await started[0].close()
+
+
+def _summary_prompt_messages(previous_summary, messages):
+    prompt_messages = [{"role": "system", "content": build_conversation_summary_prompt()}]
+    if previous_summary:
+        prompt_messages.append(
+            {"role": "user", "content": f"Existing summary:\n\n{previous_summary}"}
         )
+    prompt_messages.append(
+        {"role": "user", "content": f"Conversation:\n\n{render_transcript(messages)}"}
+    )
+    return prompt_messages
+
+
+def _add_reply(conversation: Conversation, message):
+    # Tool calls are kept so their results can follow in the next request
+    if getattr(message, "tool_calls", None):
+        conversation.add_tool_calls(
+            message.content, [ToolCall.from_api(call).to_dict() for call in message.tool_calls]
+        )
+    else:
+        conversation.add_message(message.role, message.content)
+
 
-        if "error" in response:
-            raise OpenAIAPIError(
-                f"Error from OpenAI API: {response['error']['message']}"
+class StreamAssembler:
+    """Builds the reply of a stream chunk by chunk.
+
+    Text deltas are collected, tool call fragments are joined by their index
+    and the usage comes from the final chunk (requested with `include_usage`).
+    Time to first token and tokens per second are measured from `started`,
+    which the caller takes before sending the request.
+    """
+
+    def __init__(self, started: float, span: RequestSpan | None = None):
+        self.started = started
+        self.span = span
+        self.first_token_at = None
+        self.finished_at = None
+        self.text = ""
+        self.tool_calls = {}
+        self.usage = None
+
+    def feed(self, chunk):
+        """The content delta of `chunk` to show, if it has one."""
+        _raise_for_error(chunk)
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta:
+            return None
+        delta = chunk.choices[0].delta
+        if self.first_token_at is None and (delta.content or getattr(delta, "tool_calls", None)):
+            self.first_token_at = time.monotonic()
+        for fragment in getattr(delta, "tool_calls", None) or []:
+            call = self.tool_calls.setdefault(
+                fragment.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
             )
+            if fragment.id:
+                call["id"] = fragment.id
+            if fragment.function:
+                call["function"]["name"] += fragment.function.name or ""
+                call["function"]["arguments"] += fragment.function.arguments or ""
+        if delta.content:
+            self.text += str(delta.content)
+            return delta
+        return None
+
+    def finish(self, conversation: Conversation) -> None:
+        self.finished_at = time.monotonic()
+        if self.tool_calls:
+            conversation.add_tool_calls(
+                self.text or None, [self.tool_calls[index] for index in sorted(self.tool_calls)]
+            )
+        else:
+            conversation.add_assistant_message(self.text)
+        if self.usage:
+            conversation.token_usage = self.usage.total_tokens
+        else:
+            # The gateway did not send usage, fall back to the local count
+            conversation.estimate_token_usage()
+        stats = self.stats()
+        conversation.add_metadata("last_stream_stats", stats)
+        logger.debug(f"Stream stats: {stats}")
+        if self.span:
+            self.span.ttft = stats["ttft"]
+            self.span.set_usage(self.usage)
+            self.span.finish()
+
+    def fail(self, error: BaseException) -> None:
+        if self.span:
+            self.span.ttft = self.stats()["ttft"]
+            self.span.finish(error)
+
+    @property
+    def completion_tokens(self):
+        return self.usage.completion_tokens if self.usage else None
+
+    def stats(self):
+        ttft = self.first_token_at - self.started if self.first_token_at else None
+        generating = (self.finished_at or time.monotonic()) - (self.first_token_at or self.started)
+        tokens = self.completion_tokens
+        return {
+            "ttft": ttft,
+            "latency": (self.finished_at or time.monotonic()) - self.started,
+            "prompt_tokens": self.usage.prompt_tokens if self.usage else None,
+            "completion_tokens": tokens,
+            "tokens_per_second": tokens / generating if tokens and generating > 0 else None,
+        }
+
+
+class _RoutedClient:
+    """Client state shared by the sync and async clients: the profile and its fallbacks."""
+
+    def __init__(self, model=None, client=None, profile=None) -> None:
+        self.client = client
+        self.model = model if model else DEFAULT_MODEL
+        # None follows the current profile
+        self.profile = profile
+        self._fallback_clients = {}
 
-        return response
+    def _make_client(self, config):
+        raise NotImplementedError
 
     def reset_client(self, new_client):
         self.client = new_client
+        self._fallback_clients = {}
+
+    def _routing(self):
+        profile, config = _profile_config(self.profile)
+        policy = RoutingPolicy.from_config(config)
+        return policy, policy.routes(profile, config)
+
+    def _client_for(self, route: Route):
+        if route.primary:
+            return self.client
+        if route.profile not in self._fallback_clients:
+            self._fallback_clients[route.profile] = self._make_client(route.config)
+        return self._fallback_clients[route.profile]
+
+
+class Client(_RoutedClient):
+
+    def _make_client(self, config):
+        return get_underlying_client(config)
+
+    def _create(self, model, messages, tools, **kwargs):
+        _, routes = self._routing()
+        for position, route in enumerate(routes):
+            try:
+                return _create_on(route, self._client_for(route), model, messages, tools, **kwargs)
+            except Exception as e:
+                if position == len(routes) - 1 or not should_fail_over(e):
+                    raise
+                logger.warning(
+                    f"Profile {route.profile} failed ({e}), failing over to {routes[position + 1].profile}"
+                )
+
+    def _hedged_create(self, routes, hedge_after, model, messages, tools):
+        # Hedged attempts run in threads on the same pooled clients as every other request
+        return race_threads(
+            lambda route: _create_on(route, self._client_for(route), model, messages, tools),
+            routes,
+            hedge_after,
+        )
+
+    def _call_chat_completion(self, model, messages, tools, hedge=False):
+        # debug the messages being sent
+        if GLOBAL_VERBOSE:
+            logger.info(f"Request to API: {json.dumps(messages, ensure_ascii=False)}")
+        policy, routes = self._routing()
+        with _measured(RequestSpan("chat.completions", model, routes[0].profile)) as span:
+            if hedge and policy.hedge_after and len(routes) > 1:
+                response = self._hedged_create(routes, policy.hedge_after, model, messages, tools)
+            else:
+                response = self._create(model, messages, tools)
+            _raise_for_error(response)
+        span.set_usage(getattr(response, "usage", None))
+        span.finish()
+        return response
 
     def get_chat_completion(self, messages, model=None, tools=None):
         our_model = model if model else self.model
         return self._call_chat_completion(our_model, messages, tools)
 
+    def summarize_messages(self, previous_summary, messages, model=None):
+        prompt_messages = _summary_prompt_messages(previous_summary, messages)
+        response = self.get_chat_completion(prompt_messages, model=model)
+        return response.choices[0].message.content
+
+    def _request_messages(self, conversation: Conversation):
+        return conversation.request_messages(
+            lambda previous, messages: self.summarize_messages(
+                previous, messages, model=conversation.model
+            )
+        )
+
     def converse(self, conversation: Conversation, tools=None):
         our_model = conversation.model if conversation.model else self.model
-        response = self._call_chat_completion(our_model, conversation.messages, tools)
+        messages = self._request_messages(conversation)
+        response = self._call_chat_completion(our_model, messages, tools, hedge=True)
 
-        message = response.choices[0].message
-        conversation.add_message(message.role, message.content)
+        _add_reply(conversation, response.choices[0].message)
         # Log the total token usage
         conversation.token_usage = response.usage.total_tokens
         return response
@@ -107,29 +416,125 @@ class Client:
         """
         our_model = conversation.model if conversation.model else self.model
 
+        messages = self._request_messages(conversation)
+
         if GLOBAL_VERBOSE:
-            logger.info(f"Streaming to API: {json.dumps(conversation.messages, indent=2)}")
+            logger.info(f"Streaming to API: {json.dumps(messages, ensure_ascii=False)}")
+
+        _, routes = self._routing()
+        span = RequestSpan("chat.completions", our_model, routes[0].profile, stream=True)
+        assembler = StreamAssembler(span.started, span)
+        with _measured(span):
+            stream = self._create(
+                our_model, messages, tools, stream=True, stream_options=STREAM_OPTIONS
+            )  # Enable streaming
+
+        try:
+            for chunk in stream:
+                delta = assembler.feed(chunk)
+                if delta:
+                    yield delta
+        except BaseException as e:
+            assembler.fail(e)
+            raise
+        assembler.finish(conversation)
+
+
+class AsyncClient(_RoutedClient):
+    """Asyncio counterpart of `Client` built on AsyncOpenAI / AsyncPortkey.
+
+    Turns on one conversation are serialized by its turn lock, while turns on
+    different conversations run concurrently on the same event loop. Slow
+    profiles are hedged here for streaming replies too, on the first token.
+    """
+
+    def _make_client(self, config):
+        return get_async_underlying_client(config)
+
+    async def _call_chat_completion(self, model, messages, tools):
+        if GLOBAL_VERBOSE:
+            logger.info(f"Request to API: {json.dumps(messages, ensure_ascii=False)}")
+        policy, routes = self._routing()
+        with _measured(RequestSpan("chat.completions", model, routes[0].profile)) as span:
+            response = await race(
+                lambda route: _acreate_on(route, self._client_for(route), model, messages, tools),
+                routes,
+                policy.hedge_after,
+            )
+            _raise_for_error(response)
+        span.set_usage(getattr(response, "usage", None))
+        span.finish()
+        return response
 
-        stream = self.client.chat.completions.create(
-            model=our_model,
-            messages=conversation.messages,
-            tools=tools,
-            stream=True,  # Enable streaming
+    async def _start_stream(self, route, model, messages, tools):
+        # A stream has started once its first chunk arrived
+        stream = await _acreate_on(
+            route, self._client_for(route), model, messages, tools, stream=True, stream_options=STREAM_OPTIONS
         )
+        chunks = stream.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return stream, chunks, first
+
+    async def get_chat_completion(self, messages, model=None, tools=None):
+        our_model = model if model else self.model
+        return await self._call_chat_completion(our_model, messages, tools)
+
+    async def summarize_messages(self, previous_summary, messages, model=None):
+        prompt_messages = _summary_prompt_messages(previous_summary, messages)
+        response = await self.get_chat_completion(prompt_messages, model=model)
+        return response.choices[0].message.content
+
+    async def _request_messages(self, conversation: Conversation):
+        pending = conversation.pending_summary()
+        if pending:
+            previous, messages, upto = pending
+            summary = await self.summarize_messages(previous, messages, model=conversation.model)
+            conversation.store_summary(upto, summary)
+        return conversation.request_messages()
+
+    async def converse(self, conversation: Conversation, tools=None):
+        our_model = conversation.model if conversation.model else self.model
+        async with conversation.turn_lock():
+            messages = await self._request_messages(conversation)
+            response = await self._call_chat_completion(our_model, messages, tools)
+
+            _add_reply(conversation, response.choices[0].message)
+            conversation.token_usage = response.usage.total_tokens
+        return response
 
-        response_text = ""
-        for chunk in stream:
-            if "error" in chunk:
-                raise OpenAIAPIError(
-                    f"Error from OpenAI API: {chunk['error']['message']}"
+    async def converse_stream(self, conversation: Conversation, tools=None):
+        """Async generator yielding each delta of the response as it arrives."""
+        our_model = conversation.model if conversation.model else self.model
+        async with conversation.turn_lock():
+            messages = await self._request_messages(conversation)
+
+            if GLOBAL_VERBOSE:
+                logger.info(f"Streaming to API: {json.dumps(messages, ensure_ascii=False)}")
+
+            policy, routes = self._routing()
+            span = RequestSpan("chat.completions", our_model, routes[0].profile, stream=True)
+            assembler = StreamAssembler(span.started, span)
+            with _measured(span):
+                _, chunks, first = await race(
+                    lambda route: self._start_stream(route, our_model, messages, tools),
+                    routes,
+                    policy.hedge_after,
+                    discard=_close_stream,
                 )
 
-            if (
-                chunk.choices
-                and chunk.choices[0].delta
-                and chunk.choices[0].delta.content
-            ):
-                response_text += str(chunk.choices[0].delta.content)
-                yield chunk.choices[0].delta
-        conversation.add_assistant_message(response_text)
-        conversation.estimate_token_usage()
+            try:
+                if first is not None:
+                    delta = assembler.feed(first)
+                    if delta:
+                        yield delta
+                    async for chunk in chunks:
+                        delta = assembler.feed(chunk)
+                        if delta:
+                            yield delta
+            except BaseException as e:
+                assembler.fail(e)
+                raise
+            assembler.finish(conversation)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+DEFAULT_KEEP_LAST_TURNS = 6
+STRATEGY_DROP = "drop"
+STRATEGY_SUMMARIZE = "summarize"
+
+# Takes the previous summary (or None) and the newly trimmed messages
+Summarizer = Callable[[str | None, List[Dict]], str]
+
+
+@dataclass
+class ContextPolicy:
+    """Token budget applied to the messages sent with each request.
+
+    Pinned messages (the system prompts) are always sent, the last `keep_last_turns` turns are sent
+    verbatim and older turns are either dropped or folded into a summary.
+    """
+
+    max_tokens: int
+    keep_last_turns: int = DEFAULT_KEEP_LAST_TURNS
+    strategy: str = STRATEGY_DROP
+
+    @classmethod
+    def from_config(cls, config) -> ContextPolicy | None:
+        max_tokens = config.get("context_max_tokens")
+        if not max_tokens:
+            return None
+        strategy = config.get("context_strategy", STRATEGY_DROP)
+        if strategy not in (STRATEGY_DROP, STRATEGY_SUMMARIZE):
+            raise ValueError(f"Unknown context strategy: {strategy}")
+        return cls(
+            max_tokens=int(max_tokens),
+            keep_last_turns=int(config.get("context_keep_turns", DEFAULT_KEEP_LAST_TURNS)),
+            strategy=strategy,
+        )
+
+
+def split_turns(indices: List[int], messages: List[Dict]) -> List[List[int]]:
+    """Group message indices into turns, each starting at a user message."""
+    turns = []
+    previous_role = None
+    for index in indices:
+        role = messages[index]["role"]
+        if not turns or (role == "user" and previous_role != "user"):
+            turns.append([])
+        turns[-1].append(index)
+        previous_role = role
+    return turns
+
+
+def render_transcript(messages: List[Dict]) -> str:
+    lines = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for block in content:
+                if isinstance(block, dict) and block.get("type") == "text":
+                    parts.append(block.get("text", ""))
+                elif isinstance(block, dict) and block.get("type") == "image_url":
+                    parts.append("[image]")
+                else:
+                    parts.append(str(block))
+            content = "\n".join(parts)
+        for call in message.get("tool_calls") or []:
+            function = call.get("function", {})
+            content = f"{content or ''}\n[calls {function.get('name')}({function.get('arguments')})]".strip()
+        lines.append(f"{message['role'].upper()}: {content}")
+    return "\n\n".join(lines)
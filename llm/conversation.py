@@ -1,38 +1,125 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import json
 import logging
+import threading
 from typing import Union, Dict, List
 
-import tiktoken
-from markdown2 import markdown
-
+from llm.context import ContextPolicy, Summarizer, STRATEGY_SUMMARIZE, split_turns
 from utils.config import read_config
+from utils.images import image_tokens, persistable_message
+from utils.lazy import lazy_import
 
-encoding = tiktoken.encoding_for_model("gpt-4o")
+markdown2 = lazy_import("markdown2")
 logger = logging.getLogger(__name__)
 
 MessageContent = Union[str, Dict, List[Union[str, Dict]]]
 
 
+# Per-message framing overhead added by the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+# Image costs follow the OpenAI vision pricing: a flat cost for low detail and
+# 85 + 170 per 512px tile otherwise, assuming a 1024x1024 image when unknown
+IMAGE_LOW_DETAIL_TOKENS = 85
+IMAGE_DEFAULT_TOKENS = 765
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    # Loading the BPE table is expensive, only pay for it when tokens are counted
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        logger.warning(f"Token encoder unavailable, approximating token counts: {e}")
+        return None
+
+
+def count_text_tokens(text: str) -> int:
+    encoder = get_encoding()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_block_tokens(block) -> int:
+    if isinstance(block, str):
+        return count_text_tokens(block)
+    if isinstance(block, dict):
+        if block.get("type") == "text":
+            return count_text_tokens(block.get("text", ""))
+        if block.get("type") == "image_url":
+            tokens = image_tokens(block)
+            if tokens is not None:
+                return tokens
+            detail = block.get("image_url", {}).get("detail", "auto")
+            return IMAGE_LOW_DETAIL_TOKENS if detail == "low" else IMAGE_DEFAULT_TOKENS
+    return count_text_tokens(json.dumps(block, ensure_ascii=False))
+
+
+def count_message_tokens(message: Dict) -> int:
+    content = message.get("content")
+    if content is None:
+        tokens = 0
+    elif isinstance(content, list):
+        tokens = sum(count_block_tokens(block) for block in content)
+    else:
+        tokens = count_block_tokens(content)
+    if message.get("tool_calls"):
+        tokens += count_text_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    return MESSAGE_OVERHEAD_TOKENS + tokens
+
+
 class Conversation:
     def __init__(self, model=None):
         self.messages = []
+        # Token count of each message, None until a token budget or estimate needs it
+        self.message_tokens = []
+        # Indices of the messages always sent in full, the system prompts whatever their role
+        self.pinned = set()
+        config = read_config()
         if model:
             self.model = model
         else:
-            config = read_config()
             self.model = config.model
+        self.context_policy = ContextPolicy.from_config(config)
         self.token_usage = 0
         self.extra_data = {}
         self.started_at = datetime.datetime.now()
+        self.journal = None
+        # Guards messages and token counts, turns may run on several threads
+        self._lock = threading.RLock()
+        self._turn_lock = None
 
     def add_message(self, role: str, content: MessageContent) -> None:
         # If content is a dict with a "type" key (e.g. image_url), wrap it in a list per OpenAI API requirements
         if isinstance(content, dict) and "type" in content:
             content = [content]
-        self.messages.append({"role": role, "content": content})
+        self._append({"role": role, "content": content})
+
+    def _append(self, message: Dict) -> None:
+        # Not counted here: one-shot commands never need the tokenizer
+        with self._lock:
+            self.messages.append(message)
+            self.message_tokens.append(None)
+            if self.journal:
+                self.journal.append(len(self.messages) - 1, message)
+
+    def load_messages(self, messages: List[Dict], pinned: List[int] | None = None) -> None:
+        """Append saved messages, `pinned` are the indices among them that are always sent.
+
+        Without `pinned` the system messages are pinned, as in documents saved before it existed.
+        """
+        with self._lock:
+            offset = len(self.messages)
+            for message in messages:
+                self._append(dict(message))
+            if pinned is None:
+                pinned = [i for i, m in enumerate(messages) if m["role"] == "system"]
+            self.pinned.update(offset + i for i in pinned)
 
     def add_user_message(self, content: MessageContent):
         # The add_message method now handles wrapping image block dicts as needed
@@ -41,23 +128,147 @@ class Conversation:
     def add_assistant_message(self, content: MessageContent):
         self.add_message("assistant", content)
 
+    def add_tool_calls(self, content: str | None, tool_calls: List[Dict]) -> None:
+        """Assistant message asking for `tool_calls`, in the chat completions format."""
+        self._append({"role": "assistant", "content": content, "tool_calls": tool_calls})
+
+    def add_tool_result(self, tool_call_id: str, content: str) -> None:
+        self._append({"role": "tool", "tool_call_id": tool_call_id, "content": content})
+
     def add_system_message(self, content: MessageContent) -> None:
         if isinstance(content, list):
             for item in content:
                 self.add_system_message(item)
             return
-        if self.model and self.model.startswith("o1"):
-            self.add_user_message(content)
-            return  # No system messages for o1 models
-        self.messages.append({"role": "system", "content": content})
+        # Helpers may add the system prompt a command already set up, sending it
+        # twice would break the stable prefix providers cache prompts on
+        with self._lock:
+            if self.has_system_message(content):
+                return
+            if self.model and self.model.startswith("o1"):
+                self.add_user_message(content)  # No system messages for o1 models
+            else:
+                self._append({"role": "system", "content": content})
+            self.pinned.add(len(self.messages) - 1)
+
+    def has_system_message(self, content: MessageContent) -> bool:
+        with self._lock:
+            return any(self.messages[i]["content"] == content for i in self.pinned)
 
     def delete_message(self, index: int) -> None:
-        if 0 <= index < len(self.messages):
-            self.messages[index]["content"] = "[DELETED]"
+        with self._lock:
+            if 0 <= index < len(self.messages):
+                self.messages[index]["content"] = "[DELETED]"
+                self.message_tokens[index] = None
+                if self.journal:
+                    self.journal.update(index, self.messages[index])
+
+    def _tokens(self, index: int) -> int:
+        tokens = self.message_tokens[index]
+        if tokens is None:
+            tokens = self.message_tokens[index] = count_message_tokens(self.messages[index])
+        return tokens
+
+    @property
+    def estimated_tokens(self) -> int:
+        """Local token count of all messages, counting the ones not counted yet."""
+        with self._lock:
+            return sum(self._tokens(index) for index in range(len(self.messages)))
 
     def get_conversation(self):
         return self.messages
 
+    def turn_lock(self):
+        """asyncio lock held for a whole request/reply turn by async callers."""
+        import asyncio
+
+        with self._lock:
+            if self._turn_lock is None:
+                self._turn_lock = asyncio.Lock()
+            return self._turn_lock
+
+    def _trim_plan(self):
+        # (pinned, trimmed, kept) message indices, or None when everything fits
+        policy = self.context_policy
+        if not policy or self.estimated_tokens <= policy.max_tokens:
+            return None
+
+        pinned_indices = sorted(self.pinned)
+        other_indices = [i for i in range(len(self.messages)) if i not in self.pinned]
+        turns = split_turns(other_indices, self.messages)
+        kept_turns = turns[-policy.keep_last_turns:] if policy.keep_last_turns > 0 else turns[-1:]
+
+        budget = policy.max_tokens - sum(self._tokens(i) for i in pinned_indices)
+        kept_tokens = sum(self._tokens(i) for turn in kept_turns for i in turn)
+        # The latest turn is always sent, even if it alone exceeds the budget
+        while len(kept_turns) > 1 and kept_tokens > budget:
+            kept_tokens -= sum(self._tokens(i) for i in kept_turns[0])
+            kept_turns = kept_turns[1:]
+
+        kept_indices = [i for turn in kept_turns for i in turn]
+        first_kept = kept_indices[0] if kept_indices else len(self.messages)
+        trimmed_indices = [i for i in other_indices if i < first_kept]
+        return pinned_indices, trimmed_indices, kept_indices
+
+    def pending_summary(self):
+        """(previous summary, messages to fold in, last index) when the rolling summary is stale.
+
+        Returns None when no summary is needed. The caller produces the summary,
+        on whatever thread or event loop it likes, and hands it to `store_summary`.
+        """
+        with self._lock:
+            policy = self.context_policy
+            if not policy or policy.strategy != STRATEGY_SUMMARIZE:
+                return None
+            plan = self._trim_plan()
+            if not plan or not plan[1]:
+                return None
+            trimmed_indices = plan[1]
+            # The summary is rolled forward so each message is summarized only once
+            cached = self.get_metadata("context_summary")
+            last_trimmed = trimmed_indices[-1]
+            if cached and cached["upto"] == last_trimmed:
+                return None
+            previous = cached["content"] if cached and cached["upto"] < last_trimmed else None
+            upto = cached["upto"] if previous else -1
+            new_messages = [self.messages[i] for i in trimmed_indices if i > upto]
+            return previous, new_messages, last_trimmed
+
+    def store_summary(self, upto: int, content: str) -> None:
+        with self._lock:
+            self.add_metadata("context_summary", {"upto": upto, "content": content})
+
+    def request_messages(self, summarizer: Summarizer | None = None) -> List[Dict]:
+        """Snapshot of the messages to send with the next request, trimmed to the context policy."""
+        if summarizer:
+            pending = self.pending_summary()
+            if pending:
+                previous, new_messages, upto = pending
+                self.store_summary(upto, summarizer(previous, new_messages))
+
+        with self._lock:
+            plan = self._trim_plan()
+            if not plan:
+                return list(self.messages)
+            pinned_indices, trimmed_indices, kept_indices = plan
+            request = [self.messages[i] for i in pinned_indices]
+            summary = self.get_metadata("context_summary")
+            if trimmed_indices and self.context_policy.strategy == STRATEGY_SUMMARIZE and summary:
+                role = "user" if self.model and self.model.startswith("o1") else "system"
+                request.append(
+                    {
+                        "role": role,
+                        "content": f"Summary of the earlier conversation:\n\n{summary['content']}",
+                    }
+                )
+            request.extend(self.messages[i] for i in kept_indices)
+            return request
+
+    def attach_journal(self, journal) -> None:
+        """Persist this conversation through `journal`, starting with the messages so far."""
+        journal.start(self.started_at.isoformat(), self.model, self.messages)
+        self.journal = journal
+
     def add_metadata(self, key, value):
         self.extra_data[key] = value
 
@@ -68,13 +279,14 @@ class Conversation:
         return self.token_usage
 
     def estimate_token_usage(self):
-        self.token_usage = len(encoding.encode(json.dumps(self.to_dict())))
+        self.token_usage = self.estimated_tokens
 
     def to_dict(self):
         return {
             "started_at": self.started_at.isoformat(),
             "model": self.model,
-            "messages": self.messages,
+            "messages": [persistable_message(message) for message in self.messages],
+            "pinned": sorted(self.pinned),
             "token_usage": self.token_usage,
         }
 
@@ -87,7 +299,7 @@ class Conversation:
                 f"**{message['role'].upper()}**\n\n{message['content']}\n\n"
             )
         # Convert Markdown to HTML
-        return markdown(markdown_content)
+        return markdown2.markdown(markdown_content)
 
     def as_html(self, last_n=1):
         return f"""
@@ -0,0 +1,223 @@
+"""Warm daemon that keeps the config, LLM client and token encoder loaded.
+
+The daemon listens on a Unix socket and speaks newline-delimited JSON. Each
+request is one line, e.g. ``{"action": "converse", "profile": "default",
+"model": "gpt-4o", "messages": [...]}``. Streaming requests get one
+``{"delta": ...}`` line per chunk followed by a final ``{"done": true}`` line.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from contextlib import closing
+from pathlib import Path
+from types import SimpleNamespace
+
+from llm.client import get_llm_client, apply_profile
+from llm.conversation import Conversation, get_encoding
+from llm.metrics import command_scope, current_command
+from llm.transport import pool_stats
+from utils.config import read_config, SmartConfig
+
+logger = logging.getLogger(__name__)
+
+SOCKET_ENV = "SMART_DAEMON_SOCKET"
+
+
+def get_socket_path() -> Path:
+    if os.getenv(SOCKET_ENV):
+        return Path(os.getenv(SOCKET_ENV))
+    return Path(os.getenv("HOME")) / ".smart" / "daemon.sock"
+
+
+class DaemonError(Exception):
+    """Raised when the daemon reports a failure."""
+
+    pass
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            action = request.get("action")
+            if action == "ping":
+                self._send({"ok": True, "pid": os.getpid()})
+            elif action == "stats":
+                self._send({"ok": True, "pools": pool_stats()})
+            elif action == "shutdown":
+                self._send({"ok": True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            elif action == "converse":
+                with command_scope(request.get("command")):
+                    self._converse(request)
+            elif action == "converse_stream":
+                with command_scope(request.get("command")):
+                    self._converse_stream(request)
+            else:
+                self._send({"error": f"Unknown action: {action}"})
+        except Exception as e:
+            logger.exception("Daemon request failed")
+            self._send({"error": str(e)})
+
+    def _send(self, payload):
+        self.wfile.write((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def _conversation(self, request) -> Conversation:
+        profile = request.get("profile")
+        if profile and profile != SmartConfig.get_current_profile():
+            if not apply_profile(profile):
+                raise DaemonError(f"Profile not found: {profile}")
+        conversation = Conversation(model=request.get("model") or read_config().model)
+        conversation.load_messages(request.get("messages", []), request.get("pinned"))
+        return conversation
+
+    def _converse(self, request):
+        with self.server.lock:
+            conversation = self._conversation(request)
+            response = get_llm_client().converse(conversation, tools=request.get("tools"))
+        self._send(
+            {
+                "content": response.choices[0].message.content,
+                "tool_calls": conversation.messages[-1].get("tool_calls"),
+                "token_usage": conversation.get_token_usage(),
+            }
+        )
+
+    def _converse_stream(self, request):
+        with self.server.lock:
+            conversation = self._conversation(request)
+            for delta in get_llm_client().converse_stream(conversation, tools=request.get("tools")):
+                self._send({"delta": delta.content})
+        self._send(
+            {
+                "done": True,
+                "content": conversation.messages[-1]["content"],
+                "tool_calls": conversation.messages[-1].get("tool_calls"),
+                "token_usage": conversation.get_token_usage(),
+            }
+        )
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(str(socket_path), _DaemonHandler)
+        # Profiles are global state, so requests are served one at a time
+        self.lock = threading.Lock()
+
+
+def warm_up():
+    read_config()
+    get_llm_client()
+    get_encoding()
+
+
+def serve(socket_path: Path | None = None):
+    socket_path = socket_path or get_socket_path()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        if DaemonClient(socket_path).ping():
+            raise DaemonError(f"Daemon already running at {socket_path}")
+        socket_path.unlink()
+
+    warm_up()
+    server = _DaemonServer(socket_path)
+    os.chmod(socket_path, 0o600)
+    logger.info(f"Smart daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path.exists():
+            socket_path.unlink()
+
+
+class DaemonClient:
+    """Forwards LLM calls to the daemon, mirroring the `Client` interface."""
+
+    def __init__(self, socket_path: Path | None = None, timeout: float = 600):
+        self.socket_path = socket_path or get_socket_path()
+        self.timeout = timeout
+
+    def _request(self, payload):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(str(self.socket_path))
+        try:
+            sock.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    reply = json.loads(line)
+                    if "error" in reply:
+                        raise DaemonError(reply["error"])
+                    yield reply
+        finally:
+            sock.close()
+
+    def _conversation_payload(self, action, conversation: Conversation):
+        return {
+            "action": action,
+            "command": current_command(),
+            "profile": SmartConfig.get_current_profile(),
+            "model": conversation.model,
+            "messages": conversation.messages,
+            "pinned": sorted(conversation.pinned),
+        }
+
+    def ping(self) -> bool:
+        try:
+            return any(reply.get("ok") for reply in self._request({"action": "ping"}))
+        except (OSError, DaemonError):
+            return False
+
+    def stats(self):
+        with closing(self._request({"action": "stats"})) as replies:
+            for reply in replies:
+                return reply.get("pools", [])
+        return []
+
+    def shutdown(self) -> bool:
+        try:
+            return any(reply.get("ok") for reply in self._request({"action": "shutdown"}))
+        except (OSError, DaemonError):
+            return False
+
+    def converse(self, conversation: Conversation, tools=None):
+        payload = self._conversation_payload("converse", conversation)
+        if tools:
+            payload["tools"] = tools
+        # The daemon sends a single reply, close the socket right after reading it
+        with closing(self._request(payload)) as replies:
+            reply = next(replies)
+        if reply.get("tool_calls"):
+            conversation.add_tool_calls(reply["content"], reply["tool_calls"])
+        else:
+            conversation.add_assistant_message(reply["content"])
+        conversation.token_usage = reply["token_usage"]
+        message = SimpleNamespace(role="assistant", content=reply["content"], tool_calls=reply.get("tool_calls"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def converse_stream(self, conversation: Conversation, tools=None):
+        payload = self._conversation_payload("converse_stream", conversation)
+        if tools:
+            payload["tools"] = tools
+        with closing(self._request(payload)) as replies:
+            for reply in replies:
+                if reply.get("done"):
+                    if reply.get("tool_calls"):
+                        conversation.add_tool_calls(reply["content"], reply["tool_calls"])
+                    else:
+                        conversation.add_assistant_message(reply["content"])
+                    conversation.token_usage = reply["token_usage"]
+                    break
+                yield SimpleNamespace(content=reply["delta"])
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import re
+import shlex
+import tempfile
+import threading
+import weakref
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from llm.kb_index import parse_kb, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Version 2 keys keep the instruction's word order and repeated words
+STORE_VERSION = 2
+DEFAULT_THRESHOLD = 0.75
+# A learned command is trusted once accepted this many times more than rejected
+MIN_LEARNED_MARGIN = 1
+FOLLOW_UP_PREFIX = "User follows up: "
+RAN_PATTERN = re.compile(r"^User ran `(?P<command>.+)`, exited with code (?P<code>-?\d+)$", re.S)
+CODE_BLOCK_PATTERN = re.compile(r"```[a-z]*\n(.*?)```", re.S)
+ARGUMENT_PATTERN = re.compile(r"^-\s*(?P<position>\w+) argument\s*\((?P<kind>required|optional)\)", re.I)
+DEFAULT_PATTERN = re.compile(r"Defaults to `([^`]*)`")
+PATH_PATTERN = re.compile(r"(?:^|\s)((?:~|\.{1,2})?/[^\s\"']*)")
+STOP_WORDS = {"a", "an", "the", "please", "my", "me", "all", "of", "in", "on", "for", "to", "and"}
+
+# Matchers with lookup stats not yet written, flushed at exit
+_unsaved_matchers = weakref.WeakSet()
+
+
+def normalize_instruction(text: str) -> str:
+    # Order and repeats stay: "copy a to b" and "copy b to a" are different commands
+    return " ".join(word for word in re.findall(r"[a-z0-9/~._-]+", text.lower()) if word not in STOP_WORDS)
+
+
+def _query_words(text: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOP_WORDS]
+
+
+def _coverage(words: List[str], terms: set) -> float:
+    # A word counts when the function mentions it or a word sharing its prefix ("clean" ~ "cleanup")
+    matched = sum(1 for word in words if word in terms or (len(word) >= 4 and word[:4] + "*" in terms))
+    return matched / len(words)
+
+
+@dataclass
+class KBFunction:
+    """A knowledge base function with its examples and argument specs."""
+
+    name: str
+    terms: set
+    examples: List[str]
+    # (required, default) per positional argument
+    arguments: List[tuple] = field(default_factory=list)
+
+
+def parse_functions(content: str) -> List[KBFunction]:
+    _, entries = parse_kb(content)
+    functions = []
+    for entry in entries:
+        examples = []
+        example_at = entry.text.find("**Example")
+        if example_at >= 0:
+            for block in CODE_BLOCK_PATTERN.findall(entry.text[example_at:]):
+                examples.extend(line.strip() for line in block.splitlines() if line.strip())
+        arguments = []
+        for line in entry.text.splitlines():
+            match = ARGUMENT_PATTERN.match(line.strip())
+            if match:
+                default = DEFAULT_PATTERN.search(line)
+                arguments.append(
+                    (match.group("kind").lower() == "required", default.group(1) if default else None)
+                )
+        if examples:
+            functions.append(KBFunction(entry.name, set(tokenize(entry.text)), examples, arguments))
+    return functions
+
+
+@dataclass
+class Match:
+    command: str
+    confidence: float
+    source: str
+
+
+class FastPathMatcher:
+    """Resolves `run` instructions to commands without calling the LLM.
+
+    Commands accepted before for the same instruction are proposed first.
+    Otherwise the instruction is scored against the knowledge base functions
+    and one of their `**Example**` commands is proposed, with a path from the
+    instruction filled in as the first argument, when the match is confident.
+    """
+
+    def __init__(self, store_path: Path, functions: List[KBFunction] | None = None,
+                 threshold: float = DEFAULT_THRESHOLD):
+        self.store_path = store_path
+        self.functions = functions or []
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.learned: Dict[str, Dict] = {}
+        self.stats = {"lookups": 0, "hits": 0, "accepted": 0}
+        try:
+            with open(store_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("version") == STORE_VERSION:
+                self.learned = stored["learned"]
+                self.stats.update(stored["stats"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self) -> None:
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "learned": self.learned, "stats": self.stats}, f)
+        os.replace(tmp_path, self.store_path)
+        _unsaved_matchers.discard(self)
+
+    def flush(self) -> None:
+        """Write lookup stats that are not saved yet."""
+        with self._lock:
+            if self in _unsaved_matchers:
+                self._save()
+
+    def _learned_match(self, instruction: str) -> Match | None:
+        record = self.learned.get(normalize_instruction(instruction))
+        if not record or record["accepted"] - record["rejected"] < MIN_LEARNED_MARGIN:
+            return None
+        confidence = record["accepted"] / (record["accepted"] + record["rejected"])
+        return Match(record["command"], confidence, "history")
+
+    def _kb_match(self, instruction: str) -> Match | None:
+        words = _query_words(instruction)
+        if not words or not self.functions:
+            return None
+        scored = sorted(
+            ((_coverage(words, function.terms), function) for function in self.functions),
+            key=lambda item: -item[0],
+        )
+        best_score, best = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        # Two functions covering the instruction equally well is a guess, not a match
+        confidence = best_score - runner_up / 2
+        if confidence < self.threshold:
+            return None
+        command = self._fill_arguments(best, instruction)
+        return Match(command, confidence, f"kb:{best.name}") if command else None
+
+    @staticmethod
+    def _fill_arguments(function: KBFunction, instruction: str) -> str | None:
+        example = function.examples[0]
+        try:
+            parts = shlex.split(example)
+        except ValueError:
+            return example
+        arguments = parts[1:]
+        paths = PATH_PATTERN.findall(instruction)
+        words = set(re.findall(r"[a-z0-9]+", instruction.lower()))
+        for position, value in enumerate(arguments):
+            required, default = function.arguments[position] if position < len(function.arguments) else (True, None)
+            if position == 0 and paths:
+                arguments[0] = paths[0]
+            elif not required and value == default:
+                continue
+            elif not set(re.findall(r"[a-z0-9]+", value.lower())) <= words:
+                # The example's value for this argument is not what was asked for
+                return None
+        # Quoted like the examples in the knowledge base
+        return " ".join([parts[0]] + ['"' + argument.replace('"', '\\"') + '"' for argument in arguments])
+
+    def match(self, instruction: str) -> Match | None:
+        with self._lock:
+            self.stats["lookups"] += 1
+            match = self._learned_match(instruction) or self._kb_match(instruction)
+            if match:
+                self.stats["hits"] += 1
+            # Lookups happen on every instruction, their stats are written with the next change or at exit
+            _unsaved_matchers.add(self)
+            return match
+
+    def learn(self, instruction: str, command: str, proposed: Match | None = None) -> None:
+        """Record that `command` was run for `instruction`."""
+        key = normalize_instruction(instruction)
+        if not key or not command:
+            return
+        with self._lock:
+            record = self.learned.get(key)
+            if not record or record["command"] != command:
+                record = {"command": command, "accepted": 0, "rejected": 0}
+                self.learned[key] = record
+            record["accepted"] += 1
+            if proposed and proposed.command == command:
+                self.stats["accepted"] += 1
+            self._save()
+
+    def reject(self, instruction: str, proposed: Match) -> None:
+        """Record that a proposed command was not what the user wanted."""
+        with self._lock:
+            record = self.learned.get(normalize_instruction(instruction))
+            if record and record["command"] == proposed.command:
+                record["rejected"] += 1
+                self._save()
+
+    def learn_from_messages(self, messages: Iterable[Dict]) -> int:
+        """Learn instruction/command pairs from a saved `run` conversation."""
+        learned = 0
+        instruction = None
+        for message in messages:
+            content = message.get("content")
+            if message.get("role") != "user" or not isinstance(content, str):
+                continue
+            if content.startswith(FOLLOW_UP_PREFIX):
+                instruction = content[len(FOLLOW_UP_PREFIX):]
+                continue
+            ran = RAN_PATTERN.match(content)
+            if ran and instruction and ran.group("code") == "0":
+                self.learn(instruction, ran.group("command"))
+                learned += 1
+                instruction = None
+        return learned
+
+    def hit_rate(self) -> float:
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def report(self) -> Dict:
+        return {
+            **self.stats,
+            "hit_rate": round(self.hit_rate(), 3),
+            "acceptance_rate": round(self.stats["accepted"] / self.stats["hits"], 3) if self.stats["hits"] else 0.0,
+            "learned": len(self.learned),
+        }
+
+
+@atexit.register
+def _flush_matchers():
+    for matcher in list(_unsaved_matchers):
+        try:
+            matcher.flush()
+        except OSError as e:
+            logger.debug(f"Could not save fast path stats: {e}")
+
+
+def get_store_path() -> Path:
+    return Path(os.getenv("HOME")) / ".smart" / "cache" / "fast_path.json"
+
+
+def load_matcher(kb_content: str = "", threshold: float = DEFAULT_THRESHOLD) -> FastPathMatcher:
+    return FastPathMatcher(get_store_path(), parse_functions(kb_content) if kb_content else [], threshold)
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Dict
+
+from utils.images import persistable_message
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = "header"
+RECORD_MESSAGE = "message"
+RECORD_UPDATE = "update"
+RECORD_META = "meta"
+DEFAULT_MAX_AGE_DAYS = 14
+DEFAULT_MAX_FILES = 200
+
+_open_journals = weakref.WeakSet()
+
+
+class ConversationJournal:
+    """Append-only JSONL journal of a conversation, written by a background thread.
+
+    Every new or changed message is one line, so the cost of persisting a turn
+    does not depend on the length of the conversation. Once superseded records
+    pile up the journal is compacted into a fresh file which atomically
+    replaces the old one.
+    """
+
+    def __init__(self, path: str | Path, compact_ratio: float = 2.0):
+        self.path = Path(path)
+        self.compact_ratio = compact_ratio
+        self._queue = queue.Queue()
+        # Replayed state, owned by the writer thread and used for compaction
+        self._header = {}
+        self._messages = []
+        self._meta = {}
+        self._records = 0
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+        _open_journals.add(self)
+
+    def start(self, started_at: str, model: str, messages) -> None:
+        self._queue.put(
+            {"type": RECORD_HEADER, "started_at": started_at, "model": model}
+        )
+        for index, message in enumerate(messages):
+            self.append(index, message)
+
+    def append(self, index: int, message: Dict) -> None:
+        self._queue.put(
+            {"type": RECORD_MESSAGE, "index": index, "message": persistable_message(message)}
+        )
+
+    def update(self, index: int, message: Dict) -> None:
+        self._queue.put(
+            {"type": RECORD_UPDATE, "index": index, "message": persistable_message(message)}
+        )
+
+    def record_meta(self, model: str, token_usage: int, pinned=()) -> None:
+        self._queue.put(
+            {"type": RECORD_META, "model": model, "token_usage": token_usage, "pinned": sorted(pinned)}
+        )
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        _open_journals.discard(self)
+
+    def _run(self):
+        file = None
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    if file:
+                        file.close()
+                        self._compact()
+                    return
+                if record["type"] == RECORD_HEADER:
+                    if file:
+                        file.close()
+                    self._header = {"started_at": record["started_at"], "model": record["model"]}
+                    self._messages = []
+                    self._meta = {}
+                    self._compact()
+                    file = open(self.path, "a", encoding="utf-8")
+                    continue
+                if file is None:
+                    continue
+                self._apply(record)
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                file.flush()
+                self._records += 1
+                if self._records > self.compact_ratio * len(self._messages) + 16:
+                    file.close()
+                    self._compact()
+                    file = open(self.path, "a", encoding="utf-8")
+            except Exception as e:
+                logger.warning(f"Failed to write conversation journal {self.path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _apply(self, record):
+        if record["type"] == RECORD_MESSAGE:
+            self._messages.append(record["message"])
+        elif record["type"] == RECORD_UPDATE and record["index"] < len(self._messages):
+            self._messages[record["index"]] = record["message"]
+        elif record["type"] == RECORD_META:
+            self._meta = {
+                "model": record["model"],
+                "token_usage": record["token_usage"],
+                "pinned": record.get("pinned", []),
+            }
+
+    def _compact(self):
+        records = [{"type": RECORD_HEADER, **self._header}]
+        records.extend(
+            {"type": RECORD_MESSAGE, "index": index, "message": message}
+            for index, message in enumerate(self._messages)
+        )
+        if self._meta:
+            records.append({"type": RECORD_META, **self._meta})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._records = len(records)
+
+
+def read_journal(path: str | Path) -> Dict:
+    """Replay a journal into the same document `Conversation.to_dict` produces."""
+    # Journals without a meta record leave "pinned" to the system messages, as `load_messages` does
+    document = {"started_at": None, "model": None, "messages": [], "token_usage": 0, "pinned": None}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted write
+                continue
+            if record["type"] == RECORD_HEADER:
+                document.update(started_at=record["started_at"], model=record["model"])
+                document["messages"] = []
+            elif record["type"] == RECORD_MESSAGE:
+                document["messages"].append(record["message"])
+            elif record["type"] == RECORD_UPDATE and record["index"] < len(document["messages"]):
+                document["messages"][record["index"]] = record["message"]
+            elif record["type"] == RECORD_META:
+                document.update(
+                    model=record["model"], token_usage=record["token_usage"], pinned=record.get("pinned")
+                )
+    return document
+
+
+def prune_journals(directory: str | Path, max_age_seconds: float, max_files: int) -> int:
+    """Delete journals older than `max_age_seconds` and all but the newest `max_files`.
+
+    Returns the number of journals deleted.
+    """
+    journals = []
+    for path in Path(directory).glob("*.jsonl"):
+        try:
+            journals.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    journals.sort(reverse=True)
+    now = time.time()
+    pruned = 0
+    for position, (mtime, path) in enumerate(journals):
+        if position >= max_files or now - mtime > max_age_seconds:
+            path.unlink(missing_ok=True)
+            pruned += 1
+    return pruned
+
+
+@atexit.register
+def _close_open_journals():
+    for journal in list(_open_journals):
+        journal.close()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+DEFAULT_TOP_K = 8
+BM25_K1 = 1.5
+BM25_B = 0.75
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+@dataclass
+class KBEntry:
+    """One `## function` section of a knowledge base file."""
+
+    name: str
+    text: str
+    hash: str = ""
+    terms: Dict[str, int] = field(default_factory=dict)
+
+
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        # Shared prefixes let "clean" match "cleanup" and "temp" match "temporary"
+        if len(token) >= 4:
+            terms.append(token[:4] + "*")
+    return terms
+
+
+def parse_kb(content: str) -> tuple[str, List[KBEntry]]:
+    """Split Markdown into the text before the first `## ` heading and one entry per heading."""
+    preamble_lines = []
+    entries = []
+    for line in content.splitlines(keepends=True):
+        if line.startswith("## "):
+            name = line[3:].strip().strip("`")
+            entries.append(KBEntry(name=name, text=line))
+        elif entries:
+            entries[-1].text += line
+        else:
+            preamble_lines.append(line)
+    for entry in entries:
+        entry.hash = hashlib.sha256(entry.text.encode("utf-8")).hexdigest()
+    return "".join(preamble_lines), entries
+
+
+class KBIndex:
+    """BM25 index over knowledge base entries."""
+
+    def __init__(self, preamble: str, entries: List[KBEntry]):
+        self.preamble = preamble
+        self.entries = entries
+        self.lengths = [sum(entry.terms.values()) for entry in entries]
+        self.average_length = sum(self.lengths) / len(entries) if entries else 0.0
+        self.document_frequency = Counter(term for entry in entries for term in entry.terms)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K) -> List[KBEntry]:
+        query_terms = set(tokenize(query))
+        count = len(self.entries)
+        scores = []
+        for position, entry in enumerate(self.entries):
+            score = 0.0
+            for term in query_terms:
+                frequency = entry.terms.get(term)
+                if not frequency:
+                    continue
+                df = self.document_frequency[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                norm = 1 - BM25_B + BM25_B * self.lengths[position] / (self.average_length or 1)
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+            if score > 0:
+                scores.append((score, position))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [self.entries[position] for _, position in scores[:k]]
+
+    @staticmethod
+    def render(entries: List[KBEntry]) -> str:
+        return "".join(entry.text.rstrip("\n") + "\n\n" for entry in entries)
+
+
+def get_index_dir() -> Path:
+    return Path(os.getenv("HOME")) / ".smart" / "cache" / "kb"
+
+
+def load_kb_index(kb_path: str | Path) -> KBIndex:
+    """Load the index for a knowledge base file, rebuilding it when the file changed.
+
+    Entries whose text did not change keep their stored term frequencies, so
+    edits to a large knowledge base only re-tokenize the edited sections.
+    """
+    kb_path = Path(kb_path).resolve()
+    stat = kb_path.stat()
+    index_path = get_index_dir() / f"{hashlib.sha256(str(kb_path).encode('utf-8')).hexdigest()}.json"
+    stored = None
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if (
+            stored
+            and stored.get("version") == INDEX_VERSION
+            and stored.get("mtime_ns") == stat.st_mtime_ns
+            and stored.get("size") == stat.st_size
+    ):
+        entries = [KBEntry(**entry) for entry in stored["entries"]]
+        return KBIndex(stored["preamble"], entries)
+
+    known_terms = {entry["hash"]: entry["terms"] for entry in (stored or {}).get("entries", [])}
+    preamble, entries = parse_kb(kb_path.read_text())
+    for entry in entries:
+        entry.terms = known_terms.get(entry.hash) or dict(Counter(tokenize(entry.text)))
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": INDEX_VERSION,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "preamble": preamble,
+                "entries": [entry.__dict__ for entry in entries],
+            },
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp_path, index_path)
+    return KBIndex(preamble, entries)
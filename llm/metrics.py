@@ -0,0 +1,321 @@
+"""Per-request metrics of LLM calls.
+
+Every chat completion is recorded as a span: command, profile and model, the
+time spent waiting for the rate limiter, time to first token, total latency,
+token counts, retries and whether the reply came from the response cache.
+Spans are appended to a rolling JSONL store under `~/.smart/metrics` and can
+be summarized into percentiles or exported as OTLP JSON or Prometheus text.
+"""
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+from utils.config import SmartConfig, read_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+PERCENTILES = (50, 95, 99)
+SERVICE_NAME = "smart"
+
+# The command being run: the CLI sets it for the process, the daemon per request
+_process_command = None
+_command = contextvars.ContextVar("smart_command", default=None)
+# The span of the request in flight, so the scheduler can add its waits and retries
+_current_span = contextvars.ContextVar("smart_request_span", default=None)
+
+
+def set_command(command: str | None) -> None:
+    global _process_command
+    _process_command = command
+
+
+@contextmanager
+def command_scope(command: str | None) -> Iterator[None]:
+    token = _command.set(command)
+    try:
+        yield
+    finally:
+        _command.reset(token)
+
+
+def current_command() -> str | None:
+    return _command.get() or _process_command
+
+
+@dataclass
+class RequestSpan:
+    """One LLM request, from the caller's point of view."""
+
+    name: str
+    model: str | None = None
+    profile: str | None = None
+    command: str | None = field(default_factory=current_command)
+    stream: bool = False
+    start_time: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.monotonic, repr=False)
+    queue_time: float = 0.0
+    ttft: float | None = None
+    latency: float | None = None
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    cache_hit: bool = False
+    retries: int = 0
+    error: str | None = None
+    trace_id: str = field(default_factory=lambda: os.urandom(16).hex())
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    _recorded: bool = field(default=False, repr=False)
+
+    @contextmanager
+    def active(self) -> Iterator[RequestSpan]:
+        """Make this the span the scheduler reports to while the request is sent."""
+        token = _current_span.set(self)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+
+    def set_usage(self, usage) -> None:
+        if usage:
+            self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+            self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        """Record the span once; later calls are ignored."""
+        if self._recorded:
+            return
+        self._recorded = True
+        self.latency = time.monotonic() - self.started
+        if error is not None:
+            self.error = type(error).__name__
+        get_metrics_store().append(self.to_record())
+
+    def to_record(self) -> Dict:
+        record = asdict(self)
+        record.pop("started")
+        record.pop("_recorded")
+        return record
+
+
+def note_queue_time(seconds: float) -> None:
+    span = _current_span.get()
+    if span is not None and seconds > 0:
+        span.queue_time += seconds
+
+
+def note_retry() -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.retries += 1
+
+
+def note_route(profile: str, model: str) -> None:
+    """The profile and model that actually served the request, after failover."""
+    span = _current_span.get()
+    if span is not None:
+        span.profile = profile
+        span.model = model
+
+
+def record_cache_hit(model: str | None) -> None:
+    span = RequestSpan("chat.completions", model=model, profile=SmartConfig.get_current_profile(), cache_hit=True)
+    span.ttft = 0.0
+    span.finish()
+
+
+class MetricsStore:
+    """Append-only JSONL file of spans, rolled over to one `.1` file when full."""
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    @property
+    def rolled_path(self) -> Path:
+        return self.path.with_suffix(".1.jsonl")
+
+    def append(self, record: Dict) -> None:
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                    os.replace(self.path, self.rolled_path)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                logger.debug(f"Could not record metrics: {e}")
+
+    def read(self, since: float | None = None) -> List[Dict]:
+        records = []
+        for path in (self.rolled_path, self.path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if since is None or record.get("start_time", 0) >= since:
+                            records.append(record)
+            except FileNotFoundError:
+                continue
+        return records
+
+
+@functools.lru_cache(maxsize=1)
+def get_metrics_store() -> MetricsStore:
+    config = read_config()
+    return MetricsStore(
+        Path(os.getenv("HOME")) / ".smart" / "metrics" / "requests.jsonl",
+        max_bytes=int(config.get("metrics_max_bytes", DEFAULT_MAX_BYTES)),
+        enabled=str(config.get("metrics_disabled", "false")).lower() not in ("1", "true", "yes"),
+    )
+
+
+def percentile(values: List[float], p: float) -> float | None:
+    """Nearest-rank percentile of `values`."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(records: Iterable[Dict]) -> List[Dict]:
+    """Counts and latency percentiles per (command, model)."""
+    groups: Dict[tuple, List[Dict]] = {}
+    for record in records:
+        groups.setdefault((record.get("command") or "-", record.get("model") or "-"), []).append(record)
+    summary = []
+    for (command, model), group in sorted(groups.items()):
+        served = [r for r in group if not r.get("cache_hit") and not r.get("error")]
+        latencies = [r["latency"] for r in served if r.get("latency") is not None]
+        ttfts = [r["ttft"] for r in served if r.get("ttft") is not None]
+        row = {
+            "command": command,
+            "model": model,
+            "requests": len(group),
+            "errors": sum(1 for r in group if r.get("error")),
+            "cache_hits": sum(1 for r in group if r.get("cache_hit")),
+            "retries": sum(r.get("retries") or 0 for r in group),
+            "queue_time": sum(r.get("queue_time") or 0 for r in group),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in group),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in group),
+        }
+        for p in PERCENTILES:
+            row[f"latency_p{p}"] = percentile(latencies, p)
+            row[f"ttft_p{p}"] = percentile(ttfts, p)
+        summary.append(row)
+    return summary
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(records: Iterable[Dict]) -> str:
+    """Prometheus text exposition of the summary, latencies as summaries with quantiles."""
+    lines = []
+    metrics = [
+        ("smart_request_latency_seconds", "summary", "Latency of LLM requests"),
+        ("smart_request_ttft_seconds", "summary", "Time to first token of streamed LLM requests"),
+        ("smart_requests_total", "counter", "LLM requests, including cache hits"),
+        ("smart_request_errors_total", "counter", "Failed LLM requests"),
+        ("smart_cache_hits_total", "counter", "Replies served from the response cache"),
+        ("smart_request_retries_total", "counter", "Retried LLM requests"),
+        ("smart_queue_seconds_total", "counter", "Time requests waited for the rate limiter"),
+        ("smart_tokens_total", "counter", "Tokens used by LLM requests"),
+    ]
+    summary = summarize(records)
+    for name, kind, description in metrics:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for row in summary:
+            labels = f'command="{_label_value(row["command"])}",model="{_label_value(row["model"])}"'
+            if kind == "summary":
+                prefix = "latency" if name == "smart_request_latency_seconds" else "ttft"
+                for p in PERCENTILES:
+                    value = row[f"{prefix}_p{p}"]
+                    if value is not None:
+                        lines.append(f'{name}{{{labels},quantile="{p / 100}"}} {value:.6f}')
+            elif name == "smart_requests_total":
+                lines.append(f"{name}{{{labels}}} {row['requests']}")
+            elif name == "smart_request_errors_total":
+                lines.append(f"{name}{{{labels}}} {row['errors']}")
+            elif name == "smart_cache_hits_total":
+                lines.append(f"{name}{{{labels}}} {row['cache_hits']}")
+            elif name == "smart_request_retries_total":
+                lines.append(f"{name}{{{labels}}} {row['retries']}")
+            elif name == "smart_queue_seconds_total":
+                lines.append(f"{name}{{{labels}}} {row['queue_time']:.6f}")
+            else:
+                lines.append(f'{name}{{{labels},kind="prompt"}} {row["prompt_tokens"]}')
+                lines.append(f'{name}{{{labels},kind="completion"}} {row["completion_tokens"]}')
+    return "\n".join(lines) + "\n"
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(records: Iterable[Dict]) -> Dict:
+    """OTLP/HTTP JSON trace export, one span per request with GenAI-style attributes."""
+    attribute_names = {
+        "command": "smart.command",
+        "profile": "smart.profile",
+        "model": "gen_ai.request.model",
+        "stream": "smart.stream",
+        "queue_time": "smart.queue_time",
+        "ttft": "smart.ttft",
+        "prompt_tokens": "gen_ai.usage.input_tokens",
+        "completion_tokens": "gen_ai.usage.output_tokens",
+        "cache_hit": "smart.cache_hit",
+        "retries": "smart.retries",
+    }
+    spans = []
+    for record in records:
+        start = int(record["start_time"] * 1e9)
+        span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 3,  # SPAN_KIND_CLIENT
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int((record.get("latency") or 0) * 1e9)),
+            "attributes": [
+                _otlp_attribute(attribute, record[key])
+                for key, attribute in attribute_names.items()
+                if record.get(key) is not None
+            ],
+            "status": {"code": 2, "message": record["error"]} if record.get("error") else {"code": 1},
+        }
+        spans.append(span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "llm.metrics"}, "spans": spans}],
+            }
+        ]
+    }
@@ -24,7 +24,7 @@ Functions and descriptions:
 {knowledge_file_content}
 <<<end_knowledge_file>>>
 
-Respond only with the complete shell command.
+Respond only with the complete shell command, or call the propose_command tool with it when it is available.
 """
 
 # Template for generating emoji representation
@@ -61,6 +61,37 @@ You are a text enhancement assistant. Your task is to enhance the provided user
 Respond only with the enhanced text.
 """
 
+conversation_summary_prompt = """
+You are an assistant that condenses earlier parts of a conversation so it can continue within a limited context window.
+
+Summarize the conversation below, merging it with the existing summary if one is given.
+Keep facts, decisions, file names, commands and open questions. Drop greetings and repetition.
+
+Respond only with the summary.
+"""
+
+chunk_summary_prompt = """
+You are an assistant that summarizes one chunk of a large file that is processed in several parts.
+
+Summarize the chunk, keeping details that matter for the user's question if one is given: errors, warnings, names, numbers and timestamps.
+Do not speculate about the parts of the file you cannot see.
+
+Respond only with the summary.
+"""
+
+reduce_summary_prompt = """
+You are an assistant that combines summaries of consecutive chunks of a large file into one answer.
+
+Merge the partial summaries below into a single coherent summary, removing repetition.
+If the user asked a question, answer it based on the summaries.
+
+Respond in Markdown format.
+"""
+
+retrieved_knowledge_note = """
+The knowledge file is too large to include here. The entries relevant to each request are provided in the conversation.
+"""
+
 
 def build_generic_prompt() -> str:
     return generic_system_prompt
@@ -84,5 +115,21 @@ def build_text_enhancement_prompt() -> str:
     return text_enhancement_prompt
 
 
+def build_conversation_summary_prompt() -> str:
+    return conversation_summary_prompt
+
+
+def build_chunk_summary_prompt() -> str:
+    return chunk_summary_prompt
+
+
+def build_reduce_summary_prompt() -> str:
+    return reduce_summary_prompt
+
+
+def build_retrieved_knowledge_note() -> str:
+    return retrieved_knowledge_note
+
+
 def build_prompt(template: str, args: Dict) -> str:
     return template.format(**args)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket refilled at `per_minute`, resynced from rate-limit headers.
+
+    It holds at most `capacity` tokens, a minute's worth unless given. Callers
+    serialize access with a lock of their own.
+    """
+
+    def __init__(self, per_minute: float | None, capacity: float | None = None):
+        self.per_minute = per_minute
+        self.capacity = capacity
+        self.tokens = float(capacity or per_minute or 0)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            elapsed = now - self.updated_at
+            self.tokens = min(self.capacity or self.per_minute, self.tokens + elapsed * self.per_minute / 60)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount`, possibly going into debt, and return how long to wait for it."""
+        if not self.per_minute:
+            return max(0.0, self.blocked_until - now)
+        self._refill(now)
+        self.tokens -= amount
+        wait = 0.0 if self.tokens >= 0 else -self.tokens * 60 / self.per_minute
+        return max(wait, self.blocked_until - now)
+
+    def sync(self, limit: float | None, remaining: float | None, reset: float | None, now: float) -> None:
+        known = self.per_minute
+        if limit:
+            self.per_minute = limit
+        if remaining is None:
+            return
+        self._refill(now)
+        # Requests still in flight are not in the server's count yet, keep the lower figure
+        self.tokens = min(self.tokens, remaining) if known else remaining
+        if remaining <= 0 and reset:
+            self.blocked_until = max(self.blocked_until, now + reset)
+
+
+class RateLimiter:
+    """Thread-safe limit of `rate` requests per second on average, `burst` at once."""
+
+    def __init__(self, rate: float | None, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._bucket = TokenBucket(rate * 60 if rate else None, capacity=self.burst)
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # Takes a token, possibly going into debt, and returns how long to wait
+        with self._lock:
+            return self._bucket.reserve(1, time.monotonic())
+
+    def acquire(self) -> float:
+        """Block until a request may be sent, returning the time waited."""
+        if not self.rate:
+            return 0.0
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """Like `acquire`, but waits without blocking the event loop."""
+        if not self.rate:
+            return 0.0
+        wait = self._reserve()
+        if wait > 0:
+            import asyncio
+
+            await asyncio.sleep(wait)
+        return wait
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import queue
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Awaitable, Callable, List, Tuple, TypeVar
+
+from llm.scheduler import is_retryable
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errors another profile may not have: bad key, no access or no such model there
+FAILOVER_STATUS_CODES = (401, 403, 404)
+DEFAULT_FAILOVER_RETRIES = 0
+
+
+def should_fail_over(error: Exception) -> bool:
+    return is_retryable(error) or getattr(error, "status_code", None) in FAILOVER_STATUS_CODES
+
+
+@dataclass(frozen=True)
+class Route:
+    """A profile a request can be sent to."""
+
+    profile: str
+    config: object = field(compare=False)
+    primary: bool = False
+    # Retries before moving on to the next route, None for the scheduler's full budget
+    max_retries: int | None = None
+
+    def model_for(self, model: str) -> str:
+        # The primary keeps the conversation's model, a fallback uses its own
+        if self.primary:
+            return model
+        return self.config.model or model
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    """Where a profile's requests go when it fails or is slow.
+
+    `fallbacks` are tried in order after the profile itself fails. Every route
+    but the last is retried at most `failover_retries` times, so a failing
+    profile hands over quickly. With `hedge_after`, the first fallback is also
+    started when the profile has not answered within that many seconds, and
+    whichever answers first wins.
+    """
+
+    fallbacks: Tuple[str, ...] = ()
+    hedge_after: float | None = None
+    failover_retries: int = DEFAULT_FAILOVER_RETRIES
+
+    @classmethod
+    def from_config(cls, config) -> RoutingPolicy:
+        fallbacks = config.get("fallback_profiles") or ""
+        hedge_after = config.get("hedge_after")
+        return cls(
+            fallbacks=tuple(name.strip() for name in fallbacks.split(",") if name.strip()),
+            hedge_after=float(hedge_after) if hedge_after else None,
+            failover_retries=int(config.get("failover_retries", DEFAULT_FAILOVER_RETRIES)),
+        )
+
+    def routes(self, profile: str, config) -> List[Route]:
+        routes = [Route(profile, config, primary=True)]
+        for name in self.fallbacks:
+            if name == profile:
+                continue
+            if name not in config.profiles:
+                logger.warning(f"Fallback profile {name} not found, skipping it")
+                continue
+            routes.append(Route(name, config.for_profile(name)))
+        # Only the last route, with nothing to fail over to, uses the full retry budget
+        return [replace(route, max_retries=self.failover_retries) for route in routes[:-1]] + routes[-1:]
+
+
+_NO_RESULT = object()
+
+
+async def race(
+        start: Callable[[Route], Awaitable[T]],
+        routes: List[Route],
+        hedge_after: float | None = None,
+        discard: Callable[[T], Awaitable[None]] | None = None,
+) -> T:
+    """Result of `start(route)` from the first route that succeeds.
+
+    Routes are tried in order, moving on when an attempt fails with an error
+    `should_fail_over` accepts. With `hedge_after`, the second route is started
+    alongside the first if that has not finished in time; the first success
+    wins and the other attempt is cancelled. Results that lose the race are
+    passed to `discard` so open streams get closed.
+    """
+    import asyncio
+
+    remaining = list(routes)
+    running = {}
+    error = None
+    hedged = hedge_after is None
+
+    def launch():
+        route = remaining.pop(0)
+        running[asyncio.ensure_future(start(route))] = route
+
+    launch()
+    try:
+        while running:
+            timeout = hedge_after if not hedged and remaining else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                slow = next(iter(running.values())).profile
+                logger.info(f"No answer from {slow} after {hedge_after}s, hedging with {remaining[0].profile}")
+                launch()
+                continue
+            winner = _NO_RESULT
+            for task in done:
+                route = running.pop(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    if not should_fail_over(error):
+                        raise error
+                    logger.warning(f"Profile {route.profile} failed ({error})")
+                elif winner is _NO_RESULT:
+                    winner = task.result()
+                elif discard:
+                    await discard(task.result())
+            if winner is not _NO_RESULT:
+                return winner
+            # Keep as many attempts going as before the failure, one more once hedged
+            while remaining and len(running) < (2 if hedged and hedge_after else 1):
+                logger.warning(f"Failing over to profile {remaining[0].profile}")
+                launch()
+        raise error
+    finally:
+        for task in running:
+            task.cancel()
+        for result in await asyncio.gather(*running, return_exceptions=True):
+            if discard and not isinstance(result, BaseException):
+                await discard(result)
+
+
+def race_threads(
+        start: Callable[[Route], T],
+        routes: List[Route],
+        hedge_after: float | None = None,
+) -> T:
+    """Blocking counterpart of `race` for the sync clients.
+
+    Each attempt runs in a daemon thread on the caller's pooled client, with
+    the caller's context so spans and schedulers see it. A blocking request
+    cannot be cancelled, so an attempt that loses is left to finish in the
+    background and its result is dropped.
+    """
+    results: queue.Queue = queue.Queue()
+    remaining = list(routes)
+    running = 0
+    error = None
+    hedged = hedge_after is None
+
+    def attempt(route: Route):
+        try:
+            results.put((route, start(route), None))
+        except Exception as e:
+            results.put((route, None, e))
+
+    def launch():
+        nonlocal running
+        route = remaining.pop(0)
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run, args=(attempt, route), name=f"hedge-{route.profile}", daemon=True
+        ).start()
+        running += 1
+
+    launch()
+    while running:
+        timeout = hedge_after if not hedged and remaining else None
+        try:
+            route, result, failure = results.get(timeout=timeout)
+        except queue.Empty:
+            hedged = True
+            logger.info(f"No answer from {routes[0].profile} after {hedge_after}s, hedging with {remaining[0].profile}")
+            launch()
+            continue
+        running -= 1
+        if failure is None:
+            return result
+        error = failure
+        if not should_fail_over(error):
+            raise error
+        logger.warning(f"Profile {route.profile} failed ({error})")
+        # Keep as many attempts going as before the failure, one more once hedged
+        while remaining and running < (2 if hedged and hedge_after else 1):
+            logger.warning(f"Failing over to profile {remaining[0].profile}")
+            launch()
+    raise error
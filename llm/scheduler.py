@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Mapping, TypeVar
+
+from llm.metrics import note_queue_time, note_retry
+from llm.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 30.0
+DEFAULT_RETRY_DEADLINE = 120.0
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# The scheduler of the request being sent on this thread or task, so the
+# transport can hand it the rate-limit headers of the response
+_current_scheduler: contextvars.ContextVar = contextvars.ContextVar("current_scheduler", default=None)
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Seconds in a rate-limit reset header such as `1s`, `6m0s`, `20ms` or `0.5`."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after(error) -> float | None:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    # Connection errors of the OpenAI SDK, Portkey's vendored copy of it and httpx
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"APIConnectionError", "APITimeoutError", "TransportError"})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_retries: int = DEFAULT_MAX_RETRIES
+    base_delay: float = DEFAULT_RETRY_BASE_DELAY
+    max_delay: float = DEFAULT_RETRY_MAX_DELAY
+    deadline: float = DEFAULT_RETRY_DEADLINE
+
+    @classmethod
+    def from_config(cls, config) -> RetryPolicy:
+        return cls(
+            max_retries=int(config.get("max_retries", DEFAULT_MAX_RETRIES)),
+            base_delay=float(config.get("retry_base_delay", DEFAULT_RETRY_BASE_DELAY)),
+            max_delay=float(config.get("retry_max_delay", DEFAULT_RETRY_MAX_DELAY)),
+            deadline=float(config.get("retry_deadline", DEFAULT_RETRY_DEADLINE)),
+        )
+
+    def backoff(self, attempt: int, server_delay: float | None = None) -> float:
+        # Full jitter keeps clients that failed together from retrying together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+
+def _header_float(headers: Mapping, name: str) -> float | None:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Paces and retries the requests of one profile.
+
+    Requests wait for both a request and a token budget; the budgets start from
+    `rpm_limit` / `tpm_limit` and follow the `x-ratelimit-*` headers the server
+    sends. Throttling (429), timeouts and 5xx errors are retried with jittered
+    exponential backoff until `max_retries` or the overall deadline is reached.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            rpm: float | None = None,
+            tpm: float | None = None,
+            retry: RetryPolicy = RetryPolicy(),
+    ):
+        self.name = name
+        self.retry = retry
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, name: str, config) -> RequestScheduler:
+        rpm = config.get("rpm_limit")
+        tpm = config.get("tpm_limit")
+        return cls(
+            name,
+            rpm=float(rpm) if rpm else None,
+            tpm=float(tpm) if tpm else None,
+            retry=RetryPolicy.from_config(config),
+        )
+
+    @property
+    def counts_tokens(self) -> bool:
+        """Whether callers need to estimate prompt tokens for the token budget."""
+        return bool(self._tokens.per_minute)
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._requests.reserve(1, now), self._tokens.reserve(tokens, now))
+            self.throttled_seconds += wait
+            return wait
+
+    def observe(self, headers: Mapping, status_code: int | None = None) -> None:
+        """Resync the budgets from the rate-limit headers of a response."""
+        now = time.monotonic()
+        with self._lock:
+            self._requests.sync(
+                _header_float(headers, "x-ratelimit-limit-requests"),
+                _header_float(headers, "x-ratelimit-remaining-requests"),
+                parse_duration(headers.get("x-ratelimit-reset-requests")),
+                now,
+            )
+            self._tokens.sync(
+                _header_float(headers, "x-ratelimit-limit-tokens"),
+                _header_float(headers, "x-ratelimit-remaining-tokens"),
+                parse_duration(headers.get("x-ratelimit-reset-tokens")),
+                now,
+            )
+            if status_code == 429:
+                delay = parse_duration(headers.get("retry-after"))
+                if delay:
+                    self._requests.blocked_until = max(self._requests.blocked_until, now + delay)
+
+    def _retry_delay(
+            self, error: Exception, attempt: int, started_at: float, max_retries: int | None
+    ) -> float | None:
+        if max_retries is None or max_retries > self.retry.max_retries:
+            max_retries = self.retry.max_retries
+        if not is_retryable(error) or attempt >= max_retries:
+            return None
+        delay = self.retry.backoff(attempt, retry_after(error))
+        if time.monotonic() - started_at + delay > self.retry.deadline:
+            return None
+        self.retries += 1
+        note_retry()
+        logger.warning(
+            f"Request to {self.name} failed ({error}), retry {attempt + 1} in {delay:.1f}s"
+        )
+        return delay
+
+    def call(self, fn: Callable[[], T], tokens: int = 0, max_retries: int | None = None) -> T:
+        """Send `fn` once the budgets allow, retrying up to `max_retries` (the policy's) times."""
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            note_queue_time(wait)
+            if wait > 0:
+                time.sleep(wait)
+            context = _current_scheduler.set(self)
+            try:
+                self.sent += 1
+                return fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, started_at, max_retries)
+                if delay is None:
+                    raise
+            finally:
+                _current_scheduler.reset(context)
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, fn, tokens: int = 0, max_retries: int | None = None):
+        import asyncio
+
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            note_queue_time(wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            context = _current_scheduler.set(self)
+            try:
+                self.sent += 1
+                return await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, started_at, max_retries)
+                if delay is None:
+                    raise
+            finally:
+                _current_scheduler.reset(context)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict:
+        return {
+            "profile": self.name,
+            "requests": self.sent,
+            "retries": self.retries,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "rpm": self._requests.per_minute,
+            "tpm": self._tokens.per_minute,
+        }
+
+
+def observe_response(response) -> None:
+    """Transport hook: feed the response headers to the scheduler that sent the request."""
+    scheduler = _current_scheduler.get()
+    if scheduler is not None:
+        scheduler.observe(response.headers, response.status_code)
+
+
+_schedulers: Dict[str, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(profile: str, config) -> RequestScheduler:
+    """The scheduler of `profile`, shared by every client of the process."""
+    with _schedulers_lock:
+        if profile not in _schedulers:
+            _schedulers[profile] = RequestScheduler.from_config(profile, config)
+        return _schedulers[profile]
+
+
+def scheduler_stats() -> list:
+    with _schedulers_lock:
+        return [scheduler.stats() for scheduler in _schedulers.values()]
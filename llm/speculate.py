@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+from concurrent.futures import CancelledError
+from typing import Any, Awaitable, Callable, Dict
+
+from llm.transport import aclose_http_clients
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE_SECONDS = 0.4
+DEFAULT_MIN_CHARS = 6
+# Text that only differs from the speculated input by these is the same request
+_TRAILING_NOISE = re.compile(r"[\s.!?,;:]*$")
+
+
+def _normalize(text: str) -> str:
+    return _TRAILING_NOISE.sub("", " ".join(text.split()).lower())
+
+
+def is_reusable(speculated: str, final: str) -> bool:
+    """Whether the reply for `speculated` answers `final` as well.
+
+    The final text must match the speculated text or only extend it with
+    whitespace and punctuation; any further words change the request.
+    """
+    return bool(speculated) and _normalize(speculated) == _normalize(final)
+
+
+class Speculator:
+    """Sends the request for partially typed input in the background.
+
+    Keystrokes are debounced; when the user pauses, `fetch` runs for the text
+    so far on a private event loop, cancelling the previous speculation. When
+    the input is submitted, `result_for` hands back the speculated reply if it
+    was made for the same text, so the user does not wait for a round trip.
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[str], Awaitable[Any]],
+            debounce: float = DEFAULT_DEBOUNCE_SECONDS,
+            min_chars: int = DEFAULT_MIN_CHARS,
+    ):
+        self.fetch = fetch
+        self.debounce = debounce
+        self.min_chars = min_chars
+        self.fired = 0
+        self.cancelled = 0
+        self.reused = 0
+        self._text = None
+        self._task = None
+        self._timer = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="speculate", daemon=True)
+        self._thread.start()
+
+    def on_text_changed(self, text: str) -> None:
+        """Called from the prompt on every edit."""
+        self._loop.call_soon_threadsafe(self._schedule, text)
+
+    def _schedule(self, text: str) -> None:
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self.debounce, self._fire, text)
+
+    def _fire(self, text: str) -> None:
+        self._timer = None
+        text = text.strip()
+        if len(text) < self.min_chars or text[0] in "/!:":
+            return
+        if self._task and is_reusable(self._text, text):
+            return
+        self._cancel_task()
+        self._text = text
+        self._task = self._loop.create_task(self.fetch(text))
+        self.fired += 1
+
+    def _cancel_task(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            self.cancelled += 1
+        self._task = None
+        self._text = None
+
+    async def _claim(self, text: str) -> Any | None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        task, speculated = self._task, self._text
+        self._task, self._text = None, None
+        if not task or not is_reusable(speculated, text):
+            if task and not task.done():
+                task.cancel()
+                self.cancelled += 1
+            return None
+        try:
+            result = await task
+        except Exception as e:
+            logger.debug(f"Speculative request failed: {e}")
+            return None
+        self.reused += 1
+        return result
+
+    def result_for(self, text: str) -> Any | None:
+        """The speculated reply for the submitted `text`, waiting for it if still in flight."""
+        try:
+            return asyncio.run_coroutine_threadsafe(self._claim(text), self._loop).result()
+        except CancelledError:
+            # The speculated request was cancelled while the claim waited for it
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"fired": self.fired, "cancelled": self.cancelled, "reused": self.reused}
+
+    async def _shutdown(self) -> None:
+        self._cancel_task()
+        await aclose_http_clients()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
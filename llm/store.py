@@ -0,0 +1,274 @@
+"""SQLite store of saved conversations for listing, search and resume.
+
+Each conversation is one row with its model, token usage, timestamps and a
+title taken from the first user message; its messages are rows of their own,
+stored as the JSON documents `Conversation.to_dict` produces. Message text is
+indexed with FTS5 when the SQLite build has it, otherwise search falls back to
+a LIKE scan of the same text.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+TITLE_CHARS = 80
+IMPORTED_KEY = "imported:{}"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    started_at TEXT,
+    saved_at REAL NOT NULL,
+    model TEXT,
+    token_usage INTEGER NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    title TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS conversations_started_at ON conversations (started_at);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, position)
+);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+    text, conversation_id UNINDEXED, position UNINDEXED, tokenize = 'porter unicode61'
+);
+"""
+
+
+def message_text(message: Dict) -> str:
+    """Searchable text of a message, images become a placeholder."""
+    content = message.get("content")
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+            elif isinstance(block, dict) and block.get("type") == "image_url":
+                parts.append("[image]")
+            else:
+                parts.append(str(block))
+        content = "\n".join(parts)
+    text = content if isinstance(content, str) else ""
+    for call in message.get("tool_calls") or []:
+        function = call.get("function", {})
+        text += f"\n{function.get('name')}({function.get('arguments')})"
+    return text
+
+
+def _title(messages: List[Dict]) -> str:
+    for message in messages:
+        if message.get("role") == "user":
+            text = " ".join(message_text(message).split())
+            if text:
+                return text[:TITLE_CHARS]
+    return ""
+
+
+@dataclass
+class ConversationSummary:
+    id: int
+    started_at: str | None
+    model: str | None
+    token_usage: int
+    message_count: int
+    title: str
+    snippet: str | None = None
+
+
+def _fts_query(query: str) -> str:
+    # Every word must appear, quoted so FTS5 syntax in user input is taken literally
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class ConversationStore:
+    """Saved conversations in one SQLite database, safe to share between threads."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            try:
+                self._db.executescript(_FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError as e:
+                logger.info(f"FTS5 unavailable, searching without an index: {e}")
+                self.has_fts = False
+            self._db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _meta(self, key: str) -> str | None:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def save(self, document: Dict, source: str | None = None) -> int:
+        """Store a conversation document; saving the same `source` again replaces it."""
+        messages = document.get("messages", [])
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id FROM conversations WHERE source = ?", (source,)).fetchone() \
+                if source else None
+            values = (
+                document.get("started_at"),
+                time.time(),
+                document.get("model"),
+                document.get("token_usage") or 0,
+                len(messages),
+                _title(messages),
+            )
+            if row:
+                conversation_id = row["id"]
+                self._db.execute(
+                    "UPDATE conversations SET started_at = ?, saved_at = ?, model = ?, token_usage = ?, "
+                    "message_count = ?, title = ? WHERE id = ?",
+                    (*values, conversation_id),
+                )
+                self._db.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                if self.has_fts:
+                    self._db.execute("DELETE FROM message_search WHERE conversation_id = ?", (conversation_id,))
+            else:
+                conversation_id = self._db.execute(
+                    "INSERT INTO conversations (started_at, saved_at, model, token_usage, message_count, title, "
+                    "source) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*values, source),
+                ).lastrowid
+            rows = [
+                (conversation_id, position, message.get("role", ""), message_text(message),
+                 json.dumps(message, ensure_ascii=False))
+                for position, message in enumerate(messages)
+            ]
+            self._db.executemany(
+                "INSERT INTO messages (conversation_id, position, role, text, body) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            if self.has_fts:
+                self._db.executemany(
+                    "INSERT INTO message_search (text, conversation_id, position) VALUES (?, ?, ?)",
+                    [(text, conversation_id, position) for conversation_id, position, _, text, _ in rows
+                     if text and not text.startswith("[DELETED]")],
+                )
+        return conversation_id
+
+    def recent(self, limit: int = 20, offset: int = 0) -> List[ConversationSummary]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, started_at, model, token_usage, message_count, title FROM conversations "
+                "ORDER BY started_at DESC, id DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [ConversationSummary(**dict(row)) for row in rows]
+
+    def search(self, query: str, limit: int = 20) -> List[ConversationSummary]:
+        """Conversations with a message matching every word of `query`, most recently saved first."""
+        words = query.split()
+        if not words:
+            return []
+        if self.has_fts:
+            # Ranking by relevance would score every match, by rowid the index stops at the limit
+            sql = (
+                "SELECT c.id, c.started_at, c.model, c.token_usage, c.message_count, c.title, "
+                "snippet(message_search, 0, '[', ']', '…', 12) AS snippet "
+                "FROM message_search JOIN conversations c ON c.id = message_search.conversation_id "
+                "WHERE message_search MATCH ? ORDER BY message_search.rowid DESC LIMIT ? OFFSET ?"
+            )
+            parameters = [_fts_query(query)]
+        else:
+            sql = (
+                "SELECT c.id, c.started_at, c.model, c.token_usage, c.message_count, c.title, "
+                "substr(m.text, 1, 120) AS snippet "
+                "FROM messages m JOIN conversations c ON c.id = m.conversation_id WHERE "
+                + " AND ".join("m.text LIKE ?" for _ in words)
+                + " ORDER BY m.rowid DESC LIMIT ? OFFSET ?"
+            )
+            parameters = [f"%{word}%" for word in words]
+        # One result per conversation, with its latest matching message; several
+        # messages of a conversation can match, so read pages until there are enough
+        results = {}
+        page = limit * 5
+        offset = 0
+        with self._lock:
+            while len(results) < limit:
+                rows = self._db.execute(sql, (*parameters, page, offset)).fetchall()
+                for row in rows:
+                    if row["id"] not in results:
+                        results[row["id"]] = ConversationSummary(**dict(row))
+                if len(rows) < page:
+                    break
+                offset += page
+        return list(results.values())[:limit]
+
+    def load(self, conversation_id: int) -> Dict | None:
+        """The conversation document as saved, with the `source` it was saved from, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT started_at, model, token_usage, source FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            messages = self._db.execute(
+                "SELECT body FROM messages WHERE conversation_id = ? ORDER BY position", (conversation_id,)
+            ).fetchall()
+        return {**dict(row), "messages": [json.loads(message["body"]) for message in messages]}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM conversations").fetchone()[0]
+
+    def import_directory(self, directory: Path, force: bool = False) -> int:
+        """Import the saved JSON conversations in `directory`, once unless `force`."""
+        key = IMPORTED_KEY.format(directory.resolve())
+        with self._lock:
+            if self._meta(key) and not force:
+                return 0
+        imported = 0
+        for file_path in sorted(directory.glob("*.json")):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping {file_path}: {e}")
+                continue
+            if not isinstance(document, dict) or not isinstance(document.get("messages"), list):
+                continue
+            self.save(document, source=str(file_path.resolve()))
+            imported += 1
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(time.time())))
+        return imported
+
+
+def get_saved_conversations_dir() -> Path:
+    return Path(os.getenv("HOME")) / "Documents" / "Smart" / "Conversations"
+
+
+@functools.lru_cache(maxsize=1)
+def get_conversation_store() -> ConversationStore:
+    return ConversationStore(Path(os.getenv("HOME")) / ".smart" / "conversations.db")
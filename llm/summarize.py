@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator, List
+
+from llm.conversation import count_text_tokens
+from llm.prompts import build_chunk_summary_prompt, build_reduce_summary_prompt
+from llm.ratelimit import RateLimiter
+from utils.config import read_config
+from utils.large_file import LargeFile, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAP_CONCURRENCY = 4
+
+# Called with (chunks done, total chunks) as chunks are summarized; the total
+# is None until the last chunk has been read
+ProgressCallback = Callable[[int, int | None], None]
+
+
+@dataclass
+class TextSource:
+    """Text that was already read, e.g. the lines of a file matching `?grep`."""
+
+    name: str
+    text: str
+
+
+def token_bounded_chunks(path: str, token_budget: int) -> Iterator[str]:
+    """Chunks of the file that are guaranteed to fit in `token_budget` tokens."""
+    for chunk in iter_chunks(path, token_budget):
+        yield from _split_to_budget(chunk, token_budget)
+
+
+def _split_to_budget(text: str, token_budget: int) -> Iterator[str]:
+    if len(text) <= 1 or count_text_tokens(text) <= token_budget:
+        yield text
+        return
+    middle = text.rfind("\n", 0, len(text) // 2) + 1 or len(text) // 2
+    yield from _split_to_budget(text[:middle], token_budget)
+    yield from _split_to_budget(text[middle:], token_budget)
+
+
+def _source_chunks(sources: List[str | TextSource], token_budget: int) -> Iterator[tuple]:
+    for source in sources:
+        if isinstance(source, TextSource):
+            if not source.text:
+                continue
+            name, chunks = source.name, _split_to_budget(source.text, token_budget)
+        else:
+            name, chunks = source, token_bounded_chunks(source, token_budget)
+        for number, chunk in enumerate(chunks, start=1):
+            yield name, number, chunk
+
+
+def _question_prefix(question: str | None) -> str:
+    return f"User question: {question}\n\n" if question else ""
+
+
+def summarize_chunk(client, chunk: str, source: str, number: int, question=None, model=None) -> str:
+    messages = [
+        {"role": "system", "content": build_chunk_summary_prompt()},
+        {
+            "role": "user",
+            "content": f"{_question_prefix(question)}Chunk {number} of {source}:\n\n{chunk}",
+        },
+    ]
+    response = client.get_chat_completion(messages, model=model)
+    return response.choices[0].message.content
+
+
+def reduce_summaries(
+        client,
+        summaries: List[str],
+        token_budget: int,
+        question=None,
+        model=None,
+        map_fn=map,
+) -> str:
+    """Combine partial summaries, in several rounds if they do not fit in one request."""
+    while True:
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            tokens = count_text_tokens(summary)
+            # Groups hold at least two summaries so every round makes progress
+            if len(groups[-1]) >= 2 and group_tokens + tokens > token_budget:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+
+        def reduce_group(group):
+            parts = "\n\n".join(f"Part {i + 1}:\n{summary}" for i, summary in enumerate(group))
+            messages = [
+                {"role": "system", "content": build_reduce_summary_prompt()},
+                {"role": "user", "content": f"{_question_prefix(question)}{parts}"},
+            ]
+            response = client.get_chat_completion(messages, model=model)
+            return response.choices[0].message.content
+
+        reduced = list(map_fn(reduce_group, groups))
+        if len(reduced) == 1:
+            return reduced[0]
+        summaries = reduced
+
+
+def map_reduce(
+        client,
+        paths: List[str | TextSource],
+        token_budget: int,
+        question: str | None = None,
+        model: str | None = None,
+        concurrency: int = 1,
+        rate_limiter: RateLimiter | None = None,
+        progress: ProgressCallback | None = None,
+) -> str:
+    """Summarize token-bounded chunks of `paths` concurrently, then reduce them into one answer.
+
+    At most `concurrency` requests are in flight and `rate_limiter` spaces them
+    out, so wall-clock time shrinks with concurrency rather than growing with
+    the number of chunks. Chunks are read as workers free up, so only a few
+    of them are held in memory whatever the size of the files.
+    """
+    rate_limiter = rate_limiter or RateLimiter(None)
+    concurrency = max(1, concurrency)
+    done = 0
+    total = None
+    done_lock = threading.Lock()
+
+    def limited(fn):
+        def call(*args):
+            rate_limiter.acquire()
+            return fn(*args)
+
+        return call
+
+    def map_chunk(item):
+        nonlocal done
+        path, number, chunk = item
+        summary = summarize_chunk(client, chunk, path, number, question, model)
+        with done_lock:
+            done += 1
+            if progress:
+                progress(done, total)
+        return summary
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="map-reduce") as pool:
+        summaries = []
+        pending = deque()
+        read = 0
+        try:
+            for item in _source_chunks(paths, token_budget):
+                pending.append(pool.submit(limited(map_chunk), item))
+                read += 1
+                # Keep the workers busy without reading ahead of them
+                if len(pending) >= 2 * concurrency:
+                    summaries.append(pending.popleft().result())
+            with done_lock:
+                total = read
+            while pending:
+                summaries.append(pending.popleft().result())
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        if not summaries:
+            return ""
+        return reduce_summaries(
+            client,
+            summaries,
+            token_budget,
+            question,
+            model,
+            map_fn=lambda fn, groups: pool.map(limited(fn), groups),
+        )
+
+
+def get_map_concurrency() -> int:
+    return int(read_config().get("map_concurrency", DEFAULT_MAP_CONCURRENCY))
+
+
+def get_map_rate_limiter() -> RateLimiter:
+    rate = read_config().get("map_rps")
+    return RateLimiter(float(rate) if rate else None, burst=get_map_concurrency())
+
+
+def summarize_file(
+        client,
+        large_file: LargeFile,
+        token_budget: int,
+        question: str | None = None,
+        model: str | None = None,
+        progress: ProgressCallback | None = None,
+) -> str:
+    """Map-reduce summary of a file, one request per chunk plus the reduce step."""
+    question = question or large_file.options.get("summarize") or None
+    return map_reduce(
+        client,
+        [large_file.path],
+        token_budget,
+        question=question,
+        model=model,
+        concurrency=get_map_concurrency(),
+        rate_limiter=get_map_rate_limiter(),
+        progress=progress,
+    )
@@ -1,4 +1,23 @@
+from __future__ import annotations
 
+import json
+import logging
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOOL_TIMEOUT = 30.0
+DEFAULT_TOOL_WORKERS = 4
+# Rounds of tool calls before the model has to answer
+DEFAULT_MAX_ROUNDS = 8
+PROPOSE_COMMAND = "propose_command"
+# Tool result recorded for calls to answer tools, which the caller handles
+ANSWER_RESULT = "Proposed to the user."
 
 AWESOME_TOOLS = [
     {
@@ -18,4 +37,251 @@ AWESOME_TOOLS = [
             },
         },
     },
-]
\ No newline at end of file
+]
+
+PROPOSE_COMMAND_TOOL = {
+    "type": "function",
+    "function": {
+        "name": PROPOSE_COMMAND,
+        "description": "Propose the shell command to run for the user's request. The user confirms it before it runs.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "command": {
+                    "type": "string",
+                    "description": "Complete, executable shell command",
+                },
+            },
+            "required": ["command"],
+        },
+    },
+}
+
+
+@dataclass
+class ToolCall:
+    id: str
+    name: str
+    arguments: str
+
+    @classmethod
+    def from_api(cls, call) -> ToolCall:
+        """From an SDK tool call object or its dict form."""
+        if isinstance(call, dict):
+            function = call.get("function", {})
+            return cls(call.get("id"), function.get("name"), function.get("arguments") or "{}")
+        return cls(call.id, call.function.name, call.function.arguments or "{}")
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "type": "function", "function": {"name": self.name, "arguments": self.arguments}}
+
+    def parsed_arguments(self) -> Dict:
+        arguments = json.loads(self.arguments)
+        if not isinstance(arguments, dict):
+            raise ValueError(f"arguments of {self.name} are not an object: {self.arguments}")
+        return arguments
+
+
+@dataclass
+class ToolResult:
+    call: ToolCall
+    content: str
+    ok: bool = True
+
+
+@dataclass
+class Tool:
+    """A function the model can call. Tools without `function` are answers, handled by the caller.
+
+    Tools with side effects give a `command` instead, rendering the shell
+    command a call amounts to; it only runs once the user confirms it.
+    """
+
+    spec: Dict
+    function: Callable[..., Any] | None = None
+    timeout: float = DEFAULT_TOOL_TIMEOUT
+    command: Callable[..., str] | None = None
+
+    @property
+    def name(self) -> str:
+        return self.spec["function"]["name"]
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+
+    def register(self, spec: Dict, function: Callable[..., Any] | None = None,
+                 timeout: float = DEFAULT_TOOL_TIMEOUT, command: Callable[..., str] | None = None) -> None:
+        tool = Tool(spec, function, timeout, command)
+        self._tools[tool.name] = tool
+
+    def get(self, name: str) -> Tool | None:
+        return self._tools.get(name)
+
+    def specs(self) -> List[Dict]:
+        return [tool.spec for tool in self._tools.values()]
+
+    def is_answer(self, call: ToolCall) -> bool:
+        tool = self.get(call.name)
+        return tool is not None and tool.function is None and tool.command is None
+
+
+class ToolExecutor:
+    """Runs the tool calls of one model reply in parallel, each within its tool's timeout.
+
+    A tool that fails, times out or does not exist produces an error result
+    for the model instead of an exception, so the model can correct itself.
+    Threads of timed out tools are left to finish in the background.
+
+    Commands of tools with side effects are passed to `confirm` first, one at
+    a time on the calling thread. It returns the command to run, possibly
+    edited, or None when the user declines; without `confirm` they never run.
+    """
+
+    def __init__(self, registry: ToolRegistry, max_workers: int = DEFAULT_TOOL_WORKERS,
+                 confirm: Callable[[str], str | None] | None = None):
+        self.registry = registry
+        self.confirm = confirm
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def _run(self, tool: Tool, call: ToolCall) -> str:
+        result = tool.function(**call.parsed_arguments())
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False, default=str)
+
+    def _confirmed_command(self, tool: Tool, call: ToolCall) -> str:
+        command = tool.command(**call.parsed_arguments())
+        confirmed = self.confirm(command) if self.confirm else None
+        if not confirmed:
+            raise PermissionError(f"The user declined to run `{command}`")
+        return confirmed
+
+    def execute(self, calls: List[ToolCall]) -> List[ToolResult]:
+        commands = {}
+        for index, call in enumerate(calls):
+            tool = self.registry.get(call.name)
+            if tool is not None and tool.command is not None:
+                try:
+                    commands[index] = self._confirmed_command(tool, call)
+                except Exception as e:
+                    commands[index] = e
+
+        # Time spent confirming does not count against the timeouts
+        started = time.monotonic()
+        futures = []
+        for index, call in enumerate(calls):
+            tool = self.registry.get(call.name)
+            if index in commands:
+                command = commands[index]
+                if isinstance(command, Exception):
+                    futures.append((call, tool, command))
+                else:
+                    futures.append((call, tool, self._pool.submit(run_shell_command, command, tool.timeout)))
+            elif tool is None or tool.function is None:
+                futures.append((call, None, None))
+            else:
+                futures.append((call, tool, self._pool.submit(self._run, tool, call)))
+
+        results = []
+        for call, tool, future in futures:
+            if future is None:
+                results.append(ToolResult(call, json.dumps({"error": f"Unknown tool: {call.name}"}), ok=False))
+                continue
+            if isinstance(future, Exception):
+                logger.warning(f"Tool {call.name} not run: {future}")
+                results.append(ToolResult(call, json.dumps({"error": str(future)}), ok=False))
+                continue
+            # Every call started at the same time, so each waits until its own deadline
+            remaining = max(0.0, started + tool.timeout - time.monotonic())
+            try:
+                results.append(ToolResult(call, future.result(timeout=remaining)))
+            except TimeoutError:
+                future.cancel()
+                logger.warning(f"Tool {call.name} timed out after {tool.timeout}s")
+                results.append(
+                    ToolResult(call, json.dumps({"error": f"Timed out after {tool.timeout}s"}), ok=False)
+                )
+            except Exception as e:
+                logger.warning(f"Tool {call.name} failed: {e}")
+                results.append(ToolResult(call, json.dumps({"error": str(e)}), ok=False))
+        return results
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def converse_with_tools(client, conversation, executor: ToolExecutor, max_rounds: int = DEFAULT_MAX_ROUNDS):
+    """Converse until the model answers in text or with an answer tool, for at most `max_rounds`.
+
+    Tool calls are executed and their results appended to `conversation` for
+    the next round. Calls to answer tools get a placeholder result so the
+    conversation stays valid; the caller reads their arguments from the
+    returned response.
+    """
+    specs = executor.registry.specs()
+    for _ in range(max_rounds):
+        response = client.converse(conversation, tools=specs)
+        message = response.choices[0].message
+        calls = [ToolCall.from_api(call) for call in getattr(message, "tool_calls", None) or []]
+        if not calls:
+            return response
+        answers = [call for call in calls if executor.registry.is_answer(call)]
+        for result in executor.execute([call for call in calls if call not in answers]):
+            conversation.add_tool_result(result.call.id, result.content)
+        for call in answers:
+            conversation.add_tool_result(call.id, ANSWER_RESULT)
+        if answers:
+            return response
+    logger.warning(f"No answer after {max_rounds} rounds of tool calls")
+    return response
+
+
+def is_answer_reply(response, registry: ToolRegistry) -> bool:
+    """Whether `response` answers in text or with answer tools only, without tools left to run."""
+    calls = getattr(response.choices[0].message, "tool_calls", None) or []
+    return all(registry.is_answer(ToolCall.from_api(call)) for call in calls)
+
+
+def add_answer_reply(conversation, response) -> None:
+    """Add an answer reply obtained outside `converse_with_tools` as that would have added it."""
+    message = response.choices[0].message
+    calls = [ToolCall.from_api(call) for call in getattr(message, "tool_calls", None) or []]
+    if calls:
+        conversation.add_tool_calls(message.content, [call.to_dict() for call in calls])
+        for call in calls:
+            conversation.add_tool_result(call.id, ANSWER_RESULT)
+    else:
+        conversation.add_assistant_message(message.content)
+    if getattr(response, "usage", None):
+        conversation.token_usage = response.usage.total_tokens
+
+
+def answer_arguments(response, name: str) -> Dict | None:
+    """Arguments of the first call to the answer tool `name` in `response`, if any."""
+    for call in getattr(response.choices[0].message, "tool_calls", None) or []:
+        call = ToolCall.from_api(call)
+        if call.name == name:
+            try:
+                return call.parsed_arguments()
+            except ValueError as e:
+                logger.warning(f"Unparsable {name} arguments: {e}")
+    return None
+
+
+def run_shell_command(command: str, timeout: float = DEFAULT_TOOL_TIMEOUT) -> str:
+    result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"`{command}` exited with code {result.returncode}: {result.stderr.strip()}")
+    return result.stdout.strip() or f"Ran `{command}`"
+
+
+def open_app_command(app_name: str) -> str:
+    return f"open -a {shlex.quote(app_name)}"
+
+
+def build_command_registry() -> ToolRegistry:
+    """Tools offered to `run`: the AWESOME_TOOLS and the command proposal answer."""
+    registry = ToolRegistry()
+    registry.register(AWESOME_TOOLS[0], timeout=10, command=open_app_command)
+    registry.register(PROPOSE_COMMAND_TOOL)
+    return registry
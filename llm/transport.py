@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
+
+from llm.scheduler import observe_response
+from utils.lazy import lazy_import
+
+httpx = lazy_import("httpx")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 120.0
+
+
+def _as_bool(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+_h2_checked = None
+
+
+def _h2_available() -> bool:
+    """Whether HTTP/2 can be used; warns once when it was asked for without the h2 package."""
+    global _h2_checked
+    if _h2_checked is None:
+        try:
+            import h2  # noqa: F401
+            _h2_checked = True
+        except ImportError:
+            logger.warning(
+                "HTTP/2 requested but the h2 package is not installed, using HTTP/1.1. "
+                "Install it with `poetry install -E http2`."
+            )
+            _h2_checked = False
+    return _h2_checked
+
+
+@dataclass(frozen=True)
+class TransportSettings:
+    http2: bool = False
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY
+
+    @classmethod
+    def from_config(cls, config) -> TransportSettings:
+        return cls(
+            http2=_as_bool(config.get("http2", False)),
+            connect_timeout=float(config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout=float(config.get("read_timeout", DEFAULT_READ_TIMEOUT)),
+            max_connections=int(config.get("max_connections", DEFAULT_MAX_CONNECTIONS)),
+            max_keepalive_connections=int(
+                config.get("max_keepalive_connections", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)
+            ),
+            keepalive_expiry=float(config.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY)),
+        )
+
+    def timeout(self):
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+
+class _PooledClient:
+    def __init__(self, base_url: str, settings: TransportSettings, asynchronous: bool = False):
+        self.base_url = base_url
+        self.settings = settings
+        self.requests = 0
+        self.connections_opened = 0
+        self._seen_connections = set()
+        self._lock = threading.Lock()
+        self.http2 = settings.http2 and _h2_available()
+        if asynchronous:
+            client_class = httpx.AsyncClient
+            event_hooks = {"request": [self._on_request_async], "response": [self._on_response_async]}
+        else:
+            client_class = httpx.Client
+            event_hooks = {"request": [self._on_request], "response": [self._on_response]}
+        self.client = client_class(
+            http2=self.http2,
+            timeout=settings.timeout(),
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry,
+            ),
+            event_hooks=event_hooks,
+        )
+
+    def _connections(self) -> List:
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        return list(getattr(pool, "connections", []))
+
+    def _on_request(self, request):
+        with self._lock:
+            self.requests += 1
+
+    def _on_response(self, response):
+        observe_response(response)
+        # A connection we have not seen before means a new TCP + TLS handshake
+        with self._lock:
+            current = {id(connection) for connection in self._connections()}
+            self.connections_opened += len(current - self._seen_connections)
+            self._seen_connections = current
+
+    async def _on_request_async(self, request):
+        self._on_request(request)
+
+    async def _on_response_async(self, response):
+        self._on_response(response)
+
+    def stats(self) -> Dict:
+        connections = self._connections()
+        return {
+            "base_url": self.base_url,
+            "async": isinstance(self.client, httpx.AsyncClient),
+            "http2": self.http2,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections": len(connections),
+            "idle_connections": sum(1 for c in connections if c.is_idle()),
+        }
+
+
+_pooled_clients: Dict[tuple, _PooledClient] = {}
+_async_pooled_clients: Dict[tuple, _PooledClient] = {}
+_pooled_clients_lock = threading.Lock()
+
+
+def get_http_client(base_url: str, settings: TransportSettings):
+    """Shared httpx client for `base_url`, reused across clients and profile switches."""
+    key = (base_url.rstrip("/"), settings)
+    with _pooled_clients_lock:
+        if key not in _pooled_clients:
+            _pooled_clients[key] = _PooledClient(base_url, settings)
+        return _pooled_clients[key].client
+
+
+def get_async_http_client(base_url: str, settings: TransportSettings):
+    """Shared httpx.AsyncClient for `base_url` on the running event loop.
+
+    Async connections belong to the loop that opened them, so each loop gets
+    its own pool and pools of closed loops are dropped.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    key = (base_url.rstrip("/"), settings, loop)
+    with _pooled_clients_lock:
+        for stale in [k for k in _async_pooled_clients if k[2].is_closed()]:
+            del _async_pooled_clients[stale]
+        if key not in _async_pooled_clients:
+            _async_pooled_clients[key] = _PooledClient(base_url, settings, asynchronous=True)
+        return _async_pooled_clients[key].client
+
+
+def pool_stats() -> List[Dict]:
+    with _pooled_clients_lock:
+        pooled_clients = list(_pooled_clients.values()) + list(_async_pooled_clients.values())
+        return [pooled.stats() for pooled in pooled_clients]
+
+
+def close_http_clients() -> None:
+    with _pooled_clients_lock:
+        for pooled in _pooled_clients.values():
+            pooled.client.close()
+        _pooled_clients.clear()
+
+
+async def aclose_http_clients() -> None:
+    """Close the async pools owned by the running event loop."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    with _pooled_clients_lock:
+        owned = [key for key in _async_pooled_clients if key[2] is loop]
+        clients = [_async_pooled_clients.pop(key).client for key in owned]
+    for client in clients:
+        await client.aclose()
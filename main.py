@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -8,11 +9,19 @@ from os import environ
 from pathlib import Path
 
 import click
-import pyperclip
-from rich.console import Console
-from rich.markdown import Markdown
 
+from llm.cache import ResponseCache, content_hash, get_response_cache, is_cacheable_command
 from llm.client import get_llm_client, apply_profile
+from llm.context import ContextPolicy
+from llm.journal import (
+    DEFAULT_MAX_AGE_DAYS,
+    DEFAULT_MAX_FILES,
+    ConversationJournal,
+    prune_journals,
+    read_journal,
+)
+from llm.kb_index import DEFAULT_TOP_K, load_kb_index
+from llm.metrics import record_cache_hit, set_command
 from llm.conversation import Conversation
 from llm.prompts import (
     build_command_generation_prompt,
@@ -20,6 +29,7 @@ from llm.prompts import (
     build_link_generation_prompt,
     build_generic_prompt,
     build_text_enhancement_prompt,
+    build_retrieved_knowledge_note,
 )
 from utils.config import read_config
 from utils.helper import (
@@ -30,8 +40,19 @@ from utils.helper import (
     ContentLoadType,
 )
 from utils.input import user_input
+from utils.large_file import (
+    OPTION_SUMMARIZE,
+    LargeFile,
+    get_chunk_tokens,
+    is_binary,
+    load_text_file,
+    split_file_options,
+)
+from utils.lazy import lazy_import, LazyObject, unwrap
 
-console = Console()
+pyperclip = lazy_import("pyperclip")
+rich_markdown = lazy_import("rich.markdown")
+console = LazyObject(lambda: lazy_import("rich.console").Console())
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,8 +63,20 @@ logger = logging.getLogger(__name__)
 
 brand_emoji = "🧐"
 
-last_conversation_path = "/tmp/smart-conversation.json"
+# Every session journals to a file of its own, processes must not share one
+conversation_journal_dir = Path("/tmp/smart-conversations")
 system_prompt_files_key = "system_prompt_files"
+use_daemon_key = "use_daemon"
+use_cache_key = "use_cache"
+kb_hash_key = "kb_hash"
+kb_index_key = "kb_index"
+kb_top_k_key = "kb_top_k"
+kb_sent_key = "kb_sent"
+# File a conversation was saved to, later /save calls overwrite it
+saved_path_key = "saved_path"
+
+RENDER_MARKDOWN = "markdown"
+RENDER_RAW = "raw"
 
 
 @click.group()
@@ -56,10 +89,26 @@ system_prompt_files_key = "system_prompt_files"
     help="Path to the system prompt file",
 )
 @click.option("-p", "--profile", type=str, help="Profile to apply", default=None)
+@click.option(
+    "--daemon/--no-daemon",
+    "use_daemon",
+    default=False,
+    envvar="SMART_USE_DAEMON",
+    help="Forward LLM calls to the warm daemon if it is running",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Do not use cached responses for emoji, goto and run",
+)
 @click.pass_context
-def cli(ctx, system_prompt_file, profile):
+def cli(ctx, system_prompt_file, profile, use_daemon, no_cache):
     ctx.ensure_object(dict)
     ctx.obj[system_prompt_files_key] = system_prompt_file
+    ctx.obj[use_daemon_key] = use_daemon
+    ctx.obj[use_cache_key] = not no_cache
+    set_command(ctx.invoked_subcommand)
     if profile:
         if apply_profile(profile):
             console.print(f"[bold green]Profile applied: {profile}[/bold green]")
@@ -76,50 +125,76 @@ def cli(ctx, system_prompt_file, profile):
     multiple=True,
     help="Provide the initial instruction for chat. Can be text or image file path (prefixed with file://)",
 )
+@click.option(
+    "--render",
+    type=click.Choice([RENDER_MARKDOWN, RENDER_RAW]),
+    default=RENDER_MARKDOWN,
+    help="Render streamed replies as Markdown or print the raw text",
+)
 @click.pass_context
-def chat(ctx, instruction):
+def chat(ctx, instruction, render):
     conversation = Conversation()
     conversation.add_system_message(load_system_prompt(ctx, build_generic_prompt()))
+    chat_session(conversation, instruction, render)
 
-    def handle_instruction(input_instruction):
-        current_content = []
-        for instr in input_instruction:
-            load_type, processed_instr = maybe_load_content(instr)
-            if processed_instr:
-                if load_type == ContentLoadType.IMAGE:
-                    # Add image to current content array
-                    current_content.append(processed_instr)
-                else:
-                    # If we have accumulated content, add it first
-                    if current_content:
-                        # Always wrap image content in an array
-                        conversation.add_user_message(current_content)
-                        current_content = []
-                    conversation.add_user_message(processed_instr)
-                if load_type == ContentLoadType.PRELOAD:
-                    conversation.add_assistant_message("Okay.")
 
-    # If there are initial instructions, collect them all first
-    if instruction:
-        handle_instruction(instruction)
-        # Run LLM streaming if the last message wasn't from assistant
-        if conversation.messages[-1]["role"] != "assistant":
-            run_llm_streaming(conversation)
-        else:
-            console.print(
-                f"[bold blue]Loaded {len(instruction)} instruction(s)![/bold blue]"
-            )
+@cli.command()
+@click.option("-n", "--limit", type=int, default=20, help="Number of conversations to show")
+@click.option("--offset", type=int, default=0, help="Skip the most recent N conversations")
+@click.option(
+    "--import",
+    "reimport",
+    is_flag=True,
+    default=False,
+    help="Import the saved JSON conversations again, replacing the stored copies",
+)
+def history(limit, offset, reimport):
+    """List saved conversations, most recent first."""
+    store = load_conversation_store(reimport)
+    print_conversations(store.recent(limit, offset))
 
-    # Start continuous loop for follow-up instructions
-    while True:
-        instruction = user_input(
-            f"\n{brand_emoji} What would you like to chat about? Type /q to quit: "
-        )
-        instruction = handle_commands(conversation, instruction)
-        if not instruction:
-            continue
-        handle_instruction([instruction])
-        run_llm_streaming(conversation)
+
+@cli.command()
+@click.argument("query", nargs=-1, required=True)
+@click.option("-n", "--limit", type=int, default=20, help="Number of conversations to show")
+def search(query, limit):
+    """Find saved conversations with messages containing every word of QUERY."""
+    store = load_conversation_store()
+    print_conversations(store.search(" ".join(query), limit), snippets=True)
+
+
+@cli.command()
+@click.argument("conversation_id", type=int)
+@click.option(
+    "--render",
+    type=click.Choice([RENDER_MARKDOWN, RENDER_RAW]),
+    default=RENDER_MARKDOWN,
+    help="Render streamed replies as Markdown or print the raw text",
+)
+def resume(conversation_id, render):
+    """Continue a saved conversation, by its id in `history` or `search`."""
+    import datetime
+
+    from utils.images import resolve_message
+
+    document = load_conversation_store().load(conversation_id)
+    if document is None:
+        console.print(f"[red]No saved conversation with id {conversation_id}[/red]")
+        sys.exit(1)
+    conversation = Conversation(model=document.get("model"))
+    if document.get("started_at"):
+        conversation.started_at = datetime.datetime.fromisoformat(document["started_at"])
+    conversation.load_messages(
+        [resolve_message(message) for message in document["messages"]], document.get("pinned")
+    )
+    conversation.token_usage = document.get("token_usage") or 0
+    if document.get("source"):
+        conversation.add_metadata(saved_path_key, document["source"])
+    console.print(
+        f"[bold blue]Resumed conversation {conversation_id} with {len(conversation.messages)} messages, "
+        f"{conversation.token_usage} tokens[/bold blue]"
+    )
+    chat_session(conversation, (), render)
 
 
 @cli.command()
@@ -130,14 +205,25 @@ def chat(ctx, instruction):
     multiple=True,
     help="Provide the instruction for chat completion",
 )
+@click.option(
+    "--map-reduce",
+    is_flag=True,
+    default=False,
+    help="Summarize file:// inputs chunk by chunk in parallel before answering",
+)
 @click.pass_context
-def complete(ctx, instruction):
+def complete(ctx, instruction, map_reduce):
     conversation = Conversation()
     conversation.add_system_message(load_system_prompt(ctx, build_generic_prompt()))
 
+    if instruction and map_reduce:
+        content = map_reduce_instructions(conversation, instruction)
+        console.print(rich_markdown.Markdown(content))
+        return
+
     if instruction:
         for instr in instruction:
-            _, processed_instr = maybe_load_content(instr)
+            _, processed_instr = load_instruction(instr)
             if processed_instr:
                 processed_instr = handle_commands(conversation, processed_instr)
                 if processed_instr:
@@ -151,7 +237,7 @@ def complete(ctx, instruction):
     if conversation.messages:
         content = run_llm(conversation)
         # Print the markdown to terminal using rich
-        console.print(Markdown(content))
+        console.print(rich_markdown.Markdown(content))
 
 
 @cli.command()
@@ -164,10 +250,30 @@ def complete(ctx, instruction):
 )
 @click.argument("extra_args", nargs=-1)
 @click.option("--kb", type=str, default="", help="Knowledge base file path")
+@click.option(
+    "--top-k",
+    type=int,
+    default=None,
+    help="Send only the k most relevant knowledge base entries per request",
+)
+@click.option(
+    "--speculate/--no-speculate",
+    default=False,
+    envvar="SMART_SPECULATE",
+    help="Start the request while you are still typing",
+)
+@click.option(
+    "--fast-path/--no-fast-path",
+    default=True,
+    envvar="SMART_FAST_PATH",
+    help="Propose known commands without asking the LLM",
+)
 @click.pass_context
-def run(ctx, instruction, extra_args, kb):
+def run(ctx, instruction, extra_args, kb, top_k, speculate, fast_path):
     conversation = Conversation()
-    kb_content = read_file(kb)
+    kb_text = read_file(kb)
+    matcher = load_fast_path(kb_text) if fast_path else None
+    kb_content = prepare_knowledge(conversation, kb, kb_text, top_k)
     system_prompt = build_command_generation_prompt(kb_content)
     conversation.add_system_message(load_system_prompt(ctx, system_prompt))
     conversation.add_user_message(
@@ -180,24 +286,37 @@ def run(ctx, instruction, extra_args, kb):
             f"Here are the file arguments user provided: {extra_args}"
         )
 
-    if instruction:
-        for instr in instruction:
-            _, processed_instr = maybe_load_content(instr)
-            if processed_instr:
-                processed_instr = handle_commands(conversation, processed_instr)
-                if processed_instr:
-                    run_action(processed_instr, conversation)
-    else:
-        instruction = user_input(f"\n{brand_emoji} What shall I run, your highness:")
-        instruction = handle_commands(conversation, instruction)
-        if instruction:
-            run_action(instruction, conversation)
+    start_journal(conversation)
+    speculator = start_speculation(conversation) if speculate else None
+    on_change = speculator.on_text_changed if speculator else None
 
-    while True:
-        instruction = user_input(f"\n{brand_emoji} What else do you need? /q to quit:")
-        instruction = handle_commands(conversation, instruction)
+    try:
         if instruction:
-            run_action(instruction, conversation)
+            for instr in instruction:
+                _, processed_instr = load_instruction(instr)
+                if processed_instr:
+                    processed_instr = handle_commands(conversation, processed_instr)
+                    if processed_instr:
+                        run_action(processed_instr, conversation, matcher=matcher)
+        else:
+            instruction = user_input(
+                f"\n{brand_emoji} What shall I run, your highness:", on_change=on_change
+            )
+            instruction = handle_commands(conversation, instruction)
+            if instruction:
+                run_action(instruction, conversation, speculator, matcher)
+
+        while True:
+            instruction = user_input(
+                f"\n{brand_emoji} What else do you need? /q to quit:", on_change=on_change
+            )
+            instruction = handle_commands(conversation, instruction)
+            if instruction:
+                run_action(instruction, conversation, speculator, matcher)
+    finally:
+        # /q exits through SystemExit, the speculative loop and its connections still get closed
+        if speculator:
+            speculator.close()
 
 
 @cli.command()
@@ -209,19 +328,26 @@ def run(ctx, instruction, extra_args, kb):
     help="Use natural language to describe what you want to do",
 )
 @click.option("--kb", type=str, default="", help="Knowledge base file path")
+@click.option(
+    "--top-k",
+    type=int,
+    default=None,
+    help="Send only the k most relevant knowledge base entries per request",
+)
 @click.pass_context
-def goto(ctx, instruction, kb):
+def goto(ctx, instruction, kb, top_k):
     conversation = Conversation()
-    kb_content = read_file(kb)
+    kb_content = prepare_knowledge(conversation, kb, read_file(kb), top_k)
     system_prompt = build_link_generation_prompt(kb_content)
     conversation.add_system_message(load_system_prompt(ctx, system_prompt))
 
     if instruction:
         for instr in instruction:
-            _, processed_instr = maybe_load_content(instr)
+            _, processed_instr = load_instruction(instr)
             if processed_instr:
                 processed_instr = handle_commands(conversation, processed_instr)
                 if processed_instr:
+                    add_relevant_knowledge(conversation, processed_instr)
                     conversation.add_user_message(
                         f"Here is the user input: {processed_instr}"
                     )
@@ -260,7 +386,7 @@ def emoji(ctx, instruction):
 
     if instruction:
         for instr in instruction:
-            _, processed_instr = maybe_load_content(instr)
+            _, processed_instr = load_instruction(instr)
             if processed_instr:
                 processed_instr = handle_commands(conversation, processed_instr)
                 if processed_instr:
@@ -305,7 +431,7 @@ def enhance(ctx, instruction, text):
 
     if instruction:
         for instr in instruction:
-            _, processed_instr = maybe_load_content(instr)
+            _, processed_instr = load_instruction(instr)
             if processed_instr:
                 processed_instr = handle_commands(conversation, processed_instr)
                 if processed_instr:
@@ -332,6 +458,355 @@ def enhance(ctx, instruction, text):
             console.print("[bold blue]Enhanced text copied to clipboard![/bold blue]")
 
 
+@cli.command()
+@click.argument("input_file", type=click.File("r"), default="-")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), default=None, help="Write results here instead of stdout")
+@click.option("-c", "--concurrency", type=int, default=None, help="Requests in flight at once")
+@click.option("--rps", type=float, default=None, help="Requests per second for every profile")
+@click.option(
+    "--order",
+    type=click.Choice(["input", "completion"]),
+    default="input",
+    help="Write results in input order or as they complete",
+)
+@click.option("--resume", is_flag=True, default=False, help="Skip records already in the output file")
+@click.option(
+    "--api",
+    "use_batch_api",
+    is_flag=True,
+    default=False,
+    help="Submit the records as provider Batch API jobs and wait for them",
+)
+@click.option("--poll-interval", type=float, default=30.0, help="Seconds between Batch API status checks")
+@click.pass_context
+def batch(ctx, input_file, output, concurrency, rps, order, resume, use_batch_api, poll_interval):
+    """Run JSONL records of {command, instruction, text, profile} for complete, enhance and emoji."""
+    from llm.batch import get_batch_concurrency, read_checkpoint, read_records, run_batch
+
+    skip = set()
+    partial_line = False
+    if (resume or use_batch_api) and not output:
+        raise click.UsageError("--resume and --api need --output")
+    if resume:
+        if Path(output).exists():
+            with open(output, "rb") as f:
+                skip = read_checkpoint(f)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    partial_line = f.read(1) != b"\n"
+    system_prompts = None
+    if ctx.obj.get(system_prompt_files_key):
+        system_prompts = [prompt for prompt in load_system_prompt(ctx, None) if prompt] or None
+
+    out = open(output, "a" if resume else "w", encoding="utf-8") if output else sys.stdout
+    if partial_line:
+        out.write("\n")  # The last run was cut off in the middle of a line
+    try:
+        if use_batch_api:
+            counts = run_batch_api_records(
+                [record for record in read_records(input_file) if record.index not in skip],
+                out,
+                Path(f"{output}.jobs.json"),
+                system_prompts,
+                poll_interval,
+                resume,
+            )
+            counts["skipped"] = len(skip)
+        else:
+            counts = run_batch(
+                input_file,
+                out,
+                concurrency=concurrency or get_batch_concurrency(),
+                rps=rps,
+                order=order,
+                skip=skip,
+                system_prompts=system_prompts,
+            )
+    finally:
+        if output:
+            out.close()
+    click.echo(
+        f"Batch done: {counts['ok']} ok, {counts['failed']} failed, {counts['skipped']} skipped",
+        err=True,
+    )
+
+
+def run_batch_api_records(records, out, state_path, system_prompts, poll_interval, resume):
+    from llm.batch_api import run_batch_api
+
+    def emit(result):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    return run_batch_api(
+        records,
+        emit,
+        state_path,
+        system_prompts=system_prompts,
+        poll_interval=poll_interval,
+        resume=resume,
+        on_status=lambda profile, status, done, total: click.echo(
+            f"Batch job for {profile}: {status} ({done}/{total})", err=True
+        ),
+    )
+
+
+@cli.command(name="fastpath")
+@click.option("--kb", type=str, default="", help="Knowledge base file path")
+@click.option(
+    "--learn",
+    is_flag=True,
+    default=False,
+    help="Learn accepted commands from saved conversations and the session journals first",
+)
+def fastpath(kb, learn):
+    """Report how often `run` proposes commands without the LLM."""
+    matcher = load_fast_path(read_file(kb))
+    if learn:
+        save_path = Path(os.getenv("HOME")) / "Documents" / "Smart" / "Conversations"
+        learned = 0
+        for file_path in sorted(save_path.glob("*.json")):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    learned += matcher.learn_from_messages(json.load(f).get("messages", []))
+            except (OSError, ValueError) as e:
+                logger.debug(f"Skipping {file_path}: {e}")
+        for journal_path in sorted(conversation_journal_dir.glob("*.jsonl")):
+            try:
+                learned += matcher.learn_from_messages(read_journal(journal_path)["messages"])
+            except OSError as e:
+                logger.debug(f"Skipping {journal_path}: {e}")
+        console.print(f"[bold blue]Learned {learned} commands.[/bold blue]")
+    report = matcher.report()
+    console.print(
+        f"{report['hits']} of {report['lookups']} instructions answered locally "
+        f"(hit rate {report['hit_rate']:.1%}), {report['accepted']} proposals run as is "
+        f"({report['acceptance_rate']:.1%}), {report['learned']} learned commands"
+    )
+
+
+@cli.command(name="stats")
+@click.option("--since", type=float, default=None, help="Only requests of the last N hours")
+@click.option("--command", "command_name", type=str, default=None, help="Only requests of this command")
+@click.option("--model", type=str, default=None, help="Only requests to this model")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json", "prometheus", "otlp"]),
+    default="table",
+    help="Percentile table, JSON summary, Prometheus text or OTLP JSON spans",
+)
+def stats(since, command_name, model, output_format):
+    """Show latency percentiles of LLM requests per command and model."""
+    import time
+
+    from llm.metrics import PERCENTILES, get_metrics_store, summarize, to_otlp, to_prometheus
+
+    records = [
+        record
+        for record in get_metrics_store().read(time.time() - since * 3600 if since else None)
+        if (not command_name or record.get("command") == command_name)
+        and (not model or record.get("model") == model)
+    ]
+    if output_format == "prometheus":
+        click.echo(to_prometheus(records), nl=False)
+        return
+    if output_format == "otlp":
+        click.echo(json.dumps(to_otlp(records)))
+        return
+    summary = summarize(records)
+    if output_format == "json":
+        click.echo(json.dumps(summary))
+        return
+    if not summary:
+        console.print("[bold blue]No requests recorded yet.[/bold blue]")
+        return
+
+    def seconds(value):
+        return f"{value:>7.2f}" if value is not None else f"{'-':>7}"
+
+    percentiles = " ".join(f"{f'p{p}':>7}" for p in PERCENTILES)
+    # Plain echo, the rows are wider than a default terminal and must not wrap
+    click.echo(
+        f"{'command':<10} {'model':<20} {'requests':>8} {'cached':>6} {'errors':>6} {'retries':>7} "
+        f"| latency {percentiles} | ttft {percentiles}"
+    )
+    for row in summary:
+        latencies = " ".join(seconds(row[f"latency_p{p}"]) for p in PERCENTILES)
+        ttfts = " ".join(seconds(row[f"ttft_p{p}"]) for p in PERCENTILES)
+        click.echo(
+            f"{row['command']:<10} {row['model']:<20} {row['requests']:>8} {row['cache_hits']:>6} "
+            f"{row['errors']:>6} {row['retries']:>7} |         {latencies} |      {ttfts}"
+        )
+
+
+@cli.command(name="bench")
+@click.option(
+    "-c",
+    "--command",
+    "commands",
+    type=click.Choice(["chat", "complete", "run", "goto", "emoji", "enhance"]),
+    multiple=True,
+    help="Commands to benchmark, all by default",
+)
+@click.option("--no-commands", is_flag=True, default=False, help="Only run the conversation benchmarks")
+@click.option("-n", "--iterations", type=int, default=3, help="Runs per command")
+@click.option("--latency", type=float, default=0.05, help="Seconds the stub server waits before answering")
+@click.option("--chunk-interval", type=float, default=0.005, help="Seconds between streamed chunks")
+@click.option("--error-rate", type=float, default=0.0, help="Share of requests the stub server fails")
+@click.option("--error-status", type=int, default=503, help="Status of the failed requests")
+@click.option(
+    "--history",
+    type=int,
+    multiple=True,
+    default=[100, 1000, 5000],
+    help="Conversation lengths to benchmark, none with --history 0",
+)
+@click.option("-o", "--output", type=click.Path(dir_okay=False), default=None, help="Write the JSON results here")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Exit with non-zero status if results regressed against these earlier results",
+)
+@click.option("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline, 0.2 is 20%")
+def bench(commands, no_commands, iterations, latency, chunk_interval, error_rate, error_status, history, output,
+          baseline, tolerance):
+    """Benchmark the commands against a local stub server and Conversation as history grows."""
+    from bench.stub_server import StubSettings
+    from bench.suite import compare, run_suite
+
+    results = run_suite(
+        commands=[] if no_commands else list(commands),
+        settings=StubSettings(
+            latency=latency, chunk_interval=chunk_interval, error_rate=error_rate, error_status=error_status
+        ),
+        iterations=iterations,
+        history_sizes=[size for size in history if size > 0],
+        include_commands=not no_commands,
+    )
+    document = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(document)
+    else:
+        click.echo(document)
+
+    for result in results["results"]:
+        if "p50" in result:
+            line = f"{result['name']:<40} p50 {result['p50'] * 1000:>9.1f} ms  cpu {result['cpu'] * 1000:>9.1f} ms"
+        else:
+            line = f"{result['name']:<40} peak {result['peak_mb']:>8.2f} MB"
+        if result.get("max_rss_mb"):
+            line += f"  rss {result['max_rss_mb']:>6.1f} MB"
+        if result.get("failures"):
+            line += f"  {result['failures']} failed: {result.get('error')}"
+        click.echo(line, err=True)
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for regression in regressions:
+            change = f"{regression['change']:+.0%}" if regression["change"] is not None else "new failures"
+            click.echo(
+                f"Regression in {regression['name']} {regression['value']}: "
+                f"{regression['baseline']:.4g} -> {regression['current']:.4g} ({change})",
+                err=True,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+@cli.group(name="daemon")
+def daemon_group():
+    """Manage the warm daemon that serves LLM calls over a Unix socket."""
+
+
+@daemon_group.command(name="start")
+@click.option("--socket", "socket_path", type=str, default=None, help="Socket path")
+def daemon_start(socket_path):
+    from llm.daemon import serve
+
+    serve(Path(socket_path) if socket_path else None)
+
+
+@daemon_group.command(name="stop")
+@click.option("--socket", "socket_path", type=str, default=None, help="Socket path")
+def daemon_stop(socket_path):
+    from llm.daemon import DaemonClient
+
+    if DaemonClient(Path(socket_path) if socket_path else None).shutdown():
+        console.print("[bold blue]Daemon stopped.[/bold blue]")
+    else:
+        console.print("[red]Daemon is not running![/red]")
+
+
+@daemon_group.command(name="status")
+@click.option("--socket", "socket_path", type=str, default=None, help="Socket path")
+def daemon_status(socket_path):
+    from llm.daemon import DaemonClient
+
+    client = DaemonClient(Path(socket_path) if socket_path else None)
+    if client.ping():
+        console.print(f"[bold green]Daemon is running at {client.socket_path}[/bold green]")
+        for pool in client.stats():
+            console.print(
+                f"{pool['base_url']}: {pool['requests']} requests over "
+                f"{pool['connections_opened']} connections opened, "
+                f"{pool['connections']} open ({pool['idle_connections']} idle), "
+                f"http2={pool['http2']}"
+            )
+    else:
+        console.print(f"[red]Daemon is not running at {client.socket_path}[/red]")
+
+
+@cli.command(name="importtime")
+@click.option("-m", "--module", type=str, default="main", help="Module to import")
+@click.option("-n", "--top", type=int, default=15, help="Number of modules to show")
+@click.option(
+    "--max-ms",
+    type=float,
+    default=None,
+    help="Exit with non-zero status if the total import time exceeds this",
+)
+def importtime(module, top, max_ms):
+    """Report per-module startup cost of importing a module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+    timings = parse_import_times(result.stderr)
+    if result.returncode != 0 or not timings:
+        console.print(f"[red]Failed to import {module}:[/red]\n{result.stderr}")
+        sys.exit(1)
+
+    total_ms = timings[module][1] / 1000 if module in timings else 0.0
+    ranked = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)
+    console.print(f"[bold blue]Importing {module} took {total_ms:.1f} ms[/bold blue]")
+    for name, (self_us, cumulative_us) in ranked[:top]:
+        console.print(
+            f"{cumulative_us / 1000:>10.1f} ms cumulative {self_us / 1000:>8.1f} ms self  {name}"
+        )
+    if max_ms is not None and total_ms > max_ms:
+        console.print(f"[red]Import time {total_ms:.1f} ms exceeds {max_ms} ms[/red]")
+        sys.exit(1)
+
+
+def parse_import_times(importtime_output: str) -> dict:
+    # Lines look like: "import time:       123 |        456 |   package.module"
+    timings = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        timings[parts[2].strip()] = (int(parts[0]), int(parts[1]))
+    return timings
+
+
 def handle_commands(conversation, instruction) -> str:
     if not instruction:
         return instruction
@@ -390,12 +865,19 @@ def handle_commands(conversation, instruction) -> str:
         return ""
 
     if parts[0] == "/save":
-        save_path = Path(os.getenv("HOME")) / "Documents" / "Smart" / "Conversations"
-        save_path.mkdir(parents=True, exist_ok=True)
-        file_name = f"{conversation.started_at.strftime('%Y-%m-%d-%H-%M-%S')}.json"
-        save_conversation(conversation, save_path / file_name)
+        if conversation.get_metadata(saved_path_key):
+            # A resumed or already saved conversation replaces its file and history entry
+            file_path = Path(conversation.get_metadata(saved_path_key))
+        else:
+            save_path = Path(os.getenv("HOME")) / "Documents" / "Smart" / "Conversations"
+            file_path = save_path / f"{conversation.started_at.strftime('%Y-%m-%d-%H-%M-%S')}.json"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        document = conversation.to_dict()
+        save_document(document, file_path)
+        save_to_store(document, file_path)
+        conversation.add_metadata(saved_path_key, str(file_path))
         console.print(
-            f"[bold blue]Conversation saved to:[/bold blue] {save_path / file_name}"
+            f"[bold blue]Conversation saved to:[/bold blue] {file_path}"
         )
         return ""
 
@@ -404,6 +886,7 @@ def handle_commands(conversation, instruction) -> str:
             profile = parts[1]
             if apply_profile(profile):
                 conversation.model = read_config().model
+                conversation.context_policy = ContextPolicy.from_config(read_config())
                 console.print(
                     f"[bold blue]Profile set to:[/bold blue] {profile}, model: {conversation.model}"
                 )
@@ -456,6 +939,83 @@ def handle_commands(conversation, instruction) -> str:
     return instruction
 
 
+def prepare_knowledge(conversation, kb, kb_content, top_k=None):
+    """Knowledge to paste into the system prompt.
+
+    Large knowledge bases are indexed instead: only their preamble goes into
+    the system prompt and the most relevant entries are added per request.
+    """
+    conversation.add_metadata(kb_hash_key, content_hash(kb_content))
+    if top_k is None:
+        top_k = int(read_config().get("kb_top_k", DEFAULT_TOP_K))
+    if not kb or not kb_content or top_k <= 0:
+        return kb_content
+    index = load_kb_index(kb)
+    if len(index) <= top_k:
+        return kb_content
+    conversation.add_metadata(kb_index_key, index)
+    conversation.add_metadata(kb_top_k_key, top_k)
+    conversation.add_metadata(kb_sent_key, set())
+    return index.preamble + build_retrieved_knowledge_note()
+
+
+def relevant_knowledge(conversation, query):
+    """Knowledge base entries for `query` that were not sent yet."""
+    index = conversation.get_metadata(kb_index_key)
+    if not index:
+        return []
+    sent = conversation.get_metadata(kb_sent_key)
+    return [
+        entry
+        for entry in index.search(query, conversation.get_metadata(kb_top_k_key))
+        if entry.name not in sent
+    ]
+
+
+def knowledge_message(conversation, entries):
+    index = conversation.get_metadata(kb_index_key)
+    return f"Relevant entries from the knowledge file:\n\n{index.render(entries)}"
+
+
+def add_relevant_knowledge(conversation, query):
+    entries = relevant_knowledge(conversation, query)
+    if entries:
+        conversation.get_metadata(kb_sent_key).update(entry.name for entry in entries)
+        conversation.add_user_message(knowledge_message(conversation, entries))
+
+
+def load_fast_path(kb_content):
+    from llm.fast_path import DEFAULT_THRESHOLD, load_matcher
+
+    threshold = float(read_config().get("fast_path_threshold", DEFAULT_THRESHOLD))
+    return load_matcher(kb_content, threshold)
+
+
+def start_speculation(conversation):
+    """Speculator that prefetches the command for what is typed into `run`."""
+    from llm.client import get_async_llm_client
+    from llm.speculate import DEFAULT_DEBOUNCE_SECONDS, Speculator
+    from llm.tools import is_answer_reply
+
+    registry = get_tool_executor().registry
+
+    async def fetch(text):
+        # The request propose_command would send, without touching the conversation
+        messages = conversation.request_messages()
+        entries = relevant_knowledge(conversation, text)
+        if entries:
+            messages.append({"role": "user", "content": knowledge_message(conversation, entries)})
+        messages.append({"role": "user", "content": f"User follows up: {text}"})
+        response = await get_async_llm_client().get_chat_completion(
+            messages, model=conversation.model, tools=registry.specs()
+        )
+        # Tools with side effects only run once the input is submitted
+        return response if is_answer_reply(response, registry) else None
+
+    debounce = float(read_config().get("speculate_debounce", DEFAULT_DEBOUNCE_SECONDS))
+    return Speculator(fetch, debounce=debounce)
+
+
 def enhance_text(ctx, instruction, text_input, conversation):
     system_prompt = build_text_enhancement_prompt()
     conversation.add_system_message(load_system_prompt(ctx, system_prompt))
@@ -478,8 +1038,13 @@ def get_emoji(ctx, instruction, conversation):
 
 def goto_link(ctx, instruction, kb, conversation):
     kb_content = read_file(kb)
+    if not conversation.get_metadata(kb_index_key):
+        conversation.add_metadata(kb_hash_key, content_hash(kb_content))
+    else:
+        kb_content = conversation.get_metadata(kb_index_key).preamble + build_retrieved_knowledge_note()
     system_prompt = build_link_generation_prompt(kb_content)
     conversation.add_system_message(load_system_prompt(ctx, system_prompt))
+    add_relevant_knowledge(conversation, instruction)
     conversation.add_user_message(f"Here is the user input: {instruction}")
     for _ in range(3):
         link = run_llm(conversation)
@@ -493,9 +1058,10 @@ def goto_link(ctx, instruction, kb, conversation):
     webbrowser.open(link)
 
 
-def run_action(action, conversation):
+def run_action(action, conversation, speculator=None, matcher=None):
     if not action:
         return
+    proposed = None
     # If the action starts with '!', it's a direct command to run
     if action.startswith("!"):
         edited_command = action[1:]
@@ -509,9 +1075,28 @@ def run_action(action, conversation):
                 f"User does not like the command, regenerate!"
             )
         else:
+            add_relevant_knowledge(conversation, action)
             conversation.add_user_message(f"User follows up: {action}")
-        content = run_llm(conversation)
-        command_from_llm = sanitize_shell_command(content)
+            conversation.add_metadata("last_instruction", action)
+            proposed = matcher.match(action) if matcher else None
+        if proposed:
+            console.print(
+                f"[dim]Known command ({proposed.source}, confidence {proposed.confidence:.2f})[/dim]"
+            )
+            conversation.add_assistant_message(proposed.command)
+            journal_conversation(conversation)
+            command_from_llm = sanitize_shell_command(proposed.command)
+        else:
+            response = speculator.result_for(action) if speculator and action != "/regenerate" else None
+            if response is not None:
+                from llm.tools import add_answer_reply
+
+                logger.debug(f"Using the speculated reply, {speculator.stats()}")
+                add_answer_reply(conversation, response)
+                journal_conversation(conversation)
+                command_from_llm = command_from_response(response)
+            else:
+                command_from_llm = propose_command(conversation)
         edited_command = user_input(
             f"Running this command?\n", default=command_from_llm
         )
@@ -520,7 +1105,9 @@ def run_action(action, conversation):
         return
         # regenerating the final command
     if edited_command.endswith("!"):
-        return run_action("/regenerate", conversation)
+        if proposed:
+            matcher.reject(action, proposed)
+        return run_action("/regenerate", conversation, speculator, matcher)
     elif edited_command.endswith("~") or edited_command.endswith("/q"):
         conversation.add_user_message("User aborted the command.")
         return
@@ -529,6 +1116,9 @@ def run_action(action, conversation):
         final_command = f"source {rc} && {edited_command}"
         result = subprocess.run(final_command, shell=True, executable=shell)
         conversation.add_metadata("last_command", edited_command)
+        instruction = conversation.get_metadata("last_instruction")
+        if matcher and instruction and not action.startswith("!") and result.returncode == 0:
+            matcher.learn(instruction, edited_command, proposed)
         status_color = "green" if result.returncode == 0 else "red"
         console.print(
             f"\n[bold cyan]Command returned status:[/bold cyan] [bold {status_color}]{result.returncode}[/bold {status_color}]"
@@ -538,54 +1128,335 @@ def run_action(action, conversation):
         )
 
 
+def get_client():
+    ctx = click.get_current_context(silent=True)
+    if ctx and ctx.obj and ctx.obj.get(use_daemon_key):
+        from llm.daemon import DaemonClient
+
+        daemon_client = DaemonClient()
+        if daemon_client.ping():
+            return daemon_client
+        logger.warning("Daemon is not running, calling the LLM directly")
+        ctx.obj[use_daemon_key] = False
+    return get_llm_client()
+
+
+def load_instruction(instruction):
+    load_type, content = maybe_load_content(instruction)
+    if isinstance(content, LargeFile):
+        content = f"Summary of {content.path}:\n\n{summarize_large_file(content)}"
+    return load_type, content
+
+
+def summarize_large_file(large_file):
+    from llm.summarize import summarize_file
+
+    console.print(
+        f"[bold blue]Summarizing {large_file.path} ({large_file.size} bytes) in chunks...[/bold blue]"
+    )
+    return summarize_file(
+        get_llm_client(),
+        large_file,
+        token_budget=get_chunk_tokens(),
+        model=read_config().model,
+        progress=print_chunk_progress,
+    )
+
+
+def map_reduce_instructions(conversation, instructions):
+    from llm.summarize import TextSource, map_reduce, get_map_concurrency, get_map_rate_limiter
+
+    sources, questions = [], []
+    for instr in instructions:
+        path, options = split_file_options(instr[7:]) if instr.startswith("file://") else (None, {})
+        if path and Path(path).is_file():
+            if is_binary(path):
+                console.print(f"[red]Skipping {path}, only text files can be map-reduced[/red]")
+                continue
+            if options.get(OPTION_SUMMARIZE):
+                questions.append(options[OPTION_SUMMARIZE])
+            excerpt_options = {key: value for key, value in options.items() if key != OPTION_SUMMARIZE}
+            if excerpt_options:
+                # ?head, ?tail and ?grep pick the text that is map-reduced
+                sources.append(TextSource(path, load_text_file(path, excerpt_options)))
+            else:
+                sources.append(path)
+            continue
+        _, processed_instr = load_instruction(instr)
+        if isinstance(processed_instr, str):
+            if processed_instr:
+                questions.append(processed_instr)
+        elif processed_instr:
+            console.print("[red]Skipping an image, only text can be map-reduced[/red]")
+    names = [source.name if isinstance(source, TextSource) else source for source in sources]
+    question = "\n\n".join(questions) or None
+    console.print(
+        f"[bold blue]Map-reduce over {len(sources)} file(s) with {get_map_concurrency()} workers...[/bold blue]"
+    )
+    content = map_reduce(
+        get_llm_client(),
+        sources,
+        token_budget=get_chunk_tokens(),
+        question=question,
+        model=conversation.model,
+        concurrency=get_map_concurrency(),
+        rate_limiter=get_map_rate_limiter(),
+        progress=print_chunk_progress,
+    )
+    conversation.add_user_message(
+        f"{question or 'Summarize the files.'}\n\nFiles: {', '.join(names)}"
+    )
+    conversation.add_assistant_message(content)
+    journal_conversation(conversation)
+    return content
+
+
+def print_chunk_progress(done, total):
+    console.print(f"[blue]Summarized chunk {done}{f'/{total}' if total else ''}[/blue]")
+
+
+def get_cache_key(conversation):
+    ctx = click.get_current_context(silent=True)
+    if not ctx or not ctx.obj or not ctx.obj.get(use_cache_key):
+        return None
+    if not is_cacheable_command(ctx.info_name):
+        return None
+    return ResponseCache.make_key(
+        conversation.model,
+        conversation.messages,
+        conversation.get_metadata(kb_hash_key) or "",
+    )
+
+
 def run_llm(conversation):
-    client = get_llm_client()
+    cache_key = get_cache_key(conversation)
+    if cache_key:
+        content = get_response_cache().get(cache_key)
+        if content is not None:
+            logger.debug("Using cached response")
+            record_cache_hit(conversation.model)
+            conversation.add_assistant_message(content)
+            journal_conversation(conversation)
+            return content
+
+    client = get_client()
     response = client.converse(conversation)
-    save_conversation(conversation, last_conversation_path)
-    return response.choices[0].message.content
+    journal_conversation(conversation)
+    content = response.choices[0].message.content
+    if cache_key and content:
+        get_response_cache().put(cache_key, content)
+    return content
+
+
+def propose_command(conversation):
+    """The command the LLM proposes, asked for through the propose_command tool."""
+    from llm.tools import converse_with_tools
+
+    cache_key = get_cache_key(conversation)
+    if cache_key:
+        command = get_response_cache().get(cache_key)
+        if command is not None:
+            logger.debug("Using cached response")
+            record_cache_hit(conversation.model)
+            conversation.add_assistant_message(command)
+            journal_conversation(conversation)
+            return command
+
+    response = converse_with_tools(get_client(), conversation, get_tool_executor())
+    journal_conversation(conversation)
+    command = command_from_response(response)
+    if cache_key:
+        get_response_cache().put(cache_key, command)
+    return command
 
 
-def run_llm_streaming(conversation):
+def command_from_response(response):
+    """The command of a `run` reply, from the propose_command tool or from text."""
+    from llm.tools import PROPOSE_COMMAND, answer_arguments
+
+    arguments = answer_arguments(response, PROPOSE_COMMAND)
+    if arguments and arguments.get("command"):
+        return arguments["command"].strip()
+    # Models and gateways without tool support answer in text
+    content = response.choices[0].message.content
+    if not content:
+        raise ValueError("response has no command")
+    return sanitize_shell_command(content)
+
+
+@functools.lru_cache(maxsize=1)
+def get_tool_executor():
+    from llm.tools import ToolExecutor, build_command_registry
+
+    return ToolExecutor(build_command_registry(), confirm=confirm_tool_command)
+
+
+def confirm_tool_command(command):
+    """Ask before a tool call runs, at the prompt `run` confirms commands with."""
+    console.print("[dim]The model wants to run a tool.[/dim]")
+    edited_command = user_input(f"Running this command?\n", default=command)
+    # Nothing, or the abort and regenerate markers of the run prompt, declines the call
+    if not edited_command or edited_command.endswith(("!", "~", "/q")):
+        return None
+    return edited_command
+
+
+def run_llm_streaming(conversation, render=RENDER_MARKDOWN):
     """
     This function calls the LLM in streaming mode and prints the response as it comes in.
     """
-    client = get_llm_client()
+    client = get_client()
     response_stream = client.converse_stream(
         conversation
     )  # Assuming 'converse_stream' for streaming
 
-    # Iterate over the streaming response
-    for chunk in response_stream:
-        content_chunk = chunk.content
-        if content_chunk:
-            console.print(
-                content_chunk, end="", markup=True
-            )  # Print each part of the response as it's received
+    if render == RENDER_MARKDOWN:
+        from utils.markdown_stream import MarkdownStream
 
-    save_conversation(
-        conversation, last_conversation_path
-    )  # Save the conversation to a file
+        with MarkdownStream(unwrap(console)) as markdown_stream:
+            for chunk in response_stream:
+                markdown_stream.update(chunk.content)
+    else:
+        # Iterate over the streaming response
+        for chunk in response_stream:
+            content_chunk = chunk.content
+            if content_chunk:
+                console.print(
+                    content_chunk, end="", markup=False
+                )  # Print each part of the response as it's received
+
+    journal_conversation(conversation)  # Persist the new messages in the background
     # Final message after the stream ends
+    stats = conversation.get_metadata("last_stream_stats") or {}
+    speed = ""
+    if stats.get("ttft") is not None:
+        speed += f" TTFT: {stats['ttft']:.2f}s"
+    if stats.get("tokens_per_second"):
+        speed += f" Speed: {stats['tokens_per_second']:.1f} tokens/s"
     console.print(
-        f"\n[green]Stream complete. Index: {len(conversation.messages) - 1} Tokens: {conversation.get_token_usage()}[/green]"
+        f"\n[green]Stream complete. Index: {len(conversation.messages) - 1} Tokens: {conversation.get_token_usage()}{speed}[/green]"
+    )
+
+
+def start_journal(conversation):
+    """Journal an interactive session, one-shot commands have nothing worth recovering."""
+    config = read_config()
+    prune_journals(
+        conversation_journal_dir,
+        max_age_seconds=float(config.get("journal_max_age_days", DEFAULT_MAX_AGE_DAYS)) * 24 * 3600,
+        max_files=int(config.get("journal_max_files", DEFAULT_MAX_FILES)),
+    )
+    conversation.attach_journal(ConversationJournal(conversation_journal_path(conversation)))
+
+
+def journal_conversation(conversation):
+    if conversation.journal is not None:
+        conversation.journal.record_meta(conversation.model, conversation.get_token_usage(), conversation.pinned)
+
+
+def conversation_journal_path(conversation):
+    return conversation_journal_dir / (
+        f"{conversation.started_at.strftime('%Y-%m-%d-%H-%M-%S-%f')}-{os.getpid()}.jsonl"
     )
 
 
-def save_conversation(conversation, file_path):
+def save_document(document, file_path):
     try:
         with open(file_path, "w", encoding="utf-8") as json_file:
-            json.dump(conversation.to_dict(), json_file, ensure_ascii=False, indent=4)
+            json.dump(document, json_file, ensure_ascii=False, indent=4)
     except IOError as e:
         console.print(f"[red]Error writing conversation to file: {e}[/red]")
 
 
+def chat_session(conversation, instruction, render):
+    start_journal(conversation)
+
+    def handle_instruction(input_instruction):
+        current_content = []
+        for instr in input_instruction:
+            load_type, processed_instr = load_instruction(instr)
+            if processed_instr:
+                if load_type == ContentLoadType.IMAGE:
+                    # Add image to current content array
+                    current_content.append(processed_instr)
+                else:
+                    # If we have accumulated content, add it first
+                    if current_content:
+                        # Always wrap image content in an array
+                        conversation.add_user_message(current_content)
+                        current_content = []
+                    conversation.add_user_message(processed_instr)
+                if load_type == ContentLoadType.PRELOAD:
+                    conversation.add_assistant_message("Okay.")
+
+    # If there are initial instructions, collect them all first
+    if instruction:
+        handle_instruction(instruction)
+        # Run LLM streaming if the last message wasn't from assistant
+        if conversation.messages[-1]["role"] != "assistant":
+            run_llm_streaming(conversation, render)
+        else:
+            console.print(
+                f"[bold blue]Loaded {len(instruction)} instruction(s)![/bold blue]"
+            )
+
+    # Start continuous loop for follow-up instructions
+    while True:
+        instruction = user_input(
+            f"\n{brand_emoji} What would you like to chat about? Type /q to quit: "
+        )
+        instruction = handle_commands(conversation, instruction)
+        if not instruction:
+            continue
+        handle_instruction([instruction])
+        run_llm_streaming(conversation, render)
+
+
+def load_conversation_store(reimport=False):
+    """The conversation store, with the saved JSON conversations imported on first use."""
+    from llm.store import get_conversation_store, get_saved_conversations_dir
+
+    store = get_conversation_store()
+    save_path = get_saved_conversations_dir()
+    if save_path.is_dir():
+        imported = store.import_directory(save_path, force=reimport)
+        if imported:
+            console.print(f"[bold blue]Imported {imported} saved conversations from {save_path}[/bold blue]")
+    return store
+
+
+def print_conversations(conversations, snippets=False):
+    if not conversations:
+        click.echo("No conversations found.")
+        return
+    for summary in conversations:
+        started_at = (summary.started_at or "")[:16].replace("T", " ")
+        click.echo(
+            f"{summary.id:>6}  {started_at:<16}  {summary.model or '-':<20}  "
+            f"{summary.message_count:>4} msgs {summary.token_usage:>7} tokens  {summary.title}"
+        )
+        if snippets and summary.snippet:
+            click.echo(f"        {' '.join(summary.snippet.split())}")
+
+
+def save_to_store(document, file_path):
+    import sqlite3
+
+    from llm.store import get_conversation_store
+
+    try:
+        get_conversation_store().save(document, source=str(file_path.resolve()))
+    except sqlite3.Error as e:
+        console.print(f"[red]Error adding conversation to history: {e}[/red]")
+
+
 def load_system_prompt(ctx, default_system_prompt):
     system_prompt_files = ctx.obj.get(system_prompt_files_key)
     system_prompts = []
     for system_prompt_file in system_prompt_files:
         if system_prompt_file:
             if Path(system_prompt_file).exists():
-                system_prompts.append(Path(system_prompt_file).read_text())
+                system_prompts.append(read_file(system_prompt_file))
             else:
                 console.print(
                     f"[red]System prompt file not found at path: {system_prompt_file}[/red]"
@@ -0,0 +1,75 @@
+import pytest
+
+from bench.stub_server import StubServer, StubSettings, default_responder
+from llm import scheduler
+from llm.cache import get_response_cache
+from llm.client import get_llm_client
+from llm.metrics import get_metrics_store
+from llm.transport import close_http_clients
+from utils.config import read_config
+
+SINGLETONS = [read_config, get_response_cache, get_metrics_store, get_llm_client]
+
+
+def write_config(home, **values):
+    smart = home / ".smart"
+    smart.mkdir(parents=True, exist_ok=True)
+    config = {"model": "test-model", "client": "openai", "llm_token": "test", **values}
+    (smart / "config").write_text("".join(f"{key}={value}\n" for key, value in config.items()), encoding="utf-8")
+    read_config.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def stub_server():
+    """The benchmark stub server, answering without latency."""
+    with StubServer(StubSettings(latency=0.0, chunk_interval=0.0)) as server:
+        yield server
+
+
+@pytest.fixture
+def stub(stub_server, configure):
+    """The stub server with default settings, and the test config pointing at it."""
+    stub_server.settings = StubSettings(latency=0.0, chunk_interval=0.0)
+    stub_server.responder = default_responder
+    stub_server.counts = {"requests": 0, "errors": 0}
+    configure(base_url=stub_server.base_url, retry_base_delay=0.01, retry_max_delay=0.05)
+    yield stub_server
+    close_http_clients()
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """A throwaway HOME with a minimal config, and singletons that are rebuilt for it."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    write_config(tmp_path)
+    for getter in SINGLETONS:
+        getter.cache_clear()
+    # Schedulers are kept per profile for the whole process
+    monkeypatch.setattr(scheduler, "_schedulers", {})
+    yield tmp_path
+    for getter in SINGLETONS:
+        getter.cache_clear()
+
+
+@pytest.fixture
+def configure(home):
+    """Rewrite the test config with extra profile values."""
+    return lambda **values: write_config(home, **values)
+
+
+@pytest.fixture
+def configure_backup(home):
+    """Point the config at `base_url`, failing over and hedging to a `backup` profile after 0.1s."""
+
+    def configure(base_url, **values):
+        (home / ".smart" / "config").write_text(
+            "model=test-model\nclient=openai\nllm_token=test\n"
+            f"base_url={base_url}\nretry_base_delay=0.01\n"
+            "fallback_profiles=backup\nhedge_after=0.1\n"
+            + "".join(f"{key}={value}\n" for key, value in values.items())
+            + "[backup]\nmodel=backup-model\n",
+            encoding="utf-8",
+        )
+        read_config.cache_clear()
+
+    return configure
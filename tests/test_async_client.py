@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+from llm.client import get_async_llm_client
+from llm.conversation import Conversation
+from llm.transport import aclose_http_clients, pool_stats
+
+
+def conversation_with(message):
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message(message)
+    return conversation
+
+
+def test_slow_profile_is_hedged(stub, configure_backup):
+    configure_backup(stub.base_url)
+    release = threading.Event()
+
+    def responder(body):
+        if body["model"] == "test-model":
+            release.wait(5)
+        return {"content": body["model"]}
+
+    stub.responder = responder
+
+    async def main():
+        client = get_async_llm_client()
+        reply = await client.converse(conversation_with("hello"))
+        streamed = conversation_with("hello again")
+        deltas = [delta async for delta in client.converse_stream(streamed)]
+        return reply, deltas, streamed
+
+    started = time.monotonic()
+    try:
+        reply, deltas, streamed = asyncio.run(main())
+    finally:
+        release.set()
+
+    assert reply.choices[0].message.content == "backup-model"
+    assert "".join(delta.content for delta in deltas).strip() == "backup-model"
+    assert streamed.messages[-1]["content"].strip() == "backup-model"
+    assert time.monotonic() - started < 2
+
+
+def test_turns_on_one_conversation_are_serialized(stub):
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def responder(body):
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        time.sleep(0.1)
+        with lock:
+            in_flight.pop()
+        return {"content": f"seen {len(body['messages'])}"}
+
+    stub.responder = responder
+    shared = conversation_with("first")
+    others = [conversation_with("other"), conversation_with("another")]
+
+    async def main():
+        client = get_async_llm_client()
+        await asyncio.gather(client.converse(shared), client.converse(shared))
+        await asyncio.gather(*(client.converse(conversation) for conversation in others))
+
+    asyncio.run(main())
+
+    # The second turn on the shared conversation saw the first reply
+    assert [message["content"] for message in shared.messages] == ["first", "seen 1", "seen 2"]
+    assert peak[:2] == [1, 1]
+    assert max(peak[2:]) == 2
+
+
+def test_async_pool_is_closed_with_its_loop(stub):
+    async def main():
+        client = get_async_llm_client()
+        await client.converse(conversation_with("hello"))
+        before = [stats for stats in pool_stats() if stats["async"]]
+        await aclose_http_clients()
+        return before, [stats for stats in pool_stats() if stats["async"]]
+
+    before, after = asyncio.run(main())
+
+    assert len(before) == 1 and before[0]["requests"] == 1
+    assert after == []
@@ -0,0 +1,53 @@
+import io
+import json
+
+from llm.batch import ORDER_COMPLETION, read_checkpoint, read_records, run_batch
+
+
+def run_lines(lines, **kwargs):
+    output = io.StringIO()
+    counts = run_batch(lines, output, **kwargs)
+    return counts, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_invalid_lines_fail_on_their_own(stub):
+    lines = [
+        json.dumps({"id": "a", "instruction": "hello"}),
+        "{not json",
+        "",
+        json.dumps({"id": "c", "command": "dance"}),
+        json.dumps(["not", "an", "object"]),
+        json.dumps({"id": "e", "command": "emoji", "text": "happy"}),
+    ]
+    counts, results = run_lines(lines, concurrency=2)
+
+    assert counts == {"ok": 2, "failed": 3, "skipped": 0}
+    assert [result["index"] for result in results] == [0, 1, 3, 4, 5]
+    assert results[0]["id"] == "a" and results[0]["error"] is None and results[0]["output"]
+    assert results[1]["error"].startswith("Invalid batch record")
+    assert results[2]["id"] == "c" and "Unsupported batch command: dance" in results[2]["error"]
+    assert results[3]["error"].startswith("Invalid batch record")
+    assert results[4]["output"] == "😊"
+    # Invalid records never reach the server
+    assert stub.counts["requests"] == 2
+
+
+def test_results_are_mapped_back_by_index_in_completion_order(stub):
+    lines = [json.dumps({"id": str(i), "instruction": f"question {i}"}) for i in range(6)]
+    counts, results = run_lines(lines, concurrency=3, order=ORDER_COMPLETION, skip={2})
+
+    assert counts == {"ok": 5, "failed": 0, "skipped": 1}
+    assert sorted(result["index"] for result in results) == [0, 1, 3, 4, 5]
+    assert all(result["id"] == str(result["index"]) for result in results)
+
+
+def test_checkpoint_only_skips_successful_records():
+    records = list(read_records(['{"instruction": "a"}', "oops"]))
+    output = io.StringIO(
+        json.dumps({"index": 0, "error": None}) + "\n"
+        + json.dumps({"index": 1, "error": records[1].error}) + "\n"
+        + '{"index": 2, "err'
+    )
+
+    assert records[0].error is None
+    assert read_checkpoint(output) == {0}
@@ -0,0 +1,72 @@
+import json
+
+from bench.stub_server import default_responder
+from llm.batch import read_records
+from llm.batch_api import BatchJobs, render_requests, requests_hash, run_batch_api
+
+
+def records_of(*records):
+    return list(read_records(json.dumps(record) for record in records))
+
+
+def run(records, state_path, resume=False):
+    results = []
+    counts = run_batch_api(records, results.append, state_path, poll_interval=0.0, resume=resume)
+    return counts, results
+
+
+def test_results_are_mapped_back_to_input_lines(stub, tmp_path):
+    stub.responder = lambda body: {"content": body["messages"][-1]["content"].upper()}
+    records = records_of(
+        {"id": "a", "instruction": "first"},
+        {"id": "b", "instruction": "second", "profile": "missing"},
+        {"id": "c", "command": "dance"},
+        {"id": "d", "instruction": "fourth"},
+    )
+    counts, results = run(records, tmp_path / "out.jsonl.jobs.json")
+
+    assert counts == {"ok": 2, "failed": 2, "skipped": 0}
+    assert [(result["index"], result["id"]) for result in results] == [(0, "a"), (1, "b"), (2, "c"), (3, "d")]
+    assert results[0]["output"] == "FIRST" and results[0]["tokens"]
+    assert results[1]["error"] == "Profile missing not found"
+    assert "Unsupported batch command" in results[2]["error"]
+    assert results[3]["output"] == "FOURTH"
+    assert len(stub.batches) == 1
+    assert not (tmp_path / "out.jsonl.jobs.json").exists()
+
+
+def test_failed_request_lines_become_errors(stub, tmp_path):
+    stub.settings.error_rate = 1.0
+    counts, results = run(records_of({"instruction": "hello"}), tmp_path / "jobs.json")
+
+    assert counts["failed"] == 1
+    assert results[0]["error"] == "injected error"
+
+
+def test_state_is_only_reused_on_resume_with_the_same_input(stub, tmp_path):
+    state_path = tmp_path / "jobs.json"
+    records = records_of({"instruction": "hello"})
+    rendered = render_requests(records)
+
+    def stale_state(input_hash):
+        # A job left by an earlier run that never got to write its results
+        stub.responder = lambda body: {"content": "from the earlier job"}
+        jobs = BatchJobs(state_path, input_hash)
+        _, earlier = run(records, tmp_path / "earlier.json")
+        jobs.jobs = {"default": list(stub.batches)[-1]}
+        jobs.save()
+        stub.responder = default_responder
+        return earlier
+
+    stale_state(requests_hash(rendered))
+    _, results = run(records, state_path, resume=True)
+    assert results[0]["output"] == "from the earlier job"
+
+    stale_state(requests_hash(rendered))
+    _, results = run(records, state_path)
+    assert results[0]["output"] != "from the earlier job"
+
+    stale_state("another input")
+    _, results = run(records, state_path, resume=True)
+    assert results[0]["output"] != "from the earlier job"
+    assert not state_path.exists()
@@ -0,0 +1,100 @@
+import os
+import types
+
+import pytest
+from click.testing import CliRunner
+
+import main
+from llm import cache as cache_module
+from llm.cache import ResponseCache
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    return ResponseCache(tmp_path / "responses", ttl_seconds=60, max_entries=3)
+
+
+def age(cache, key, seconds):
+    """Pretend the entry was last used `seconds` ago."""
+    path = cache._path(key)
+    then = path.stat().st_mtime - seconds
+    os.utime(path, (then, then))
+
+
+def test_entries_expire_after_the_ttl(response_cache, monkeypatch):
+    response_cache.put("key", "reply")
+    assert response_cache.get("key") == "reply"
+
+    now = cache_module.time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 61)
+    assert response_cache.get("key") is None
+    assert not response_cache._path("key").exists()
+
+
+def test_least_recently_used_entries_are_evicted_first(response_cache):
+    for index, key in enumerate(["a", "b", "c"]):
+        response_cache.put(key, key)
+        age(response_cache, key, 30 - index)
+    # Reading "a" makes "b" the least recently used entry
+    assert response_cache.get("a") == "a"
+
+    response_cache.put("d", "d")
+
+    assert response_cache.get("b") is None
+    assert [response_cache.get(key) for key in ["a", "c", "d"]] == ["a", "c", "d"]
+
+
+def test_the_directory_is_only_scanned_once_a_limit_is_crossed(tmp_path, monkeypatch):
+    response_cache = ResponseCache(tmp_path / "responses", max_entries=10)
+    scans = []
+    evict = ResponseCache.evict
+    monkeypatch.setattr(ResponseCache, "evict", lambda self: scans.append(1) or evict(self))
+
+    for index in range(10):
+        response_cache.put(f"key{index}", "reply")
+    # The first put counts the entries, the next ones update the usage file
+    assert len(scans) == 1
+    response_cache.put("key0", "replaced")
+    assert len(scans) == 1
+
+    response_cache.put("key10", "reply")
+    assert len(scans) == 2
+    assert len(list(response_cache.directory.glob("*.json"))) == 9
+    assert response_cache._read_usage()[0] == 9
+
+
+def test_keys_cover_model_messages_and_knowledge_base():
+    messages = [{"role": "user", "content": "happy"}]
+    key = ResponseCache.make_key("gpt-4o", messages, "kb1")
+
+    assert key == ResponseCache.make_key("gpt-4o", [dict(messages[0])], "kb1")
+    assert key != ResponseCache.make_key("gpt-4o-mini", messages, "kb1")
+    assert key != ResponseCache.make_key("gpt-4o", [{"role": "user", "content": "sad"}], "kb1")
+    assert key != ResponseCache.make_key("gpt-4o", messages, "kb2")
+    assert key != ResponseCache.make_key("gpt-4o", messages)
+
+
+def run_emoji(*args):
+    result = CliRunner().invoke(main.cli, [*args, "emoji", "-i", "happy"])
+    assert result.exit_code == 0, result.output
+
+
+@pytest.fixture
+def clipboard(monkeypatch):
+    monkeypatch.setattr(main, "pyperclip", types.SimpleNamespace(copy=lambda text: None))
+
+
+def test_repeated_commands_are_served_from_the_cache(stub, clipboard):
+    run_emoji()
+    run_emoji()
+    assert stub.counts["requests"] == 1
+
+    run_emoji("--no-cache")
+    assert stub.counts["requests"] == 2
+
+
+def test_commands_can_opt_out_of_the_cache(stub, configure, clipboard):
+    configure(base_url=stub.base_url, cache_disabled_commands="goto, emoji")
+    run_emoji()
+    run_emoji()
+    assert stub.counts["requests"] == 2
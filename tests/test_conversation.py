@@ -0,0 +1,94 @@
+import pytest
+
+import llm.conversation
+from llm.context import ContextPolicy, STRATEGY_DROP, STRATEGY_SUMMARIZE
+from llm.conversation import Conversation, count_message_tokens
+
+
+def count_calls(monkeypatch):
+    calls = []
+
+    def counting(message):
+        calls.append(message)
+        return count_message_tokens(message)
+
+    monkeypatch.setattr(llm.conversation, "count_message_tokens", counting)
+    return calls
+
+
+def test_messages_are_counted_only_when_needed(monkeypatch):
+    calls = count_calls(monkeypatch)
+    conversation = Conversation(model="test-model")
+    conversation.add_system_message("You are helpful.")
+    conversation.add_user_message("hello")
+    conversation.request_messages()
+    assert calls == []
+
+    total = conversation.estimated_tokens
+    assert total == sum(count_message_tokens(message) for message in conversation.messages)
+    assert len(calls) == 2
+    # Counts are cached per message
+    assert conversation.estimated_tokens == total
+    assert len(calls) == 2
+
+
+def test_deleting_a_message_recounts_it(monkeypatch):
+    calls = count_calls(monkeypatch)
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("a rather long message " * 20)
+    before = conversation.estimated_tokens
+    conversation.delete_message(0)
+
+    assert conversation.estimated_tokens < before
+    assert len(calls) == 2
+
+
+def long_conversation(model, strategy):
+    conversation = Conversation(model=model)
+    conversation.context_policy = ContextPolicy(max_tokens=200, keep_last_turns=2, strategy=strategy)
+    conversation.add_system_message("You are a terse assistant.")
+    for turn in range(6):
+        conversation.add_user_message(f"question {turn} " + "padding " * 20)
+        conversation.add_assistant_message(f"answer {turn}")
+    return conversation
+
+
+@pytest.mark.parametrize("model", ["test-model", "o1-mini"])
+def test_dropping_old_turns_keeps_the_system_prompt(model):
+    conversation = long_conversation(model, STRATEGY_DROP)
+    request = conversation.request_messages()
+
+    assert request[0]["content"] == "You are a terse assistant."
+    assert request[0]["role"] == ("user" if model == "o1-mini" else "system")
+    assert request[1:] == conversation.messages[-4:]
+
+
+@pytest.mark.parametrize("model", ["test-model", "o1-mini"])
+def test_summarized_turns_follow_the_system_prompt(model):
+    conversation = long_conversation(model, STRATEGY_SUMMARIZE)
+    folded = []
+
+    def summarizer(previous, messages):
+        folded.append(messages)
+        return "they asked five questions"
+
+    request = conversation.request_messages(summarizer)
+
+    assert request[0]["content"] == "You are a terse assistant."
+    assert request[1]["content"].endswith("they asked five questions")
+    assert request[-1]["content"] == "answer 5"
+    # The system prompt is never folded into the summary
+    assert all(message["content"] != "You are a terse assistant." for message in folded[0])
+    assert folded[0][0]["content"].startswith("question 0")
+
+
+def test_pinned_messages_survive_saving_and_loading():
+    conversation = long_conversation("o1-mini", STRATEGY_DROP)
+    document = conversation.to_dict()
+
+    loaded = Conversation(model="o1-mini")
+    loaded.context_policy = conversation.context_policy
+    loaded.load_messages(document["messages"], document["pinned"])
+
+    assert loaded.request_messages() == conversation.request_messages()
+    assert loaded.has_system_message("You are a terse assistant.")
@@ -0,0 +1,69 @@
+import json
+import socket
+import threading
+import time
+
+from llm.conversation import Conversation
+from llm.daemon import DaemonClient, serve
+
+
+def test_converse_closes_the_socket_after_the_reply(tmp_path):
+    socket_path = tmp_path / "daemon.sock"
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen(1)
+    closed = threading.Event()
+
+    def serve():
+        connection, _ = server.accept()
+        with connection, connection.makefile("r", encoding="utf-8") as reader:
+            reader.readline()
+            reply = {"content": "hi", "token_usage": 3}
+            connection.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+            connection.settimeout(5)
+            # An empty read means the client closed its end
+            if connection.recv(1) == b"":
+                closed.set()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("hello")
+    reply = DaemonClient(socket_path, timeout=5).converse(conversation)
+
+    assert reply.choices[0].message.content == "hi"
+    assert closed.wait(5)
+    assert conversation.messages[-1] == {"role": "assistant", "content": "hi"}
+    assert conversation.get_token_usage() == 3
+    thread.join(5)
+    server.close()
+
+
+def test_serve_forwards_conversations_to_the_configured_server(stub, tmp_path):
+    stub.responder = lambda body: {"content": f"echo {body['messages'][-1]['content']}"}
+    socket_path = tmp_path / "smart.sock"
+    thread = threading.Thread(target=serve, args=(socket_path,), daemon=True)
+    thread.start()
+    client = DaemonClient(socket_path, timeout=10)
+    for _ in range(100):
+        if client.ping():
+            break
+        time.sleep(0.05)
+
+    try:
+        conversation = Conversation(model="test-model")
+        conversation.add_user_message("hello")
+        reply = client.converse(conversation)
+        assert reply.choices[0].message.content == "echo hello"
+        assert conversation.messages[-1] == {"role": "assistant", "content": "echo hello"}
+        assert conversation.get_token_usage()
+
+        conversation.add_user_message("again")
+        deltas = [delta.content for delta in client.converse_stream(conversation)]
+        assert "".join(deltas).strip() == "echo again"
+        assert conversation.messages[-1] == {"role": "assistant", "content": "".join(deltas)}
+        assert stub.counts["requests"] == 2
+    finally:
+        assert client.shutdown()
+        thread.join(5)
+    assert not socket_path.exists()
@@ -0,0 +1,36 @@
+import json
+
+from llm.fast_path import FastPathMatcher, _flush_matchers, normalize_instruction
+
+
+def test_keys_keep_word_order_and_repeats():
+    assert normalize_instruction("Copy a.txt to b.txt") != normalize_instruction("copy b.txt to a.txt")
+    assert normalize_instruction("tail the log tail") != normalize_instruction("tail log")
+    # Case and filler words still do not matter
+    assert normalize_instruction("Please list ALL the files") == normalize_instruction("list files")
+
+
+def test_learned_commands_follow_word_order(tmp_path):
+    matcher = FastPathMatcher(tmp_path / "fast_path.json")
+    matcher.learn("copy a.txt to b.txt", "cp a.txt b.txt")
+    matcher.learn("copy a.txt to b.txt", "cp a.txt b.txt")
+
+    assert matcher.match("Copy a.txt to b.txt").command == "cp a.txt b.txt"
+    assert matcher.match("copy b.txt to a.txt") is None
+
+
+def test_lookups_are_saved_with_changes_and_at_exit(tmp_path):
+    store_path = tmp_path / "fast_path.json"
+    matcher = FastPathMatcher(store_path)
+    matcher.match("list files")
+    assert not store_path.exists()
+
+    matcher.learn("list files", "ls")
+    assert json.loads(store_path.read_text())["stats"]["lookups"] == 1
+
+    matcher.match("list files")
+    matcher.match("list files")
+    assert json.loads(store_path.read_text())["stats"]["lookups"] == 1
+    _flush_matchers()
+    assert json.loads(store_path.read_text())["stats"]["lookups"] == 3
+    assert FastPathMatcher(store_path).learned == matcher.learned
@@ -0,0 +1,16 @@
+from utils.helper import read_file
+
+
+def test_read_file_reads_the_current_content(tmp_path):
+    path = tmp_path / "kb.md"
+    path.write_text("first", encoding="utf-8")
+    assert read_file(str(path)) == "first"
+
+    path.write_text("second revision", encoding="utf-8")
+    assert read_file(str(path)) == "second revision"
+    assert read_file(path) == "second revision"
+
+
+def test_read_file_defaults_for_missing_files(tmp_path):
+    assert read_file(str(tmp_path / "missing.md"), default="none") == "none"
+    assert read_file("") == ""
@@ -0,0 +1,55 @@
+import pytest
+
+from utils import images
+from utils.images import IMAGE_REF_PREFIX, MISSING_IMAGE_TEXT, persistable_message, prepare_image, resolve_message
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def write_image(path, size, color):
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+def test_large_images_are_downscaled(tmp_path):
+    block = prepare_image(write_image(tmp_path / "wide.png", (4000, 1000), "red"))
+
+    assert block["image_url"]["url"].startswith("data:image/jpeg;base64,")
+    assert images._dimensions[block["image_url"]["url"]] == (2048, 512)
+
+
+def test_cache_evicts_least_recently_used_images(tmp_path, configure):
+    first = prepare_image(write_image(tmp_path / "first.png", (600, 600), "red"))
+    entry_bytes = sum(path.stat().st_size for path in images.get_image_cache_dir().glob("*.json"))
+    configure(image_cache_max_bytes=int(entry_bytes * 2.5))
+    prepare_image(write_image(tmp_path / "second.png", (600, 600), "green"))
+    prepare_image(write_image(tmp_path / "third.png", (600, 600), "blue"))
+
+    cached = list(images.get_image_cache_dir().glob("*.json"))
+    assert len(cached) == 2
+    # The first image was evicted, a saved conversation referring to it still loads
+    message = persistable_message({"role": "user", "content": [first]})
+    assert message["content"][0]["image_url"]["url"].startswith(IMAGE_REF_PREFIX)
+    assert resolve_message(message)["content"] == [{"type": "text", "text": MISSING_IMAGE_TEXT}]
+
+
+def test_references_resolve_to_the_cached_image(tmp_path):
+    block = prepare_image(write_image(tmp_path / "small.png", (100, 100), "red"))
+    message = persistable_message({"role": "user", "content": [block]})
+
+    assert resolve_message(message)["content"][0]["image_url"]["url"] == block["image_url"]["url"]
+
+
+def test_images_remembered_in_memory_are_bounded(tmp_path, monkeypatch):
+    for name in ("_refs", "_dimensions", "_prepared"):
+        monkeypatch.setattr(images, name, images._LruDict(2))
+    blocks = [
+        prepare_image(write_image(tmp_path / f"{color}.png", (100, 100), color))
+        for color in ("red", "green", "blue")
+    ]
+
+    assert len(images._prepared) == len(images._refs) == len(images._dimensions) == 2
+    assert blocks[0]["image_url"]["url"] not in images._refs
+    # A forgotten image is prepared again from the disk cache
+    assert prepare_image(str(tmp_path / "red.png")) == blocks[0]
+    assert blocks[1]["image_url"]["url"] not in images._refs
@@ -0,0 +1,97 @@
+import json
+import os
+import time
+import types
+
+from click.testing import CliRunner
+
+from llm.conversation import Conversation
+from llm.journal import ConversationJournal, prune_journals, read_journal
+
+
+def journaled_conversation(path, *messages):
+    conversation = Conversation(model="test-model")
+    conversation.context_policy = None
+    for message in messages:
+        conversation.add_user_message(message)
+    conversation.attach_journal(ConversationJournal(path))
+    return conversation
+
+
+def test_replay_matches_the_conversation(tmp_path):
+    conversation = journaled_conversation(tmp_path / "a.jsonl", "first")
+    conversation.add_assistant_message("second")
+    conversation.delete_message(0)
+    conversation.token_usage = 12
+    conversation.journal.record_meta(conversation.model, conversation.token_usage, conversation.pinned)
+    conversation.journal.close()
+
+    assert read_journal(tmp_path / "a.jsonl") == conversation.to_dict()
+
+
+def test_compaction_keeps_the_latest_state(tmp_path):
+    path = tmp_path / "a.jsonl"
+    conversation = journaled_conversation(path, "question")
+    for i in range(100):
+        conversation.journal.record_meta(conversation.model, i)
+    conversation.journal.flush()
+
+    # Superseded meta records were compacted away
+    assert len(path.read_text(encoding="utf-8").splitlines()) < 50
+    conversation.journal.close()
+    document = read_journal(path)
+    assert document["token_usage"] == 99
+    assert [m["content"] for m in document["messages"]] == ["question"]
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = tmp_path / "a.jsonl"
+    conversation = journaled_conversation(path, "question")
+    conversation.journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"type": "message", "index": 1, "message": {"role": "user"}})[:20])
+
+    assert [m["content"] for m in read_journal(path)["messages"]] == ["question"]
+
+
+def test_conversations_do_not_share_journals(tmp_path, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "conversation_journal_dir", tmp_path)
+    chat = Conversation(model="test-model")
+    chat.add_user_message("chat question")
+    main.start_journal(chat)
+    # Another session journals its own conversation while the chat is open
+    other = Conversation(model="test-model")
+    other.add_user_message("run request")
+    main.start_journal(other)
+    chat.add_assistant_message("chat answer")
+    chat.journal.close()
+    other.journal.close()
+
+    assert chat.journal.path != other.journal.path
+    assert [m["content"] for m in read_journal(chat.journal.path)["messages"]] == ["chat question", "chat answer"]
+    assert [m["content"] for m in read_journal(other.journal.path)["messages"]] == ["run request"]
+
+
+def test_one_shot_commands_are_not_journaled(stub, tmp_path, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "conversation_journal_dir", tmp_path / "journals")
+    monkeypatch.setattr(main, "pyperclip", types.SimpleNamespace(copy=lambda text: None))
+    result = CliRunner().invoke(main.cli, ["emoji", "-i", "happy"])
+
+    assert result.exit_code == 0, result.output
+    assert not (tmp_path / "journals").exists()
+
+
+def test_old_and_surplus_journals_are_pruned(tmp_path):
+    now = time.time()
+    for age_days in range(5):
+        path = tmp_path / f"{age_days}.jsonl"
+        path.write_text("")
+        os.utime(path, (now - age_days * 24 * 3600, now - age_days * 24 * 3600))
+
+    assert prune_journals(tmp_path, max_age_seconds=3.5 * 24 * 3600, max_files=10) == 1
+    assert prune_journals(tmp_path, max_age_seconds=3.5 * 24 * 3600, max_files=2) == 2
+    assert sorted(path.name for path in tmp_path.glob("*.jsonl")) == ["0.jsonl", "1.jsonl"]
@@ -0,0 +1,103 @@
+import os
+import types
+
+from click.testing import CliRunner
+
+import main
+from llm import kb_index
+from llm.kb_index import KBIndex, load_kb_index, parse_kb
+
+KB = """# Shell helpers
+Use these functions when they fit.
+
+## `cleanup_temp`
+Delete temporary files from the build directory.
+
+## `docker_logs`
+Show the logs of a docker container.
+
+## `docker_prune`
+Remove stopped docker containers and dangling docker images.
+
+## `open_notes`
+Open today's notes in the editor.
+"""
+
+
+def write_kb(tmp_path, content=KB):
+    path = tmp_path / "kb.md"
+    path.write_text(content)
+    return path
+
+
+def test_parse_kb_splits_preamble_and_entries():
+    preamble, entries = parse_kb(KB)
+
+    assert preamble == "# Shell helpers\nUse these functions when they fit.\n\n"
+    assert [entry.name for entry in entries] == ["cleanup_temp", "docker_logs", "docker_prune", "open_notes"]
+    assert entries[1].text == "## `docker_logs`\nShow the logs of a docker container.\n\n"
+    assert len({entry.hash for entry in entries}) == 4
+
+
+def test_search_ranks_by_bm25(tmp_path):
+    index = load_kb_index(write_kb(tmp_path))
+
+    # Rare terms outweigh "docker", which two entries share
+    assert [entry.name for entry in index.search("docker logs")] == ["docker_logs", "docker_prune"]
+    assert [entry.name for entry in index.search("docker images", k=1)] == ["docker_prune"]
+    # Prefix terms match related words
+    assert [entry.name for entry in index.search("clean temp")] == ["cleanup_temp"]
+    assert index.search("kubernetes") == []
+    assert KBIndex.render(index.search("notes")) == "## `open_notes`\nOpen today's notes in the editor.\n\n"
+
+
+def test_the_index_is_persisted_and_rebuilt_when_the_file_changes(tmp_path, monkeypatch):
+    path = write_kb(tmp_path)
+    load_kb_index(path)
+    assert len(list(kb_index.get_index_dir().glob("*.json"))) == 1
+
+    def no_parsing(content):
+        raise AssertionError("the stored index should have been used")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(kb_index, "parse_kb", no_parsing)
+        assert len(load_kb_index(path)) == 4
+
+    path.write_text(KB + "\n## `kubectl_pods`\nList the kubernetes pods.\n")
+    index = load_kb_index(path)
+    assert [entry.name for entry in index.search("kubernetes")] == ["kubectl_pods"]
+
+
+def test_unchanged_entries_reuse_their_terms(tmp_path, monkeypatch):
+    path = write_kb(tmp_path)
+    load_kb_index(path)
+    tokenized = []
+    tokenize = kb_index.tokenize
+    monkeypatch.setattr(kb_index, "tokenize", lambda text: tokenized.append(text) or tokenize(text))
+
+    path.write_text(KB.replace("Open today's notes", "Open yesterday's notes"))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    index = load_kb_index(path)
+
+    assert tokenized == ["## `open_notes`\nOpen yesterday's notes in the editor.\n"]
+    assert [entry.name for entry in index.search("yesterday")] == ["open_notes"]
+
+
+def test_top_k_limits_the_entries_sent(stub, tmp_path, monkeypatch):
+    path = write_kb(tmp_path)
+    requests = []
+    stub.responder = lambda body: requests.append(body["messages"]) or {"content": "https://example.com"}
+    monkeypatch.setattr(main, "webbrowser", types.SimpleNamespace(open=lambda url: None))
+
+    result = CliRunner().invoke(main.cli, ["goto", "--kb", str(path), "--top-k", "1", "-i", "docker logs"])
+
+    assert result.exit_code == 0, result.output
+    sent = "\n".join(str(message["content"]) for message in requests[0])
+    assert "docker_logs" in sent
+    assert "docker_prune" not in sent and "cleanup_temp" not in sent
+
+    requests.clear()
+    result = CliRunner().invoke(main.cli, ["goto", "--kb", str(path), "--top-k", "0", "-i", "docker logs"])
+    assert result.exit_code == 0, result.output
+    assert "cleanup_temp" in requests[0][0]["content"]
@@ -0,0 +1,18 @@
+from utils.large_file import load_text_file, split_file_options
+
+
+def test_options_are_split_from_the_path(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("".join(f"line {i}\n" for i in range(10)))
+
+    assert split_file_options(f"{path}?tail=2&grep=ERROR") == (str(path), {"tail": "2", "grep": "ERROR"})
+    assert load_text_file(*split_file_options(f"{path}?head=2")).endswith("line 0\nline 1\n")
+
+
+def test_line_counts_that_are_not_numbers_are_dropped(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("first\nsecond\n")
+
+    assert split_file_options(f"{path}?head=abc") == (str(path), {})
+    assert split_file_options(f"{path}?tail=-3&grep=x") == (str(path), {"grep": "x"})
+    assert load_text_file(*split_file_options(f"{path}?head=")) == "first\nsecond\n"
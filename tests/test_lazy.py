@@ -0,0 +1,107 @@
+import json
+import socket
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from utils.lazy import LazyObject, lazy_import, unwrap
+
+REPO = Path(__file__).resolve().parent.parent
+
+# Runs a one-shot command in a fresh interpreter and reports which heavy modules got executed.
+# A lazy module sits in sys.modules from the start, it only turns into a plain module once loaded.
+ISOLATION_SCRIPT = """
+import json, sys, types
+import main
+
+main.pyperclip = types.SimpleNamespace(copy=lambda text: None)
+main.webbrowser = types.SimpleNamespace(open=lambda url: None)
+main.cli.main(sys.argv[1:], standalone_mode=False)
+loaded = [name for name in ("openai", "portkey_ai", "tiktoken") if type(sys.modules.get(name)) is types.ModuleType]
+print(json.dumps(loaded))
+"""
+
+
+def test_lazy_import_defers_the_module_body(tmp_path, monkeypatch):
+    (tmp_path / "lazy_probe.py").write_text("import builtins\nbuiltins.lazy_probe_runs += 1\nvalue = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr("builtins.lazy_probe_runs", 0, raising=False)
+    monkeypatch.delitem(sys.modules, "lazy_probe", raising=False)
+
+    module = lazy_import("lazy_probe")
+    import builtins
+
+    assert builtins.lazy_probe_runs == 0
+    assert module.value == 42
+    assert module.value == 42
+    assert builtins.lazy_probe_runs == 1
+
+
+def test_lazy_import_reuses_loaded_modules_and_rejects_missing_ones():
+    assert lazy_import("json") is json
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("no_such_module_anywhere")
+
+
+def test_lazy_object_builds_once_and_forwards_attributes():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return type("Target", (), {"name": "first"})()
+
+    proxy = LazyObject(factory)
+    assert calls == []
+
+    proxy.name = "second"
+    assert proxy.name == "second"
+    assert unwrap(proxy).name == "second"
+    assert calls == [1]
+    assert unwrap("plain") == "plain"
+
+
+def fake_daemon(socket_path, content):
+    """A daemon that answers pings and converse requests with `content`."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen(4)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            with connection, connection.makefile("r", encoding="utf-8") as reader:
+                request = json.loads(reader.readline())
+                if request["action"] == "ping":
+                    reply = {"ok": True}
+                else:
+                    reply = {"content": content, "token_usage": 1}
+                connection.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+
+@pytest.mark.parametrize("command", ["emoji", "goto"])
+def test_one_shot_commands_do_not_load_llm_sdks(command, home, tmp_path, monkeypatch):
+    socket_path = tmp_path / "daemon.sock"
+    monkeypatch.setenv("SMART_DAEMON_SOCKET", str(socket_path))
+    server = fake_daemon(socket_path, "https://example.com")
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", ISOLATION_SCRIPT, "--daemon", "--no-cache", command, "-i", "happy"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    finally:
+        server.close()
+
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.splitlines()[-1]) == []
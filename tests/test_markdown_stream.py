@@ -0,0 +1,65 @@
+import io
+
+import pytest
+from rich.console import Console
+
+from utils.markdown_stream import MarkdownStream
+
+
+@pytest.fixture
+def printed(monkeypatch):
+    """The Markdown source of every block the stream prints."""
+    blocks = []
+    console = Console(file=io.StringIO(), width=80)
+    monkeypatch.setattr(console, "print", lambda renderable: blocks.append(renderable.markup))
+    return console, blocks
+
+
+def stream_lines(stream, *lines):
+    for line in lines:
+        stream.update(line + "\n")
+
+
+def test_paragraphs_and_fences_are_printed_once_complete(printed):
+    console, blocks = printed
+    with MarkdownStream(console) as stream:
+        stream_lines(stream, "Intro line", "")
+        assert blocks == ["Intro line\n\n"]
+
+        stream_lines(stream, "```python", "x = 1", "", "y = 2")
+        # Blank lines inside a fence do not end it
+        assert len(blocks) == 1
+        stream_lines(stream, "```")
+        assert blocks[-1] == "```python\nx = 1\n\ny = 2\n```\n"
+        stream.update("Outro")
+    assert blocks[-1] == "Outro"
+
+
+def test_loose_lists_and_blockquotes_are_printed_whole(printed):
+    console, blocks = printed
+    with MarkdownStream(console) as stream:
+        stream_lines(stream, "1. first", "", "   more about first", "", "2. second", "")
+        assert blocks == []
+        stream_lines(stream, "> quoted", ">", "> still quoted", "")
+        assert blocks == ["1. first\n\n   more about first\n\n2. second\n\n"]
+        stream_lines(stream, "After the quote")
+        assert blocks[-1] == "> quoted\n>\n> still quoted\n\n"
+    assert blocks[-1] == "After the quote\n"
+
+
+def test_fences_inside_list_items_end_with_the_list(printed):
+    console, blocks = printed
+    with MarkdownStream(console) as stream:
+        stream_lines(stream, "- step one", "", "  ```", "  make", "  ```", "- step two", "", "Done.")
+    assert blocks == ["- step one\n\n  ```\n  make\n  ```\n- step two\n\n", "Done.\n"]
+
+
+def test_the_live_tail_is_cropped_and_keeps_the_open_fence(printed):
+    console, blocks = printed
+    stream = MarkdownStream(console, max_live_lines=40)
+    with stream:
+        stream_lines(stream, "~~~", *[f"line {i}" for i in range(100)])
+        tail = stream.live_text().splitlines()
+        assert blocks == []
+    assert tail[0] == "~~~"
+    assert tail[1:] == [f"line {i}" for i in range(60, 100)]
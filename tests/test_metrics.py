@@ -0,0 +1,133 @@
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import main
+from llm.metrics import MetricsStore, get_metrics_store, percentile, summarize, to_otlp, to_prometheus
+
+
+def record(command="emoji", model="gpt-4o", latency=1.0, **values):
+    return {
+        "name": "chat.completions",
+        "command": command,
+        "model": model,
+        "profile": "default",
+        "stream": False,
+        "start_time": 1700000000.0,
+        "queue_time": 0.0,
+        "ttft": None,
+        "latency": latency,
+        "prompt_tokens": 10,
+        "completion_tokens": 2,
+        "cache_hit": False,
+        "retries": 0,
+        "error": None,
+        "trace_id": "a" * 32,
+        "span_id": "b" * 16,
+        **values,
+    }
+
+
+@pytest.mark.parametrize("p, expected", [(50, 5), (95, 10), (99, 10), (10, 1), (0, 1)])
+def test_percentile_uses_the_nearest_rank(p, expected):
+    assert percentile(list(range(10, 0, -1)), p) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) is None
+
+
+def test_summarize_groups_by_command_and_model():
+    records = [record(latency=latency) for latency in (1.0, 2.0, 3.0, 4.0)]
+    records += [
+        record(latency=0.0, cache_hit=True),
+        record(latency=9.0, error="APIError", retries=2),
+        record(command="chat", stream=True, ttft=0.2, queue_time=0.5),
+    ]
+    chat, emoji = summarize(records)
+
+    assert (chat["command"], chat["model"], chat["ttft_p50"], chat["queue_time"]) == ("chat", "gpt-4o", 0.2, 0.5)
+    assert emoji["requests"] == 6
+    assert (emoji["errors"], emoji["cache_hits"], emoji["retries"]) == (1, 1, 2)
+    assert emoji["prompt_tokens"] == 60
+    # Cache hits and errors do not count towards the latencies
+    assert (emoji["latency_p50"], emoji["latency_p99"]) == (2.0, 4.0)
+    assert emoji["ttft_p50"] is None
+
+
+def test_prometheus_text():
+    text = to_prometheus([record(), record(command='say "hi"', latency=2.0, error="APIError")])
+    lines = text.splitlines()
+
+    assert "# TYPE smart_request_latency_seconds summary" in lines
+    assert 'smart_request_latency_seconds{command="emoji",model="gpt-4o",quantile="0.5"} 1.000000' in lines
+    assert 'smart_requests_total{command="say \\"hi\\"",model="gpt-4o"} 1' in lines
+    assert 'smart_request_errors_total{command="say \\"hi\\"",model="gpt-4o"} 1' in lines
+    assert 'smart_tokens_total{command="emoji",model="gpt-4o",kind="prompt"} 10' in lines
+    # No latency quantiles for a group without successful requests
+    assert not any(line.startswith('smart_request_latency_seconds{command="say') for line in lines)
+    assert text.endswith("\n")
+
+
+def test_otlp_spans():
+    export = to_otlp([record(latency=0.5), record(error="APIError", cache_hit=True)])
+    [resource] = export["resourceSpans"]
+    ok, failed = resource["scopeSpans"][0]["spans"]
+
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "smart"}}]
+    assert int(ok["endTimeUnixNano"]) - int(ok["startTimeUnixNano"]) == 500_000_000
+    assert ok["status"] == {"code": 1}
+    assert {"key": "gen_ai.usage.input_tokens", "value": {"intValue": "10"}} in ok["attributes"]
+    assert {"key": "smart.cache_hit", "value": {"boolValue": True}} in failed["attributes"]
+    assert failed["status"] == {"code": 2, "message": "APIError"}
+    assert not any(attribute["key"] == "smart.ttft" for attribute in ok["attributes"])
+
+
+def test_store_rolls_over_to_one_older_file(tmp_path):
+    store = MetricsStore(tmp_path / "requests.jsonl", max_bytes=1000)
+    for index in range(12):
+        store.append(record(latency=float(index), start_time=float(index)))
+
+    assert store.rolled_path.exists()
+    assert store.path.stat().st_size <= 1000
+    latencies = [r["latency"] for r in store.read()]
+    # The oldest records went with the file rolled over twice, the rest stay in order
+    assert latencies == sorted(latencies) and latencies[-1] == 11.0 and len(latencies) < 12
+    assert [r["latency"] for r in store.read(since=10.0)] == [10.0, 11.0]
+
+    with open(store.path, "a", encoding="utf-8") as f:
+        f.write('{"torn')
+    assert len(store.read()) == len(latencies)
+
+
+def test_disabled_store_writes_nothing(tmp_path):
+    store = MetricsStore(tmp_path / "requests.jsonl", enabled=False)
+    store.append(record())
+
+    assert store.read() == []
+    assert not store.path.exists()
+
+
+def test_stats_command_filters_and_formats(home):
+    store = get_metrics_store()
+    now = time.time()
+    store.append(record(command="emoji", start_time=now, latency=1.5))
+    store.append(record(command="goto", start_time=now))
+    store.append(record(command="emoji", start_time=now - 48 * 3600))
+    runner = CliRunner()
+
+    summary = json.loads(runner.invoke(main.cli, ["stats", "--format", "json", "--since", "24"]).output)
+    assert [(row["command"], row["requests"]) for row in summary] == [("emoji", 1), ("goto", 1)]
+
+    summary = json.loads(runner.invoke(main.cli, ["stats", "--format", "json", "--command", "emoji"]).output)
+    assert [row["requests"] for row in summary] == [2]
+
+    table = runner.invoke(main.cli, ["stats", "--model", "gpt-4o"]).output
+    assert table.splitlines()[0].startswith("command")
+    assert "emoji" in table and "goto" in table
+
+    assert "smart_requests_total" in runner.invoke(main.cli, ["stats", "--format", "prometheus"]).output
+    spans = json.loads(runner.invoke(main.cli, ["stats", "--format", "otlp", "--command", "goto"]).output)
+    assert len(spans["resourceSpans"][0]["scopeSpans"][0]["spans"]) == 1
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+from llm.client import get_llm_client
+from llm.conversation import Conversation
+from llm.transport import pool_stats
+
+
+def test_slow_profile_is_hedged_on_the_pooled_clients(stub, configure_backup):
+    configure_backup(stub.base_url)
+    release = threading.Event()
+
+    def responder(body):
+        if body["model"] == "test-model":
+            release.wait(5)
+        return {"content": body["model"]}
+
+    stub.responder = responder
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("hello")
+    try:
+        response = get_llm_client().converse(conversation)
+    finally:
+        release.set()
+
+    assert response.choices[0].message.content == "backup-model"
+    assert conversation.messages[-1]["content"] == "backup-model"
+    # Both attempts went through the one sync pool, no event loop or async pool was made for them
+    [stats] = pool_stats()
+    assert not stats["async"]
+    assert stats["requests"] == 2
+
+
+def test_hedged_calls_work_inside_a_running_loop(stub, configure_backup):
+    configure_backup(stub.base_url)
+    stub.responder = lambda body: {"content": body["model"]}
+
+    async def main():
+        conversation = Conversation(model="test-model")
+        conversation.add_user_message("hello")
+        return get_llm_client().converse(conversation)
+
+    response = asyncio.run(main())
+    assert response.choices[0].message.content == "test-model"
+
+
+def test_failing_profile_hands_over_without_using_its_retry_budget(stub, configure_backup):
+    configure_backup(stub.base_url)
+    stub.responder = lambda body: {"content": body["model"]}
+    stub.settings.fail_first = 1
+    # A retry would have to wait this long
+    stub.settings.retry_after = 1.0
+    started = time.monotonic()
+    response = get_llm_client().get_chat_completion([{"role": "user", "content": "hello"}])
+
+    assert response.choices[0].message.content == "backup-model"
+    assert time.monotonic() - started < 0.5
+    assert stub.counts == {"requests": 2, "errors": 1}
+
+
+def test_failover_retries_give_the_profile_another_chance(stub, configure_backup):
+    configure_backup(stub.base_url, failover_retries=1)
+    stub.responder = lambda body: {"content": body["model"]}
+    stub.settings.fail_first = 1
+    stub.settings.retry_after = 0.2
+    started = time.monotonic()
+    response = get_llm_client().get_chat_completion([{"role": "user", "content": "hello"}])
+
+    # The primary answered on its retry, the backup was never asked
+    assert response.choices[0].message.content != "backup-model"
+    assert time.monotonic() - started >= 0.2
+    assert stub.counts == {"requests": 2, "errors": 1}
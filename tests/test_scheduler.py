@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from llm.client import get_llm_client
+from llm.ratelimit import RateLimiter
+from llm.scheduler import RequestScheduler, RetryPolicy, parse_duration, scheduler_stats
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_transient_errors_are_retried(stub):
+    stub.settings.fail_first = 2
+    response = get_llm_client().get_chat_completion(MESSAGES)
+
+    assert response.choices[0].message.content
+    assert stub.counts == {"requests": 3, "errors": 2}
+    [stats] = scheduler_stats()
+    assert stats["retries"] == 2
+
+
+def test_retry_after_is_waited_for(stub):
+    stub.settings.fail_first = 1
+    stub.settings.error_status = 429
+    stub.settings.retry_after = 0.3
+    started = time.monotonic()
+    get_llm_client().get_chat_completion(MESSAGES)
+
+    # The backoff alone would be at most retry_base_delay (0.01s)
+    assert time.monotonic() - started >= 0.3
+    assert stub.counts["requests"] == 2
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.settings.fail_first = 1
+    stub.settings.error_status = 400
+    with pytest.raises(Exception) as error:
+        get_llm_client().get_chat_completion(MESSAGES)
+
+    assert error.value.status_code == 400
+    assert stub.counts["requests"] == 1
+
+
+def test_retries_stop_at_max_retries(stub, configure):
+    configure(base_url=stub.base_url, retry_base_delay=0.01, max_retries=2)
+    stub.settings.error_rate = 1.0
+    with pytest.raises(Exception) as error:
+        get_llm_client().get_chat_completion(MESSAGES)
+
+    assert error.value.status_code == 503
+    assert stub.counts["requests"] == 3
+
+
+def test_rate_limit_headers_pace_requests():
+    scheduler = RequestScheduler("test", rpm=600, retry=RetryPolicy())
+    scheduler.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+
+    assert 1.9 <= scheduler._reserve(0) <= 2.0
+
+
+@pytest.mark.parametrize("value, seconds", [("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("0.5", 0.5)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+
+def test_parse_duration_of_nothing():
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_rate_limiter_allows_a_burst_then_paces():
+    limiter = RateLimiter(10, burst=2)
+
+    assert [limiter._reserve() for _ in range(2)] == [0.0, 0.0]
+    assert limiter._reserve() == pytest.approx(0.1, abs=0.01)
+    assert limiter._reserve() == pytest.approx(0.2, abs=0.01)
+    assert RateLimiter(None).acquire() == 0.0
+
+
+@pytest.mark.parametrize("client", ["openai", "portkey"])
+def test_only_the_scheduler_retries(stub, configure, client):
+    configure(base_url=stub.base_url, client=client, portkey_api_key="test", portkey_virtual_key="test", max_retries=0)
+    stub.settings.fail_first = 1
+    with pytest.raises(Exception) as error:
+        get_llm_client().get_chat_completion(MESSAGES)
+
+    assert error.value.status_code == 503
+    assert stub.counts["requests"] == 1
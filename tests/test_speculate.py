@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import main
+from llm.conversation import Conversation
+from llm.speculate import Speculator
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cancelled_speculation_is_not_an_error():
+    async def fetch(text):
+        raise asyncio.CancelledError()
+
+    speculator = Speculator(fetch, debounce=0.0)
+    try:
+        speculator.on_text_changed("list the files")
+        wait_for(lambda: speculator.fired)
+        assert speculator.result_for("list the files") is None
+    finally:
+        speculator.close()
+    assert speculator._loop.is_closed()
+
+
+def speculate(conversation, text):
+    speculator = main.start_speculation(conversation)
+    try:
+        speculator.debounce = 0.0
+        speculator.on_text_changed(text)
+        wait_for(lambda: speculator.fired)
+        return speculator.result_for(text), speculator.stats()
+    finally:
+        speculator.close()
+
+
+def test_speculation_proposes_through_the_tool_like_run(stub):
+    bodies = []
+    responder = stub.responder
+    stub.responder = lambda body: bodies.append(body) or responder(body)
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("Current directory: /tmp")
+    response, stats = speculate(conversation, "list the files")
+
+    assert [tool["function"]["name"] for tool in bodies[0]["tools"]] == ["open_app", "propose_command"]
+    assert stats["reused"] == 1
+    assert main.command_from_response(response) == "echo bench"
+
+
+def test_speculated_tool_calls_are_not_run(stub):
+    stub.responder = lambda body: {
+        "tool_calls": [
+            {"id": "call_app", "type": "function", "function": {"name": "open_app", "arguments": '{"app_name": "Notes"}'}}
+        ]
+    }
+    conversation = Conversation(model="test-model")
+    response, _ = speculate(conversation, "open my notes")
+
+    assert response is None
@@ -0,0 +1,66 @@
+import json
+
+import main
+from llm.store import ConversationStore, get_conversation_store
+
+
+def document(started_at, *texts, model="test-model"):
+    return {
+        "started_at": started_at,
+        "model": model,
+        "token_usage": 10,
+        "messages": [{"role": "user", "content": text} for text in texts],
+    }
+
+
+def test_search_finds_every_word_once_per_conversation(tmp_path):
+    store = ConversationStore(tmp_path / "conversations.db")
+    first = store.save(document("2026-01-01T10:00:00", "deploy the staging server", "staging server is down"))
+    second = store.save(document("2026-01-02T10:00:00", "the server logs"))
+    store.save(document("2026-01-03T10:00:00", "nothing relevant"))
+
+    results = store.search("staging server")
+    assert [result.id for result in results] == [first]
+    assert "server" in results[0].snippet
+    # Most recently saved first, one row per conversation
+    assert [result.id for result in store.search("server")] == [second, first]
+    assert store.search("   ") == []
+    # FTS5 syntax in a query is taken literally
+    assert store.search('server" OR "nothing') == []
+
+
+def test_load_returns_the_document_and_its_source(tmp_path):
+    store = ConversationStore(tmp_path / "conversations.db")
+    saved = document("2026-01-01T10:00:00", "hello", "again")
+    conversation_id = store.save(saved, source="/saved/a.json")
+
+    loaded = store.load(conversation_id)
+    assert loaded == {**saved, "source": "/saved/a.json"}
+    assert store.load(conversation_id + 1) is None
+
+
+def test_saving_a_resumed_conversation_replaces_it(home, monkeypatch):
+    save_dir = home / "Documents" / "Smart" / "Conversations"
+    save_dir.mkdir(parents=True)
+    # Not the name /save would pick for a new conversation
+    original = save_dir / "standup-notes.json"
+    original.write_text(json.dumps(document("2026-01-01T10:00:00.123456", "hello")), encoding="utf-8")
+    resumed = []
+    monkeypatch.setattr(main, "chat_session", lambda conversation, instruction, render: resumed.append(conversation))
+
+    store = main.load_conversation_store()
+    try:
+        [summary] = store.recent()
+        main.resume.callback(summary.id, main.RENDER_RAW)
+        [conversation] = resumed
+        conversation.add_user_message("one more thing")
+        main.handle_commands(conversation, "/save")
+        main.handle_commands(conversation, "/save")
+
+        assert list(save_dir.iterdir()) == [original]
+        assert len(json.loads(original.read_text())["messages"]) == 2
+        assert store.count() == 1
+        assert store.load(summary.id)["messages"][-1]["content"] == "one more thing"
+    finally:
+        store.close()
+        get_conversation_store.cache_clear()
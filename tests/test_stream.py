@@ -0,0 +1,89 @@
+import time
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+from llm.client import OpenAIAPIError, StreamAssembler, get_llm_client
+from llm.conversation import Conversation
+
+
+def chunk(delta=None, usage=None, **extra):
+    return ChatCompletionChunk.model_validate({
+        "id": "chunk",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test-model",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": None}] if delta is not None else [],
+        "usage": usage,
+        **extra,
+    })
+
+
+def test_streamed_text_and_usage_come_from_the_stub(stub):
+    stub.responder = lambda body: {"content": "one two three four five"}
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("count")
+    deltas = [delta.content for delta in get_llm_client().converse_stream(conversation)]
+
+    assert len(deltas) == 3
+    assert conversation.messages[-1] == {"role": "assistant", "content": "one two three four five "}
+    stats = conversation.get_metadata("last_stream_stats")
+    assert stats["completion_tokens"] == 5
+    # The usage of the final chunk, not a local count
+    assert conversation.get_token_usage() == stats["prompt_tokens"] + 5
+    assert stats["ttft"] is not None and stats["tokens_per_second"]
+
+
+def test_streamed_tool_call_from_the_stub(stub):
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("list files")
+    tools = [{"type": "function", "function": {"name": "propose_command", "parameters": {"type": "object"}}}]
+    assert list(get_llm_client().converse_stream(conversation, tools=tools)) == []
+
+    message = conversation.messages[-1]
+    assert message["role"] == "assistant" and message["content"] is None
+    assert message["tool_calls"] == [{
+        "id": "call_bench",
+        "type": "function",
+        "function": {"name": "propose_command", "arguments": '{"command": "echo bench"}'},
+    }]
+
+
+def test_tool_call_fragments_are_joined_by_index():
+    assembler = StreamAssembler(time.monotonic())
+    fragments = [
+        {"role": "assistant", "tool_calls": [
+            {"index": 0, "id": "call_a", "type": "function", "function": {"name": "open_", "arguments": ""}},
+        ]},
+        {"tool_calls": [{"index": 1, "id": "call_b", "function": {"name": "propose_command", "arguments": '{"co'}}]},
+        {"tool_calls": [{"index": 0, "function": {"name": "app", "arguments": '{"app_name": "Notes"}'}}]},
+        {"tool_calls": [{"index": 1, "function": {"arguments": 'mmand": "ls"}'}}]},
+    ]
+    for delta in fragments:
+        assert assembler.feed(chunk(delta)) is None
+    assembler.feed(chunk(usage={"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}))
+    conversation = Conversation(model="test-model")
+    assembler.finish(conversation)
+
+    calls = conversation.messages[-1]["tool_calls"]
+    assert [call["id"] for call in calls] == ["call_a", "call_b"]
+    assert calls[0]["function"] == {"name": "open_app", "arguments": '{"app_name": "Notes"}'}
+    assert calls[1]["function"] == {"name": "propose_command", "arguments": '{"command": "ls"}'}
+    assert conversation.get_token_usage() == 10
+
+
+def test_stream_without_usage_is_estimated():
+    assembler = StreamAssembler(time.monotonic())
+    assembler.feed(chunk({"role": "assistant", "content": "hello there"}))
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("hi")
+    assembler.finish(conversation)
+
+    assert assembler.stats()["completion_tokens"] is None
+    assert conversation.get_token_usage() > 0
+
+
+def test_error_chunks_raise():
+    assembler = StreamAssembler(time.monotonic())
+    with pytest.raises(OpenAIAPIError, match="overloaded"):
+        assembler.feed(chunk(error={"message": "overloaded"}))
@@ -0,0 +1,101 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import main
+from llm import summarize
+from llm.summarize import TextSource, map_reduce
+
+
+class FakeClient:
+    """Answers chunk summaries with the chunk's first line and reduces by joining the parts."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_chat_completion(self, messages, model=None):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.requests.append(prompt)
+        time.sleep(self.delay)
+        if "Chunk " in prompt:
+            content = prompt.split(":\n\n", 1)[1].splitlines()[0]
+        else:
+            content = " ".join(
+                line for line in prompt.splitlines()
+                if line and not line.startswith(("Part ", "User question:"))
+            )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def write_lines(path, count):
+    path.write_text("".join(f"line {i}\n" for i in range(count)), encoding="utf-8")
+    return str(path)
+
+
+def test_chunks_are_read_as_workers_free_up(tmp_path, monkeypatch):
+    read = 0
+    chunks = summarize.token_bounded_chunks
+
+    def counting_chunks(path, token_budget):
+        nonlocal read
+        for chunk in chunks(path, token_budget):
+            read += 1
+            yield chunk
+
+    monkeypatch.setattr(summarize, "token_bounded_chunks", counting_chunks)
+    ahead = []
+
+    def progress(done, total):
+        ahead.append(read - done)
+
+    client = FakeClient(delay=0.005)
+    path = write_lines(tmp_path / "big.log", 400)
+    map_reduce(client, [path], token_budget=10, concurrency=2, progress=progress)
+
+    assert read > 50
+    # Never more than the queued window of chunks waiting for a worker
+    assert max(ahead) <= 4
+
+
+def test_summaries_are_reduced_in_file_order(tmp_path):
+    first = write_lines(tmp_path / "a.log", 3)
+    client = FakeClient()
+
+    answer = map_reduce(
+        client, [first, TextSource("b.log?grep=x", "x one\nx two")], token_budget=1000, question="what?",
+        concurrency=4,
+    )
+
+    assert answer == "line 0 x one"
+    assert all(request.startswith("User question: what?") for request in client.requests)
+
+
+def test_no_chunks_make_no_requests(tmp_path):
+    empty = tmp_path / "empty.log"
+    empty.write_text("", encoding="utf-8")
+    client = FakeClient()
+
+    assert map_reduce(client, [str(empty), TextSource("nothing", "")], token_budget=100) == ""
+    assert client.requests == []
+
+
+def test_instructions_skip_binaries_and_keep_file_options(tmp_path, monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(main, "get_llm_client", lambda: client)
+    log = write_lines(tmp_path / "app.log", 50)
+    binary = tmp_path / "photo.png"
+    binary.write_bytes(b"\x89PNG\r\n\x1a\n\0\0\0")
+    conversation = main.Conversation(model="test-model")
+
+    main.map_reduce_instructions(
+        conversation, [f"file://{log}?grep=line 4", f"file://{binary}", "what is logged?"]
+    )
+
+    chunk_requests = [request for request in client.requests if "Chunk " in request]
+    assert len(chunk_requests) == 1
+    assert "line 4" in chunk_requests[0] and "line 5" not in chunk_requests[0]
+    assert all("PNG" not in request for request in client.requests)
+    assert conversation.messages[0]["content"] == f"what is logged?\n\nFiles: {log}"
@@ -0,0 +1,63 @@
+import json
+
+from llm.tools import ANSWER_RESULT, ToolCall, ToolExecutor, build_command_registry, converse_with_tools
+from llm.conversation import Conversation
+
+
+def open_app_call(app_name="Notes", call_id="call_app"):
+    return ToolCall(call_id, "open_app", json.dumps({"app_name": app_name}))
+
+
+def test_tools_with_side_effects_need_confirmation(monkeypatch):
+    ran = []
+    monkeypatch.setattr("llm.tools.run_shell_command", lambda command, timeout: ran.append(command) or "ok")
+    asked = []
+    executor = ToolExecutor(build_command_registry(), confirm=lambda command: asked.append(command))
+    [result] = executor.execute([open_app_call()])
+
+    assert asked == ["open -a Notes"]
+    assert not result.ok and "declined" in json.loads(result.content)["error"]
+    assert ran == []
+
+
+def test_confirmed_commands_run_as_edited(monkeypatch):
+    ran = []
+    monkeypatch.setattr("llm.tools.run_shell_command", lambda command, timeout: ran.append(command) or "ok")
+    executor = ToolExecutor(build_command_registry(), confirm=lambda command: command + " --new")
+    [result] = executor.execute([open_app_call("Text Edit")])
+
+    assert result.ok
+    assert ran == ["open -a 'Text Edit' --new"]
+
+
+def test_tools_without_a_confirm_prompt_never_run(monkeypatch):
+    monkeypatch.setattr("llm.tools.run_shell_command", lambda command, timeout: 1 / 0)
+    [result] = ToolExecutor(build_command_registry()).execute([open_app_call()])
+
+    assert not result.ok
+
+
+def test_run_confirms_tool_calls_before_proposing(stub, monkeypatch):
+    import main
+
+    replies = iter([
+        {"tool_calls": [open_app_call().to_dict()]},
+        {"tool_calls": [ToolCall("call_cmd", "propose_command", '{"command": "ls"}').to_dict()]},
+    ])
+    stub.responder = lambda body: next(replies)
+    prompts = []
+    monkeypatch.setattr(main, "user_input", lambda hint, default="": prompts.append(default) or "~")
+    monkeypatch.setattr("llm.tools.run_shell_command", lambda command, timeout: 1 / 0)
+    main.get_tool_executor.cache_clear()
+    conversation = Conversation(model="test-model")
+    conversation.add_user_message("User follows up: open notes")
+    try:
+        response = converse_with_tools(main.get_llm_client(), conversation, main.get_tool_executor())
+    finally:
+        main.get_tool_executor.cache_clear()
+
+    assert prompts == ["open -a Notes"]
+    assert main.command_from_response(response) == "ls"
+    tool_results = [message for message in conversation.messages if message["role"] == "tool"]
+    assert "declined" in tool_results[0]["content"]
+    assert tool_results[1]["content"] == ANSWER_RESULT
@@ -0,0 +1,20 @@
+import importlib.util
+
+from llm.transport import TransportSettings, close_http_clients, get_http_client, pool_stats
+
+
+def test_requests_share_pooled_connections(stub):
+    settings = TransportSettings(http2=True)
+    body = {"model": "test-model", "messages": [{"role": "user", "content": "hi"}]}
+    try:
+        for _ in range(3):
+            response = get_http_client(stub.base_url, settings).post(f"{stub.base_url}/chat/completions", json=body)
+            assert response.status_code == 200
+        [stats] = pool_stats()
+    finally:
+        close_http_clients()
+
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    # Without the http2 extra the pool falls back to HTTP/1.1
+    assert stats["http2"] == (importlib.util.find_spec("h2") is not None)
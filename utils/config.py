@@ -17,6 +17,9 @@ class SmartConfig:
             self.profiles[profile] = profile_dict
         self.apply_profile(SmartConfig.current_profile)
 
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
     @staticmethod
     def get_current_profile() -> str:
         return SmartConfig.current_profile
@@ -27,6 +30,15 @@ class SmartConfig:
             self.__apply_profile(profile, applied_profiles=set([]))
         SmartConfig.current_profile = profile
 
+    def for_profile(self, profile: str) -> 'SmartConfig':
+        """A copy of this config with `profile` applied, the current profile is left alone."""
+        config = SmartConfig.__new__(SmartConfig)
+        config.profiles = self.profiles
+        config.__apply_profile(DEFAULT_PROFILE, applied_profiles=set([]))
+        if profile != DEFAULT_PROFILE:
+            config.__apply_profile(profile, applied_profiles=set([]))
+        return config
+
     def __apply_profile(self, profile: str, applied_profiles):
         if profile not in self.profiles:
             raise ValueError(f"Profile {profile} not found")
@@ -39,6 +51,21 @@ class SmartConfig:
             'portkey_api_key', 'portkey_virtual_key',
             'llm_token',
             'telegram_token', 'telegram_chat_id', 'telegram_important_chat_id',
+            'cache_ttl', 'cache_max_entries', 'cache_max_bytes', 'cache_disabled_commands',
+            'context_max_tokens', 'context_keep_turns', 'context_strategy',
+            'image_cache_max_bytes',
+            'large_file_bytes', 'chunk_tokens', 'map_concurrency', 'map_rps',
+            'kb_top_k',
+            'batch_concurrency', 'batch_rps',
+            'rpm_limit', 'tpm_limit',
+            'fallback_profiles', 'hedge_after', 'failover_retries',
+            'speculate_debounce',
+            'fast_path_threshold',
+            'metrics_disabled', 'metrics_max_bytes',
+            'journal_max_age_days', 'journal_max_files',
+            'max_retries', 'retry_base_delay', 'retry_max_delay', 'retry_deadline',
+            'http2', 'connect_timeout', 'read_timeout',
+            'max_connections', 'max_keepalive_connections', 'keepalive_expiry',
         ]
         for key, value in self.profiles[profile].items():
             if key in attributes:
@@ -3,8 +3,9 @@ from __future__ import annotations
 from enum import Enum
 from os import environ
 from pathlib import Path
-import base64
-import mimetypes
+
+from utils.images import prepare_image
+from utils.large_file import LargeFile, load_text_file, split_file_options
 
 
 class ContentLoadType(Enum):
@@ -53,43 +54,30 @@ def _load_image_file(path: str) -> dict:
     Returns:
         A dictionary containing the image data in OpenAI API format
     """
-    mime_type, _ = mimetypes.guess_type(path)
-    if not mime_type or not mime_type.startswith("image/"):
-        return None
-
-    # Read image file and encode as base64
-    with open(path, "rb") as img_file:
-        base64_image = base64.b64encode(img_file.read()).decode("utf-8")
-        # Format exactly as OpenAI API expects
-        return {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{mime_type};base64,{base64_image}",
-                "detail":"auto"
-            },
-        }
+    return prepare_image(path)
 
 
 def maybe_load_content(
         file_path_or_str: str | None,
-) -> tuple[ContentLoadType, str | dict]:
+) -> tuple[ContentLoadType, str | dict | LargeFile]:
     if not file_path_or_str:
         return ContentLoadType.NORMAL, ""
 
     # Handle preload URLs
     if file_path_or_str.startswith("preload:file://"):
-        path = file_path_or_str[15:]  # Remove "preload:file://" prefix
+        # Remove "preload:file://" prefix, options like ?tail=100 select an excerpt
+        path, options = split_file_options(file_path_or_str[15:])
         image_content = _load_image_file(path)
         if image_content:
             return ContentLoadType.PRELOAD, image_content
-        return ContentLoadType.PRELOAD, read_file(path)
+        return ContentLoadType.PRELOAD, load_text_file(path, options)
 
     # Handle regular file URLs
     if file_path_or_str.startswith("file://"):
-        path = file_path_or_str[7:]  # Remove "file://" prefix
+        path, options = split_file_options(file_path_or_str[7:])  # Remove "file://" prefix
         image_content = _load_image_file(path)
         if image_content:
             return ContentLoadType.IMAGE, image_content
-        return ContentLoadType.FILE, read_file(path)
+        return ContentLoadType.FILE, load_text_file(path, options)
 
     return ContentLoadType.NORMAL, file_path_or_str
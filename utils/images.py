@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+
+from utils.config import read_config
+
+logger = logging.getLogger(__name__)
+
+# Vision models fit images into 2048x2048 and then scale the shortest side to
+# 768, anything above that is sent for nothing
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+IMAGE_REF_PREFIX = "smart-image://"
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Index entries only map a file to a content hash, they are kept by count
+MAX_INDEX_ENTRIES = 10000
+MISSING_IMAGE_TEXT = "[image no longer in the cache]"
+# Images remembered per process, the daemon would otherwise keep every image it ever saw
+MAX_MEMORY_IMAGES = 64
+
+
+class _LruDict(OrderedDict):
+    """Dict keeping only the `max_entries` most recently used keys."""
+
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+# data URL -> content hash / dimensions for images prepared in this process
+_refs: Dict[str, str] = _LruDict(MAX_MEMORY_IMAGES)
+_dimensions: Dict[str, tuple] = _LruDict(MAX_MEMORY_IMAGES)
+_prepared: Dict[str, dict] = _LruDict(MAX_MEMORY_IMAGES)
+_warned_no_backend = False
+
+
+def get_image_cache_dir() -> Path:
+    return Path(os.getenv("HOME")) / ".smart" / "cache" / "images"
+
+
+def target_size(width: int, height: int) -> tuple:
+    scale = min(1.0, MAX_LONG_SIDE / max(width, height), MAX_SHORT_SIDE / max(1, min(width, height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _downscale_with_pillow(data: bytes, mime_type: str):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        size = target_size(*image.size)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(output, format="PNG", optimize=True)
+            mime_type = "image/png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            mime_type = "image/jpeg"
+        return mime_type, output.getvalue(), size
+
+
+def _downscale_with_sips(path: str, mime_type: str):
+    # macOS ships sips, which can only bound the longest side
+    width, height = _sips_size(path)
+    size = target_size(width, height)
+    if size == (width, height):
+        return None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = Path(tmp_dir) / "image.jpg"
+        subprocess.run(
+            ["sips", "-s", "format", "jpeg", "-Z", str(max(size)), path, "--out", str(output_path)],
+            check=True,
+            capture_output=True,
+        )
+        return "image/jpeg", output_path.read_bytes(), size
+
+
+def _sips_size(path: str) -> tuple:
+    output = subprocess.run(
+        ["sips", "-g", "pixelWidth", "-g", "pixelHeight", path],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    values = {}
+    for line in output.splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            values[key.strip()] = value.strip()
+    return int(values["pixelWidth"]), int(values["pixelHeight"])
+
+
+def _downscale(path: str, data: bytes, mime_type: str):
+    global _warned_no_backend
+    try:
+        return _downscale_with_pillow(data, mime_type)
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to downscale {path}: {e}")
+        return mime_type, data, None
+    if shutil.which("sips"):
+        try:
+            result = _downscale_with_sips(path, mime_type)
+            if result:
+                return result
+        except (subprocess.CalledProcessError, KeyError, ValueError) as e:
+            logger.warning(f"Failed to downscale {path}: {e}")
+    elif not _warned_no_backend:
+        _warned_no_backend = True
+        logger.warning("Neither Pillow nor sips is available, images are sent at full size")
+    return mime_type, data, None
+
+
+def _read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, value) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _evict_lru(directory: Path, max_entries: int | None = None, max_bytes: int | None = None) -> None:
+    entries = []
+    for path in directory.glob("*.json"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    while entries and (
+            (max_entries is not None and len(entries) > max_entries)
+            or (max_bytes is not None and total_bytes > max_bytes)
+    ):
+        _, size, path = entries.pop(0)
+        path.unlink(missing_ok=True)
+        total_bytes -= size
+
+
+def evict_image_cache() -> None:
+    """Drop the least recently used images beyond `image_cache_max_bytes`."""
+    cache_dir = get_image_cache_dir()
+    max_bytes = int(read_config().get("image_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES))
+    _evict_lru(cache_dir, max_bytes=max_bytes)
+    _evict_lru(cache_dir / "index", max_entries=MAX_INDEX_ENTRIES)
+
+
+def prepare_image(path: str) -> dict | None:
+    """Load an image as an OpenAI image block, downscaled and cached.
+
+    Encoded images are cached by content hash; a small index keyed on path,
+    mtime and size lets unchanged files skip reading and hashing entirely.
+    Entries are bumped on use and the least recently used are evicted once
+    the cache outgrows `image_cache_max_bytes`.
+    """
+    mime_type, _ = mimetypes.guess_type(path)
+    if not mime_type or not mime_type.startswith("image/"):
+        return None
+
+    stat = os.stat(path)
+    file_key = hashlib.sha256(
+        f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8")
+    ).hexdigest()
+    if file_key in _prepared:
+        return _prepared[file_key]
+
+    cache_dir = get_image_cache_dir()
+    index_entry = _read_json(cache_dir / "index" / f"{file_key}.json")
+    entry = None
+    if index_entry:
+        entry = _read_json(cache_dir / f"{index_entry['content_hash']}.json")
+        content_hash = index_entry["content_hash"]
+        if entry is not None:
+            _touch(cache_dir / f"{content_hash}.json")
+    if entry is None:
+        with open(path, "rb") as img_file:
+            data = img_file.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        entry = _read_json(cache_dir / f"{content_hash}.json")
+        if entry is None:
+            encoded_mime, encoded, size = _downscale(path, data, mime_type)
+            entry = {
+                "mime_type": encoded_mime,
+                "data": base64.b64encode(encoded).decode("utf-8"),
+                "size": size,
+            }
+            _write_json(cache_dir / f"{content_hash}.json", entry)
+        else:
+            _touch(cache_dir / f"{content_hash}.json")
+        _write_json(cache_dir / "index" / f"{file_key}.json", {"content_hash": content_hash})
+        evict_image_cache()
+
+    url = f"data:{entry['mime_type']};base64,{entry['data']}"
+    _refs[url] = content_hash
+    if entry.get("size"):
+        _dimensions[url] = tuple(entry["size"])
+    # Format exactly as OpenAI API expects
+    block = {"type": "image_url", "image_url": {"url": url, "detail": "auto"}}
+    _prepared[file_key] = block
+    return block
+
+
+def image_tokens(block: dict) -> int | None:
+    """Token cost of an image block if its dimensions are known."""
+    image_url = block.get("image_url", {})
+    if image_url.get("detail") == "low":
+        return 85
+    size = _dimensions.get(image_url.get("url"))
+    if not size:
+        return None
+    width, height = target_size(*size)
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def persistable_message(message: Dict) -> Dict:
+    """Copy of `message` with prepared images replaced by cache references."""
+    content = message.get("content")
+    if not isinstance(content, list):
+        return dict(message)
+    blocks = []
+    for block in content:
+        if isinstance(block, dict) and block.get("type") == "image_url":
+            url = block.get("image_url", {}).get("url")
+            if url in _refs:
+                block = {
+                    "type": "image_url",
+                    "image_url": {**block["image_url"], "url": IMAGE_REF_PREFIX + _refs[url]},
+                }
+        blocks.append(block)
+    return {**message, "content": blocks}
+
+
+def resolve_message(message: Dict) -> Dict:
+    """Inverse of `persistable_message`, loading referenced images from the cache.
+
+    Images evicted from the cache since are replaced by a text placeholder.
+    """
+    content = message.get("content")
+    if not isinstance(content, list):
+        return message
+    blocks = []
+    for block in content:
+        if isinstance(block, dict) and block.get("type") == "image_url":
+            url = block.get("image_url", {}).get("url", "")
+            if url.startswith(IMAGE_REF_PREFIX):
+                content_hash = url[len(IMAGE_REF_PREFIX):]
+                entry = _read_json(get_image_cache_dir() / f"{content_hash}.json")
+                if entry:
+                    _touch(get_image_cache_dir() / f"{content_hash}.json")
+                    url = f"data:{entry['mime_type']};base64,{entry['data']}"
+                    _refs[url] = content_hash
+                    if entry.get("size"):
+                        _dimensions[url] = tuple(entry["size"])
+                    block = {"type": "image_url", "image_url": {**block["image_url"], "url": url}}
+                else:
+                    block = {"type": "text", "text": MISSING_IMAGE_TEXT}
+        blocks.append(block)
+    return {**message, "content": blocks}
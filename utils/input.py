@@ -1,11 +1,18 @@
 import sys
 
-from prompt_toolkit import prompt
+from utils.lazy import lazy_import
 
+prompt_toolkit = lazy_import("prompt_toolkit")
 
-def user_input(hint, default=""):
+
+def user_input(hint, default="", on_change=None):
     if sys.stdin.isatty():
-        final_value = prompt(hint, default=default).strip()
+        if on_change:
+            session = prompt_toolkit.PromptSession()
+            session.default_buffer.on_text_changed += lambda buffer: on_change(buffer.text)
+            final_value = session.prompt(hint, default=default).strip()
+        else:
+            final_value = prompt_toolkit.prompt(hint, default=default).strip()
     else:
         # if input is not a terminal
         default_output= f' (defaults to  `{default}`)' if default else ""
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import logging
+import mmap
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator
+from urllib.parse import parse_qs
+
+from utils.config import read_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LARGE_FILE_BYTES = 1024 * 1024
+DEFAULT_CHUNK_TOKENS = 4000
+# Rough size of a token, used to size reads before exact counting
+BYTES_PER_TOKEN = 4
+BINARY_SNIFF_BYTES = 8192
+MAX_GREP_MATCHES = 2000
+
+OPTION_HEAD = "head"
+OPTION_TAIL = "tail"
+OPTION_GREP = "grep"
+OPTION_SUMMARIZE = "summarize"
+LINE_COUNT_OPTIONS = (OPTION_HEAD, OPTION_TAIL)
+
+
+@dataclass
+class LargeFile:
+    """A file too large to inline, to be summarized chunk by chunk."""
+
+    path: str
+    size: int
+    options: Dict[str, str] = field(default_factory=dict)
+
+
+def get_large_file_bytes() -> int:
+    return int(read_config().get("large_file_bytes", DEFAULT_LARGE_FILE_BYTES))
+
+
+def get_chunk_tokens() -> int:
+    return int(read_config().get("chunk_tokens", DEFAULT_CHUNK_TOKENS))
+
+
+def split_file_options(spec: str) -> tuple[str, Dict[str, str]]:
+    """Split `path?tail=200` into the path and its options.
+
+    A `?` is only treated as the start of options when the whole spec is not
+    an existing file, so paths that contain `?` keep working. `head` and `tail`
+    without a line count are dropped, the file is then read as without them.
+    """
+    if "?" not in spec or Path(spec).exists():
+        return spec, {}
+    path, query = spec.rsplit("?", 1)
+    options = {key: values[-1] for key, values in parse_qs(query, keep_blank_values=True).items()}
+    for key in LINE_COUNT_OPTIONS:
+        if key in options and not options[key].strip().isdecimal():
+            logger.warning(f"Ignoring ?{key}={options[key]} for {path}, expected a number of lines")
+            del options[key]
+    return path, options
+
+
+def is_binary(path: str) -> bool:
+    with open(path, "rb") as f:
+        return b"\0" in f.read(BINARY_SNIFF_BYTES)
+
+
+def head_lines(path: str, count: int) -> str:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = 0
+        for _ in range(count):
+            end = mm.find(b"\n", end)
+            if end < 0:
+                end = len(mm)
+                break
+            end += 1
+        return mm[:end].decode("utf-8", errors="replace")
+
+
+def tail_lines(path: str, count: int) -> str:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = len(mm)
+        # A trailing newline does not start another line
+        if start and mm[start - 1:start] == b"\n":
+            start -= 1
+        for _ in range(count):
+            start = mm.rfind(b"\n", 0, start)
+            if start < 0:
+                break
+        return mm[start + 1:].decode("utf-8", errors="replace")
+
+
+def grep_lines(path: str, pattern: str, max_matches: int = MAX_GREP_MATCHES) -> str:
+    regex = re.compile(pattern.encode("utf-8"))
+    matches = []
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, start=1):
+            if regex.search(line):
+                matches.append(f"{number}: {line.decode('utf-8', errors='replace').rstrip()}")
+                if len(matches) >= max_matches:
+                    break
+    return "\n".join(matches)
+
+
+def iter_chunks(path: str, token_budget: int) -> Iterator[str]:
+    """Yield pieces of the file of roughly `token_budget` tokens, split at line ends."""
+    chunk_bytes = max(1, token_budget * BYTES_PER_TOKEN)
+    if Path(path).stat().st_size == 0:
+        # Empty files cannot be mapped
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = min(len(mm), start + chunk_bytes)
+            if end < len(mm):
+                newline = mm.rfind(b"\n", start, end)
+                if newline > start:
+                    end = newline + 1
+            yield mm[start:end].decode("utf-8", errors="replace")
+            start = end
+
+
+def load_text_file(path: str, options: Dict[str, str]) -> str | LargeFile:
+    """Read a text file, or the excerpt of it selected by `options`.
+
+    Files above the large file threshold are never read whole: without options
+    the tail that fits in one chunk is returned, and `summarize` hands the file
+    back as a `LargeFile` for chunked summarization.
+    """
+    file_path = Path(path)
+    if not file_path.exists():
+        return ""
+    size = file_path.stat().st_size
+    if size == 0:
+        return ""
+    if is_binary(path):
+        return f"[Binary file {path} ({size} bytes) was not included]"
+
+    if OPTION_SUMMARIZE in options:
+        return LargeFile(path=path, size=size, options=options)
+    if OPTION_HEAD in options:
+        return f"First {options[OPTION_HEAD]} lines of {path}:\n\n" + head_lines(path, int(options[OPTION_HEAD]))
+    if OPTION_TAIL in options:
+        return f"Last {options[OPTION_TAIL]} lines of {path}:\n\n" + tail_lines(path, int(options[OPTION_TAIL]))
+    if OPTION_GREP in options:
+        return f"Lines of {path} matching `{options[OPTION_GREP]}`:\n\n" + grep_lines(path, options[OPTION_GREP])
+
+    if size <= get_large_file_bytes():
+        return file_path.read_text(errors="replace")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = max(0, len(mm) - get_chunk_tokens() * BYTES_PER_TOKEN)
+        # Start at a line boundary
+        newline = mm.find(b"\n", start)
+        if 0 <= newline < len(mm) - 1:
+            start = newline + 1
+        tail = mm[start:].decode("utf-8", errors="replace")
+    return (
+        f"{path} is {size} bytes, only its end is included. "
+        f"Use ?head=N, ?tail=N, ?grep=PATTERN or ?summarize to choose what to send.\n\n{tail}"
+    )
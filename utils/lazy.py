@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Callable
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return a module whose body only executes on first attribute access.
+
+    Already imported modules are returned as is, so calling this for something
+    that was loaded eagerly elsewhere costs nothing.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class LazyObject:
+    """Proxy that builds the wrapped object with `factory` on first use."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get_instance(self):
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, item):
+        return getattr(self._get_instance(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self._get_instance(), key, value)
+
+
+def unwrap(obj):
+    """Return the real object behind a `LazyObject`, e.g. for APIs using dunder methods."""
+    if isinstance(obj, LazyObject):
+        return obj._get_instance()
+    return obj
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import re
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+FENCE_PREFIXES = ("```", "~~~")
+LIST_ITEM = re.compile(r"\s*([-*+]|\d+[.)])\s")
+
+BLOCK_TEXT = "text"
+BLOCK_FENCE = "fence"
+BLOCK_LIST = "list"
+BLOCK_QUOTE = "quote"
+
+
+def block_kind(line: str) -> str:
+    stripped = line.strip()
+    if stripped.startswith(FENCE_PREFIXES):
+        return BLOCK_FENCE
+    if stripped.startswith(">"):
+        return BLOCK_QUOTE
+    if LIST_ITEM.match(line):
+        return BLOCK_LIST
+    return BLOCK_TEXT
+
+
+def continues_block(kind: str | None, line: str) -> bool:
+    """Whether `line`, following a blank line, still belongs to a block of `kind`."""
+    if kind == BLOCK_LIST:
+        # Loose lists separate their items, and the paragraphs within an item, by blank lines
+        return bool(LIST_ITEM.match(line)) or line[:1].isspace()
+    if kind == BLOCK_QUOTE:
+        return line.lstrip().startswith(">")
+    return False
+
+
+class _LiveTail:
+    """Renders the unfinished block only when Live refreshes, not per chunk."""
+
+    def __init__(self, stream: MarkdownStream):
+        self.stream = stream
+
+    def __rich_console__(self, console, options):
+        yield Markdown(self.stream.live_text())
+
+
+class MarkdownStream:
+    """Incrementally renders streamed Markdown.
+
+    Completed blocks (paragraphs, lists, closed code fences) are printed once
+    and never redrawn. Lists and blockquotes may go on after a blank line, so
+    they are only printed once a line shows they ended. Only the trailing, unfinished block is shown in a Live
+    region, cropped to `max_live_lines`, so the work per chunk does not grow
+    with the length of the answer.
+    """
+
+    def __init__(self, console: Console, max_live_lines: int = 40, refresh_per_second: int = 8):
+        self.console = console
+        self.max_live_lines = max_live_lines
+        self.refresh_per_second = refresh_per_second
+        self.buffer = ""
+        self._scan_pos = 0
+        self._in_fence = False
+        self._fence_line = ""
+        # Kind of the block being buffered, and where it ends if the blank line before the next line ended it
+        self._block = None
+        self._blank_end = 0
+        self._live = None
+
+    def __enter__(self) -> MarkdownStream:
+        self._live = Live(
+            _LiveTail(self),
+            console=self.console,
+            refresh_per_second=self.refresh_per_second,
+            transient=True,
+        )
+        self._live.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._live.__exit__(exc_type, exc_val, exc_tb)
+        self._live = None
+        if self.buffer.strip():
+            self.console.print(Markdown(self.buffer))
+        self.buffer = ""
+
+    def update(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self.buffer += chunk
+        boundary = self._scan()
+        if boundary:
+            completed = self.buffer[:boundary]
+            self.buffer = self.buffer[boundary:]
+            self._scan_pos -= boundary
+            if self._blank_end:
+                self._blank_end -= boundary
+            if completed.strip():
+                self._live.console.print(Markdown(completed))
+
+    def _scan(self) -> int:
+        # Only lines that arrived since the last call are inspected
+        boundary = 0
+        while True:
+            end = self.buffer.find("\n", self._scan_pos)
+            if end < 0:
+                return boundary
+            raw_line = self.buffer[self._scan_pos:end]
+            line = raw_line.strip()
+            self._scan_pos = end + 1
+            if self._in_fence:
+                if line.startswith(FENCE_PREFIXES):
+                    self._in_fence = False
+                    # Fences nested in a list item end with the list, not here
+                    if self._block == BLOCK_FENCE:
+                        boundary = self._scan_pos
+                        self._block = None
+                continue
+            if not line:
+                if self._block in (BLOCK_LIST, BLOCK_QUOTE):
+                    self._blank_end = self._scan_pos
+                elif self._block:
+                    boundary = self._scan_pos
+                    self._block = None
+                continue
+            if self._blank_end:
+                if not continues_block(self._block, raw_line):
+                    boundary = self._blank_end
+                    self._block = None
+                self._blank_end = 0
+            if self._block is None:
+                self._block = block_kind(raw_line)
+            elif self._block == BLOCK_TEXT and LIST_ITEM.match(raw_line):
+                # A list may start right below a paragraph
+                self._block = BLOCK_LIST
+            if line.startswith(FENCE_PREFIXES):
+                self._in_fence = True
+                self._fence_line = line
+
+    def live_text(self) -> str:
+        # A trailing newline does not start another line worth showing
+        start = len(self.buffer) - self.buffer.endswith("\n")
+        for _ in range(self.max_live_lines):
+            start = self.buffer.rfind("\n", 0, start)
+            if start < 0:
+                return self.buffer
+        tail = self.buffer[start + 1:]
+        if self._in_fence:
+            # Keep the opening fence so the cropped code still renders as code
+            tail = f"{self._fence_line}\n{tail}"
+        return tail